@@ -1,16 +1,33 @@
+import time
+_START_TIME = time.perf_counter()  # 模块开始导入的时间，用于测量启动耗时
 import sys
 import os
 import json
 import datetime
+import hashlib
+import re
+import bisect
+import threading
+import mmap
+import stat
+import sqlite3
+from contextlib import closing, contextmanager
+import codecs
+import io
+from collections import OrderedDict, defaultdict, deque
+from itertools import repeat
+from html import escape as html_escape, unescape as html_unescape
 from PySide6.QtWidgets import (QApplication, QMainWindow, QTabWidget, QWidget, QVBoxLayout, 
                             QHBoxLayout, QPushButton, QLabel, QListWidget, QListWidgetItem,
                             QSplitter, QTextEdit, QTreeWidget, QTreeWidgetItem, QMenuBar, 
-                            QMenu, QDialog, QFormLayout, QMessageBox, QFileDialog,
-                            QToolBar, QInputDialog, QFrame, QGridLayout)
-from PySide6.QtGui import QAction, QFont, QIcon, QTextCursor, QDesktopServices
-from PySide6.QtCore import Qt, QSize, QUrl, QFile, QIODevice, QTextStream, QDateTime
-import shutil
-import markdown
+                            QPlainTextEdit, QPlainTextDocumentLayout, QMenu, QDialog, QFormLayout, QMessageBox, QFileDialog,
+                            QToolBar, QInputDialog, QFrame, QGridLayout, QProgressBar,
+                            QDockWidget, QLineEdit, QTreeView)
+from PySide6.QtGui import (QAction, QFont, QIcon, QTextCursor, QDesktopServices, QTextDocument,
+                           QSyntaxHighlighter, QTextCharFormat, QColor, QImage, QImageReader)
+from PySide6.QtCore import (Qt, QSize, QUrl, QFile, QIODevice, QTextStream, QDateTime, QPoint,
+                            QObject, QTimer, Signal, QRunnable, QThreadPool, QCoreApplication,
+                            QFileSystemWatcher, QAbstractItemModel, QModelIndex, QEvent, qVersion)
 
 # 软件基本信息
 APP_NAME = "NemoMark"   
@@ -20,13 +37,2281 @@ APP_WEBSITE = "https://example.com/marknote"
 GITEE_REPO = "https://gitee.com/kisina/nemo-mark"
 QQ_GROUP = "https://qm.qq.com/q/uOvY1UZFqo"
 
+# 预览渲染调度参数（毫秒），可在 settings.json 中覆盖
+PREVIEW_RENDER_DELAY_MS = 150       # 停止输入多久后渲染
+PREVIEW_MAX_STALENESS_MS = 1000     # 连续输入时预览最多落后多久
+BLOCK_CACHE_SIZE = 4096             # 每个编辑器缓存的块级HTML数量
+PREVIEW_PATCH_MAX_BLOCKS = 200      # 一次变化超过这么多块时整篇更新预览
+LARGE_FILE_THRESHOLD_MB = 16        # 超过这个大小的文件使用大文件模式打开
+WATCH_DEBOUNCE_MS = 300            # 文件变化停止多久后统一处理
+WATCH_MAX_DELAY_MS = 2000          # 持续变化时最多延迟多久处理一次
+DIRECTORY_LIST_BATCH_SIZE = 2000   # 目录树每轮事件循环插入的条目数
+LARGE_FILE_CHUNK_SIZE = 256 * 1024   # 大文件模式每次解码写入的字节数，过大会长时间占用 GIL
+EXPORT_SERIAL_LIMIT = 16           # 导出时需要渲染的文件不超过这个数量就不启动进程池
+TAB_HIBERNATE_IDLE_MINUTES = 30    # 后台标签页多久未切换到就休眠
+TAB_MEMORY_BUDGET_MB = 1024        # 所有标签页估计占用的内存超过这个值时，休眠最久未使用的后台标签页
+TAB_HIBERNATE_CHECK_MS = 60 * 1000 # 检查休眠策略的间隔
+EDITOR_BLOCK_BYTES = 200           # 估计内存用：纯文本文档每个文本块的排版等开销
+PREVIEW_BLOCK_BYTES = 2000         # 估计内存用：富文本预览每个文本块的格式和排版开销
+RENDER_CACHE_SIZE_MB = 256         # 磁盘渲染缓存的大小上限，超出时删除最久未用的条目
+RENDER_CACHE_MIN_CHARS = 64 * 1024 # 不少于这么多字符的文档才写入磁盘渲染缓存
+HIGHLIGHT_BUDGET_MS = 8            # 一轮语法高亮最多占用界面线程的时间，剩下的块空闲时分批处理
+HIGHLIGHT_MARGIN_BLOCKS = 200      # 可见区域前后立即高亮的文本块数，更远的块滚动到附近时再高亮
+SETTINGS_WRITE_DELAY_MS = 500     # 设置停止修改多久后写入磁盘
+RECENT_NOTEBOOKS_LIMIT = 10        # 最近使用的笔记本最多记录的数量
+RECENT_DOCUMENTS_LIMIT = 20        # 最近打开的文档最多记录的数量
+JOURNAL_COMPACT_BYTES = 1024 * 1024  # 编辑日志超过这个大小（且超过文档大小）时写入全文并丢弃之前的记录
+THUMBNAIL_MEMORY_MB = 128         # 内存中预览图片缩略图的大小上限，超出时丢弃最久未用的
+THUMBNAIL_CACHE_SIZE_MB = 256     # 磁盘缩略图缓存的大小上限
+THUMBNAIL_WIDTH_STEP = 128        # 缩略图宽度按这个步长向下取整，预览区宽度小幅变化时复用已有的缩略图
+CODE_HIGHLIGHT_STYLE = "default"   # 预览中代码块的配色（Pygments 样式名），设置为 null 时不高亮
+CODE_HIGHLIGHT_CACHE_SIZE = 512    # 缓存的代码块高亮结果数量
+CODE_HIGHLIGHT_MAX_CHARS = 200 * 1024  # 代码块只高亮开头这么多字符，其余部分按纯文本显示
+MARKDOWN_EXTENSIONS = ["tables", "fenced_code", "toc"]  # 默认启用的Markdown扩展，可在 settings.json 中修改
+# 只影响所在块的扩展：按块渲染的结果与整篇渲染一致。启用了其他扩展（如 footnotes、abbr、meta）时预览每次整篇渲染
+BLOCK_LOCAL_EXTENSIONS = frozenset(("tables", "fenced_code", "toc", "admonition", "sane_lists", "nl2br",
+                                    "smarty", "codehilite", "wikilinks", "legacy_attrs", "legacy_em"))
+
+# 从 ~/.marknote/settings.json 加载的用户设置
+_settings = {}
+
+def get_setting(key, default=None):
+    """读取用户设置，未设置时返回默认值"""
+    return _settings.get(key, default)
+
+def content_hash(text):
+    """计算文本内容的哈希值，用于判断内容是否变化"""
+    return hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()
+
+class _SeedIds:
+    """按块渲染时，在 toc 扩展分配标题 id 之前放入前文已经使用的 id
+
+    toc 扩展给重复的标题加 _1、_2 后缀，放入前文的 id 后块内标题得到的 id 与整篇渲染一致。
+    """
+    def __init__(self, md):
+        self.md = md
+
+    def run(self, root):
+        from xml.etree import ElementTree
+        self.md.seed_elements = [ElementTree.SubElement(root, "div", {"id": seed_id})
+                                 for seed_id in self.md.seed_ids]
+
+
+class _RemoveSeedIds:
+    """toc 扩展分配完 id 之后移除 _SeedIds 放入的元素"""
+    def __init__(self, md):
+        self.md = md
+
+    def run(self, root):
+        for element in self.md.seed_elements:
+            root.remove(element)
+        self.md.seed_elements = []
+
+
+# 没有安装 Pygments 时使用的简单分词器，只区分注释、字符串、数字和关键字
+_BUILTIN_CODE_RE = re.compile(r"""
+    (?P<comment>\#[^\n]*|//[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>"(?:[^"\\\n]|\\.)*"?|'(?:[^'\\\n]|\\.)*'?)
+  | (?P<number>\b(?:0[xX][0-9a-fA-F]+|\d+(?:\.\d*)?(?:[eE][+-]?\d+)?)\b)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*)
+""", re.VERBOSE | re.DOTALL)
+_BUILTIN_KEYWORDS = frozenset("""
+    and as assert async await break case catch class const continue def default del do elif else enum
+    except export extends false False final finally fn for from func function global go if impl import
+    in interface is lambda let loop match mod module mut new nil None nonlocal not null or package pass
+    private protected pub public raise return self static struct super switch this throw trait true True
+    try type typeof use var void while with yield
+""".split())
+_BUILTIN_CODE_STYLES = {
+    "comment": "color:#3d7b7b;font-style:italic",
+    "string": "color:#ba2121",
+    "number": "color:#666666",
+    "keyword": "color:#008000;font-weight:bold",
+}
+_PLAIN_LANGUAGES = frozenset(("text", "txt", "plain", "plaintext"))
+# fenced_code 输出的代码块：<pre> 可能带 id/class，<code> 的 class 中任意位置有 language-xxx，后面还可能有其他属性
+_CODE_BLOCK_RE = re.compile(
+    r'(<pre\b[^>]*><code\b[^>]*?\sclass="(?:[^"]*\s)?language-([^"\s]+)[^"]*"[^>]*>)(.*?)</code></pre>', re.DOTALL)
+
+
+class CodeHighlighter:
+    """预览和导出中代码块的语法高亮
+
+    安装了 Pygments 时使用它的词法分析器，否则使用内置的简单分词器，都在本地完成。
+    输出带内联样式的 span，预览区和导出的HTML不需要额外的样式表。
+    结果按 (语言, 代码哈希) 缓存，整篇重新渲染时没有变化的代码块不会重新分词。
+    词法单元逐个生成，超过 CODE_HIGHLIGHT_MAX_CHARS 的代码块只对开头部分分词，其余部分按纯文本输出。
+    """
+    OUTPUT_VERSION = 2  # 代码块的识别或输出格式变化时加 1，之前缓存的渲染结果作废
+
+    def __init__(self, style=CODE_HIGHLIGHT_STYLE, cache_size=CODE_HIGHLIGHT_CACHE_SIZE,
+                 max_chars=CODE_HIGHLIGHT_MAX_CHARS):
+        self.cache_size = cache_size
+        self.max_chars = max_chars
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # (语言, 代码哈希) -> 高亮后的HTML
+        self._lexers = {}            # 语言 -> Pygments 词法分析器，不支持的语言为 None
+        self._styles = {}            # 词法单元类型 -> 内联样式
+        self._pygments = None        # 是否安装了 Pygments，首次高亮时检查
+        self.configure(style)
+
+    def configure(self, style):
+        """设置配色，清空已缓存的结果"""
+        with self._lock:
+            self.style = style
+            self._pygments_style = None
+            self._cache.clear()
+            self._styles.clear()
+
+    def _has_pygments(self):
+        if self._pygments is None:
+            try:
+                import pygments  # noqa: F401  首次高亮时才导入，缩短启动时间
+                self._pygments = True
+            except ImportError:
+                self._pygments = False
+        return self._pygments
+
+    def version(self):
+        """高亮结果的版本标识"""
+        if self._has_pygments():
+            import pygments
+            tokenizer = f"pygments-{pygments.__version__}"
+        else:
+            tokenizer = "builtin"
+        return f"{tokenizer}/{self.style}/{self.max_chars}/v{self.OUTPUT_VERSION}"
+
+    def highlight(self, language, code):
+        """返回高亮后的代码HTML（已转义），不支持的语言返回 None"""
+        language = language.lower()
+        if language in _PLAIN_LANGUAGES:
+            return None
+        key = (language, content_hash(code))
+        with self._lock:
+            html = self._cache.get(key)
+            if html is not None:
+                self._cache.move_to_end(key)
+                return html or None
+        tokens = self._tokens(language, code)
+        html = self._format(tokens, code) if tokens is not None else ""
+        with self._lock:
+            self._cache[key] = html
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return html or None
+
+    def _tokens(self, language, code):
+        """返回 (内联样式, 文本) 的生成器"""
+        if not self._has_pygments():
+            return self._builtin_tokens(code)
+        lexer = self._lexer(language)
+        if lexer is None:
+            return None
+        return ((self._token_style(token_type), value) for token_type, value in lexer.get_tokens(code))
+
+    def _lexer(self, language):
+        with self._lock:
+            if language in self._lexers:
+                return self._lexers[language]
+        from pygments.lexers import get_lexer_by_name
+        from pygments.util import ClassNotFound
+        try:
+            # 保留首尾空行，词法单元拼起来与原代码一致
+            lexer = get_lexer_by_name(language, stripnl=False, ensurenl=False)
+        except ClassNotFound:
+            lexer = None
+        with self._lock:
+            self._lexers[language] = lexer
+        return lexer
+
+    def _token_style(self, token_type):
+        css = self._styles.get(token_type)
+        if css is None:
+            if self._pygments_style is None:
+                from pygments.styles import get_style_by_name
+                from pygments.util import ClassNotFound
+                try:
+                    self._pygments_style = get_style_by_name(self.style)
+                except ClassNotFound:
+                    print(f"未知的代码配色: {self.style}")
+                    self._pygments_style = get_style_by_name("default")
+            info = self._pygments_style.style_for_token(token_type)
+            parts = []
+            if info["color"]:
+                parts.append(f"color:#{info['color']}")
+            if info["bgcolor"]:
+                parts.append(f"background-color:#{info['bgcolor']}")
+            if info["bold"]:
+                parts.append("font-weight:bold")
+            if info["italic"]:
+                parts.append("font-style:italic")
+            css = ";".join(parts)
+            self._styles[token_type] = css
+        return css
+
+    @staticmethod
+    def _builtin_tokens(code):
+        position = 0
+        for match in _BUILTIN_CODE_RE.finditer(code):
+            kind = match.lastgroup
+            if kind == "word":
+                if match.group() not in _BUILTIN_KEYWORDS:
+                    continue
+                kind = "keyword"
+            if match.start() > position:
+                yield "", code[position:match.start()]
+            yield _BUILTIN_CODE_STYLES[kind], match.group()
+            position = match.end()
+        if position < len(code):
+            yield "", code[position:]
+
+    def _format(self, tokens, code):
+        """把词法单元拼成HTML，相邻的同样式单元合并到一个 span"""
+        parts = []
+        current_css = ""
+        current = []
+        consumed = 0
+        for css, value in tokens:
+            # 空白的颜色看不出来，并入前一个 span
+            if css != current_css and not value.isspace():
+                if current:
+                    text = html_escape("".join(current), quote=False)
+                    parts.append(f'<span style="{current_css}">{text}</span>' if current_css else text)
+                current_css = css
+                current = []
+            current.append(value)
+            consumed += len(value)
+            if consumed >= self.max_chars:
+                # 不再从生成器取词法单元，剩下的代码不分词
+                break
+        if current:
+            text = html_escape("".join(current), quote=False)
+            parts.append(f'<span style="{current_css}">{text}</span>' if current_css else text)
+        parts.append(html_escape(code[consumed:], quote=False))
+        return "".join(parts)
+
+
+code_highlighter = CodeHighlighter()
+
+
+class _HighlightCode:
+    """把 fenced_code 扩展输出的代码块替换为高亮后的HTML"""
+    def __init__(self, md):
+        self.md = md
+
+    def run(self, text):
+        if 'language-' not in text:
+            return text
+
+        def replace(match):
+            highlighted = code_highlighter.highlight(match.group(2), html_unescape(match.group(3)))
+            if highlighted is None:
+                return match.group()
+            return f'{match.group(1)}{highlighted}</code></pre>'
+        return _CODE_BLOCK_RE.sub(replace, text)
+
+
+class MarkdownRenderer:
+    """可配置的Markdown转换器
+
+    每个线程复用一个按当前配置创建的 markdown.Markdown 实例，转换前调用 reset()，
+    不必每次转换都重新创建实例、注册全部处理器。预览、导出和渲染缓存共用同一配置。
+    """
+    def __init__(self, extensions=MARKDOWN_EXTENSIONS, extension_configs=None, code_style=CODE_HIGHLIGHT_STYLE):
+        self._local = threading.local()
+        self.generation = 0
+        self.configure(extensions, extension_configs, code_style)
+
+    def configure(self, extensions, extension_configs=None, code_style=CODE_HIGHLIGHT_STYLE):
+        """设置启用的扩展及其参数和代码块配色（None 时不高亮），各线程下次转换时重新创建实例"""
+        self.extensions = list(extensions)
+        self.extension_configs = dict(extension_configs or {})
+        names = {name.rsplit(".", 1)[-1]: name for name in self.extensions}
+        self.block_local = set(names) <= BLOCK_LOCAL_EXTENSIONS
+        # codehilite 扩展自己高亮代码块
+        self.code_style = code_style if "codehilite" not in names else None
+        if self.code_style:
+            code_highlighter.configure(self.code_style)
+        self._toc = names.get("toc")
+        # 目录标记所在的块要整篇渲染才能生成完整目录
+        self.toc_marker = self.extension_configs.get(self._toc, {}).get("marker", "[TOC]") if self._toc else None
+        self.generation += 1
+
+    def version(self):
+        """转换结果的版本标识，程序、markdown 版本或扩展配置变化后导出清单和渲染缓存作废"""
+        import markdown
+        config = json.dumps([self.extensions, self.extension_configs], sort_keys=True, default=repr)
+        highlight = code_highlighter.version() if self.code_style else "none"
+        return f"{APP_VERSION}/markdown-{markdown.__version__}/{content_hash(config)[:12]}/{highlight}"
+
+    def _markdown(self):
+        local = self._local
+        if getattr(local, "generation", None) != self.generation:
+            import markdown  # 首次渲染时才导入，缩短启动时间
+            configs = {name: dict(config) for name, config in self.extension_configs.items()}
+            if self._toc:
+                # 默认的 slugify 会丢掉中文，标题全是中文时锚点只剩 _1、_2
+                from markdown.extensions.toc import slugify_unicode
+                configs.setdefault(self._toc, {}).setdefault("slugify", slugify_unicode)
+            md = markdown.Markdown(extensions=self.extensions, extension_configs=configs)
+            md.seed_ids = ()
+            md.seed_elements = []
+            if self._toc:
+                md.treeprocessors.register(_SeedIds(md), "nemomark_seed_ids", 6)
+                md.treeprocessors.register(_RemoveSeedIds(md), "nemomark_remove_seed_ids", 4)
+            if self.code_style:
+                # 在 raw_html 放回 fenced_code 暂存的代码块之后
+                md.postprocessors.register(_HighlightCode(md), "nemomark_highlight_code", 25)
+            local.md = md
+            local.generation = self.generation
+        return local.md
+
+    def render(self, text, references=None, seed_ids=()):
+        """转换一段Markdown，返回 (HTML, 其中定义的引用)
+
+        references 是文档其他部分定义的引用，seed_ids 是前文已经使用的标题 id。
+        """
+        md = self._markdown()
+        md.reset()
+        if references:
+            md.references.update(references)
+        md.seed_ids = seed_ids
+        html = md.convert(text)
+        return html, dict(md.references)
+
+    def convert(self, text):
+        """转换整篇Markdown"""
+        return self.render(text)[0]
+
+
+markdown_renderer = MarkdownRenderer()
+
+def configure_markdown(extensions=None, extension_configs=None):
+    """按用户设置配置Markdown扩展（也用作导出进程池的初始化函数）"""
+    if extensions is None:
+        extensions = get_setting('markdown_extensions', MARKDOWN_EXTENSIONS)
+    if extension_configs is None:
+        extension_configs = get_setting('markdown_extension_configs', {})
+    markdown_renderer.configure(extensions, extension_configs, get_setting('code_highlight_style', CODE_HIGHLIGHT_STYLE))
+
+def render_markdown(text):
+    """把整篇Markdown转换为HTML，预览和导出使用同一转换"""
+    return markdown_renderer.convert(text)
+
+def render_pipeline_version():
+    """Markdown转换的版本标识，版本变化后导出清单和渲染缓存中的结果都作废"""
+    return markdown_renderer.version()
+
+# 新建文件的默认权限受 umask 影响；mkstemp 创建的临时文件固定为 0600，替换前需要改回来
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def atomic_write_text(path, text, sync=True):
+    """原子地写入文本文件
+
+    先写入同一目录下的临时文件并 fsync，再用 os.replace 替换目标文件。
+    写入过程中崩溃或磁盘已满时，原文件保持不变。
+    sync=False 时不 fsync，只保证不会看到写了一半的文件，用于可以重新生成的文件。
+    """
+    path = os.path.realpath(path)
+    directory = os.path.dirname(path)
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    import tempfile
+    fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+    # 同步目录项，保证重命名本身也已落盘（Windows 不支持打开目录，跳过）
+    if sync and hasattr(os, 'O_DIRECTORY'):
+        try:
+            dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except OSError:
+            pass
+
+
+def lock_file(f, blocking=True):
+    """对打开的文件加进程间排他锁，blocking=False 时已被其他进程锁住则返回 False"""
+    if os.name == 'nt':
+        import msvcrt
+        position = f.tell()
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK if blocking else msvcrt.LK_NBLCK, 1)
+        except OSError:
+            if blocking:
+                raise
+            return False
+        finally:
+            f.seek(position)
+    else:
+        import fcntl
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+    return True
+
+def unlock_file(f):
+    """释放 lock_file() 加的锁"""
+    if os.name == 'nt':
+        import msvcrt
+        position = f.tell()
+        f.seek(0)
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            f.seek(position)
+    else:
+        import fcntl
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class SettingsStore:
+    """用户设置和最近使用列表的存储（~/.marknote/settings.json）
+
+    启动时读取一次，之后所有读取都使用内存中的 _settings。修改只改内存并记下修改过的键，
+    停止修改 SETTINGS_WRITE_DELAY_MS 后在线程池中合并写入：在文件锁内重新读取磁盘上的内容，
+    只写回本进程修改过的键，最近使用列表与磁盘上的按时间合并，再原子地替换文件。
+    同时运行的多个程序实例不会覆盖对方的修改，也不会读到写了一半的文件。
+    """
+    RECENT_KEYS = {"recent_notebooks": RECENT_NOTEBOOKS_LIMIT, "recent_documents": RECENT_DOCUMENTS_LIMIT}
+
+    def __init__(self, data, path=None):
+        self.data = data
+        self.path = path or os.path.join(os.path.expanduser("~"), ".marknote", "settings.json")
+        self._dirty = set()
+        self._lock = threading.Lock()        # 保护 data 和 _dirty
+        self._write_lock = threading.Lock()  # 同一时间只有一次写入
+        self._timer = None
+
+    def load(self):
+        """从磁盘读取设置，替换内存中的内容"""
+        data = self._read()
+        for key in self.RECENT_KEYS:
+            if key in data:
+                data[key] = self._normalize_recent(data[key])
+        with self._lock:
+            self.data.clear()
+            self.data.update(data)
+            self._dirty.clear()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        if not isinstance(data, dict):
+            raise ValueError("设置文件的内容不是JSON对象")
+        return data
+
+    @staticmethod
+    def _normalize_recent(entries):
+        # 早期版本只保存路径，没有时间
+        return [{'path': entry, 'time': 0} if isinstance(entry, str) else entry
+                for entry in entries if isinstance(entry, (str, dict))]
+
+    @staticmethod
+    def _merge_recent(lists, limit):
+        """合并多个最近使用列表：同一路径保留最近的时间，按时间从新到旧排列"""
+        times = {}
+        for entries in lists:
+            for entry in entries:
+                path = entry.get('path')
+                if path and entry.get('time', 0) >= times.get(path, -1):
+                    times[path] = entry.get('time', 0)
+        merged = sorted(times.items(), key=lambda item: item[1], reverse=True)[:limit]
+        return [{'path': path, 'time': timestamp} for path, timestamp in merged]
+
+    def set(self, key, value):
+        """修改一项设置，稍后在后台写入"""
+        with self._lock:
+            self.data[key] = value
+            self._dirty.add(key)
+        self.schedule()
+
+    def recent(self, kind):
+        """最近使用的路径列表，从新到旧"""
+        return [entry['path'] for entry in self.data.get(kind, [])]
+
+    def add_recent(self, kind, path):
+        """把路径移到最近使用列表的最前面"""
+        entries = [{'path': path, 'time': time.time()}] + [
+            entry for entry in self.data.get(kind, []) if entry['path'] != path]
+        self.set(kind, entries[:self.RECENT_KEYS[kind]])
+
+    def schedule(self):
+        """合并短时间内的修改，延迟后在线程池中写入（在界面线程调用）"""
+        if QCoreApplication.instance() is None:
+            self.flush()
+            return
+        if self._timer is None:
+            self._timer = QTimer()
+            self._timer.setSingleShot(True)
+            self._timer.timeout.connect(lambda: QThreadPool.globalInstance().start(SettingsWriteTask(self)))
+        self._timer.start(get_setting('settings_write_delay_ms', SETTINGS_WRITE_DELAY_MS))
+
+    def flush(self):
+        """立即写入全部修改，等待进行中的写入完成（用于退出）"""
+        if self._timer is not None:
+            self._timer.stop()
+        self.write()
+
+    def write(self):
+        """把修改过的键合并写入磁盘"""
+        with self._write_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                changes = {key: self.data[key] for key in self._dirty if key in self.data}
+                self._dirty.clear()
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                with self._interprocess_lock():
+                    try:
+                        data = self._read()
+                    except (OSError, ValueError) as e:
+                        # 文件损坏时用内存中的设置重建
+                        print(f"读取设置失败: {str(e)}")
+                        data = dict(self.data)
+                    for key, value in changes.items():
+                        if key in self.RECENT_KEYS:
+                            value = self._merge_recent([value, self._normalize_recent(data.get(key, []))],
+                                                       self.RECENT_KEYS[key])
+                            changes[key] = value
+                        data[key] = value
+                    atomic_write_text(self.path, json.dumps(data, ensure_ascii=False, indent=2))
+            except Exception:
+                with self._lock:
+                    # 下次写入时重试
+                    self._dirty.update(changes)
+                raise
+            with self._lock:
+                # 其他实例加入的最近使用项；写入期间又修改过的键以内存为准
+                for key in self.RECENT_KEYS:
+                    if key in changes and key not in self._dirty:
+                        self.data[key] = changes[key]
+
+    @contextmanager
+    def _interprocess_lock(self):
+        """在 settings.json.lock 上加排他锁，多个程序实例依次读改写"""
+        with open(self.path + ".lock", 'a+') as f:
+            lock_file(f)
+            try:
+                yield
+            finally:
+                unlock_file(f)
+
+
+settings_store = SettingsStore(_settings)
+
+
+class SettingsWriteTask(QRunnable):
+    """在线程池中写入设置"""
+    def __init__(self, store):
+        super().__init__()
+        self.store = store
+
+    def run(self):
+        try:
+            self.store.write()
+        except Exception as e:
+            print(f"保存设置失败: {str(e)}")
+
+
+class _NullSpan:
+    """跟踪关闭时 Tracer.span() 返回的空操作对象，所有调用方共用一个实例"""
+    __slots__ = ()
+
+    @property
+    def size(self):
+        return 0
+
+    @size.setter
+    def size(self, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def start(self):
+        return self
+
+    def finish(self):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    """一段被跟踪的耗时，size 记录文档大小（字符数、字节数或文件数），可在结束前更新"""
+    __slots__ = ('tracer', 'name', 'size', 'begin')
+
+    def __init__(self, tracer, name, size):
+        self.tracer = tracer
+        self.name = name
+        self.size = size
+        self.begin = 0
+
+    def __enter__(self):
+        self.begin = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.tracer.record(self.name, self.begin, time.perf_counter_ns(), self.size)
+        return False
+
+    def start(self):
+        return self.__enter__()
+
+    def finish(self):
+        self.__exit__(None, None, None)
+
+
+class Tracer:
+    """热点路径耗时跟踪
+
+    用法: with tracer.span("markdown", size): ...
+    关闭时 span() 直接返回共享的空操作对象，开销只有一次属性判断和一次函数调用。
+    开启后记录每段耗时（最多 MAX_EVENTS 条，超出时丢弃最早的），可导出为
+    Chrome/Perfetto 的 trace event JSON；每个名称最近 STATS_WINDOW 次的耗时用于计算 p50/p99。
+    """
+    MAX_EVENTS = 200000
+    STATS_WINDOW = 1000
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._events = deque(maxlen=self.MAX_EVENTS)  # (名称, 开始ns, 耗时ns, 大小, 线程)
+        self._durations = {}  # 名称 -> 最近的耗时ns
+        self._origin = time.perf_counter_ns()
+
+    def span(self, name, size=0):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name, size)
+
+    def record(self, name, begin, end, size):
+        with self._lock:
+            self._events.append((name, begin, end - begin, size, threading.get_ident()))
+            durations = self._durations.get(name)
+            if durations is None:
+                durations = self._durations[name] = deque(maxlen=self.STATS_WINDOW)
+            durations.append(end - begin)
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._durations.clear()
+
+    def stats(self):
+        """返回 [(名称, 次数, p50毫秒, p99毫秒)]"""
+        with self._lock:
+            snapshot = [(name, sorted(durations)) for name, durations in self._durations.items()]
+        result = []
+        for name, durations in sorted(snapshot):
+            count = len(durations)
+            p50 = durations[count // 2] / 1e6
+            p99 = durations[min(count - 1, count * 99 // 100)] / 1e6
+            result.append((name, count, p50, p99))
+        return result
+
+    def export_chrome_trace(self, path):
+        """导出为 Chrome/Perfetto 可以打开的 trace event JSON，返回导出的事件数"""
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        main_thread = threading.main_thread().ident
+        trace_events = []
+        for thread_id in {event[4] for event in events}:
+            trace_events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": thread_id,
+                                 "args": {"name": "界面线程" if thread_id == main_thread else f"后台线程 {thread_id}"}})
+        for name, begin, duration, size, thread_id in events:
+            trace_events.append({"name": name, "ph": "X", "pid": pid, "tid": thread_id,
+                                 "ts": (begin - self._origin) / 1000, "dur": duration / 1000,
+                                 "args": {"size": size}})
+        atomic_write_text(path, json.dumps({"traceEvents": trace_events, "displayTimeUnit": "ms"}, ensure_ascii=False))
+        return len(events)
+
+
+# 全局跟踪器，设置环境变量 NEMOMARK_TRACE 时启动即开启
+tracer = Tracer()
+
+
+class RenderScheduler(QObject):
+    """预览渲染调度器：把连续的编辑合并为一次空闲时的渲染"""
+    render_requested = Signal()
+
+    def __init__(self, delay_ms=PREVIEW_RENDER_DELAY_MS, max_staleness_ms=PREVIEW_MAX_STALENESS_MS, parent=None):
+        super().__init__(parent)
+        self.delay_ms = delay_ms
+        self.max_staleness_ms = max_staleness_ms
+
+        # 空闲计时器：每次编辑都会重新计时
+        self._idle_timer = QTimer(self)
+        self._idle_timer.setSingleShot(True)
+        self._idle_timer.timeout.connect(self.flush)
+
+        # 截止计时器：保证持续输入时预览也不会无限期落后
+        self._deadline_timer = QTimer(self)
+        self._deadline_timer.setSingleShot(True)
+        self._deadline_timer.timeout.connect(self.flush)
+
+    def schedule(self):
+        """记录一次编辑，推迟到空闲时再渲染"""
+        self._idle_timer.start(self.delay_ms)
+        if not self._deadline_timer.isActive():
+            self._deadline_timer.start(self.max_staleness_ms)
+
+    def is_pending(self):
+        """是否有尚未执行的渲染"""
+        return self._idle_timer.isActive() or self._deadline_timer.isActive()
+
+    def cancel(self):
+        """取消待执行的渲染"""
+        self._idle_timer.stop()
+        self._deadline_timer.stop()
+
+    def flush(self):
+        """立即执行待处理的渲染"""
+        self.cancel()
+        self.render_requested.emit()
+
+
+# 块切分使用的正则，与 Python-Markdown 的识别规则保持一致
+_FENCE_OPEN_RE = re.compile(
+    r'^(?P<fence>~{3,}|`{3,})[ ]*'
+    r'(?:\{[^\n]*\}|(?:\.?[\w#.+-]*[ ]*)?(?:hl_lines=(?P<quot>"|\').*?(?P=quot)[ ]*)?)$')
+_LIST_ITEM_RE = re.compile(r'^(?:[*+-]|\d+\.)(?:[ \t]|$)')
+_REFERENCE_RE = re.compile(r'^\[[^\[\]]*\]:')
+_HTML_BLOCK_RE = re.compile(r'^[ ]{0,3}<', re.MULTILINE)
+# 渲染结果中的标题 id，以及 toc 扩展去重时加的 _n 后缀
+_HEADING_ID_RE = re.compile(r'<h[1-6] id="([^"]*)"')
+_OTHER_ID_RE = re.compile(r'<(?!h[1-6][ >])[a-z][^>]*\sid="')
+_ID_COUNT_RE = re.compile(r'^(.*)_([0-9]+)$')
+
+
+def _closes_fence(line, fence):
+    """判断该行是否结束以 fence 开始的围栏代码块"""
+    return line.startswith(fence) and not line[len(fence):].strip(' ')
+
+
+def split_markdown_blocks(lines, start=0):
+    """从 start 行开始把源码行切分为顶层块，逐个产出 (起始行, 结束行)
+
+    只在空行之后、顶格且不是列表项/引用/缩进内容的行处切分，围栏代码块内部不切分。
+    切得粗一些不影响渲染结果，只是缓存命中少一些。
+    """
+    block_start = start
+    fence = None
+    prev_blank = False
+    has_content = False
+    for i in range(start, len(lines)):
+        line = lines[i]
+        if fence is not None:
+            # 围栏代码块内部，只寻找结束围栏
+            if _closes_fence(line, fence):
+                fence = None
+            prev_blank = False
+            continue
+        blank = not line.strip(' \t')
+        # 只含空白的块单独渲染时结果为空，因此块内必须有内容才能切分；
+        # 以引用定义开头的行被移除后，剩余部分可能接续上一块的列表或引用
+        if (prev_blank and not blank and has_content
+                and line[0] not in ' \t>' and not _LIST_ITEM_RE.match(line)
+                and not _REFERENCE_RE.match(line)):
+            yield block_start, i
+            block_start = i
+        has_content = has_content or not blank
+        match = _FENCE_OPEN_RE.match(line)
+        if match:
+            fence = match.group('fence')
+        prev_blank = blank
+    if block_start < len(lines):
+        yield block_start, len(lines)
+
+
+class HeadingEntry:
+    """目录中的一个标题，行号相对所在块保存，块移动时无需逐个更新"""
+    __slots__ = ('block', 'offset', 'level', 'title', 'item')
+
+    def __init__(self, block, offset, level, title):
+        self.block = block
+        self.offset = offset  # 相对块起始行的偏移
+        self.level = level
+        self.title = title
+        self.item = None      # 对应的目录树节点
+
+    @property
+    def line(self):
+        return self.block.start + self.offset
+
+
+class MarkdownBlock:
+    """Markdown顶层块：源码中连续的若干行"""
+    __slots__ = ('start', 'end', 'text', 'key', 'headings')
+
+    def __init__(self, start, end, text):
+        self.start = start  # 起始行号
+        self.end = end      # 结束行号（不含）
+        self.text = text
+        self.key = content_hash(text)
+        self.headings = self._extract_headings() if "#" in text else []
+
+    def _extract_headings(self):
+        """提取块内的标题（跳过围栏代码块）"""
+        headings = []
+        fence = None
+        for offset, line in enumerate(self.text.split("\n")):
+            if fence is not None:
+                if _closes_fence(line, fence):
+                    fence = None
+                continue
+            match = _FENCE_OPEN_RE.match(line)
+            if match:
+                fence = match.group('fence')
+                continue
+            stripped_line = line.strip()
+            if stripped_line.startswith("#"):
+                level = len(stripped_line) - len(stripped_line.lstrip("#"))
+                if level <= 6:
+                    headings.append(HeadingEntry(self, offset, level, stripped_line[level:].strip()))
+        return headings
+
+
+class CachedBlock:
+    """从磁盘渲染缓存恢复目录时使用的伪块
+
+    第一次编辑之前不切分文档，缓存中的标题都挂在这个从第 0 行开始的块上；
+    第一次编辑整篇切分后，它作为被替换的块交给 update_toc，目录节点由新标题接管。
+    """
+    __slots__ = ('start', 'headings')
+
+    def __init__(self, headings):
+        self.start = 0
+        self.headings = [HeadingEntry(self, line, level, title) for line, level, title in headings]
+
+
+def _block_start(block):
+    return block.start
+
+
+def _id_stem(heading_id):
+    """去掉 toc 扩展去重时加的 _n 后缀；同一标题去重时尝试的 id 都有相同的词干"""
+    match = _ID_COUNT_RE.match(heading_id)
+    return match.group(1) if match else heading_id
+
+
+class IncrementalMarkdownRenderer:
+    """增量Markdown渲染器
+
+    把文档切分为顶层块，按块内容哈希缓存渲染结果，编辑时只重新切分和渲染
+    contentsChange 涉及的块。输出与 render_markdown 整篇转换完全一致。
+    update() 在界面线程调用，render() 在后台线程调用。
+    """
+    def __init__(self, cache_size=BLOCK_CACHE_SIZE):
+        self.blocks = []
+        self.cache_size = cache_size
+        self._cache = OrderedDict()         # 块哈希 -> (html, 块内定义的引用, 是否需要整篇渲染, 标题id)
+        self._seeded_cache = OrderedDict()  # (块哈希, 引用指纹, 前文的标题id) -> html
+        self._generation = markdown_renderer.generation
+        self._lock = threading.Lock()
+        self._dirty = None                  # 变化涉及的行范围（变化后的行号）
+        self._line_delta = 0                # 累计增加的行数
+        self._line_count = 0
+
+    def note_change(self, first_line, last_line, line_delta):
+        """记录一次 contentsChange 影响的行范围，行号为变化后的行号"""
+        if self._dirty is not None:
+            old_first, old_last = self._dirty
+            # 把之前记录的范围映射到这次变化之后的行号
+            if old_last > last_line - line_delta:
+                old_last += line_delta
+            elif old_last >= first_line:
+                old_last = last_line
+            first_line = min(first_line, old_first)
+            last_line = max(last_line, old_last)
+        self._dirty = (first_line, last_line)
+        self._line_delta += line_delta
+
+    def invalidate(self):
+        """丢弃切分结果，下次 update() 时整篇重新切分"""
+        self.blocks = []
+        self._dirty = None
+        self._line_delta = 0
+
+    def clear_cache(self):
+        """清空块级HTML缓存"""
+        with self._lock:
+            self._cache.clear()
+            self._seeded_cache.clear()
+
+    def cache_bytes(self):
+        """块级HTML缓存的大致大小（字节）"""
+        with self._lock:
+            return (sum(len(info[0]) for info in self._cache.values())
+                    + sum(len(html) for html in self._seeded_cache.values()))
+
+    def update(self, text):
+        """根据记录的变化重新切分文档
+
+        返回 (index, removed, inserted)：self.blocks[index:index+len(inserted)]
+        替换了原来的 removed 块。
+        """
+        lines = text.split("\n")
+        dirty, delta = self._dirty, self._line_delta
+        self._dirty = None
+        self._line_delta = 0
+        blocks = self.blocks
+
+        if not blocks or len(lines) != self._line_count + delta:
+            # 首次切分，或行数对不上（变化没有完整记录），整篇切分
+            removed = blocks
+            self.blocks = [MarkdownBlock(s, e, "\n".join(lines[s:e]))
+                           for s, e in split_markdown_blocks(lines)]
+            self._line_count = len(lines)
+            return 0, removed, list(self.blocks)
+        self._line_count = len(lines)
+        if dirty is None:
+            return 0, [], []
+
+        first, last = dirty
+        # 从变化所在块开始重新切分；变化落在块首行时可能与上一块合并，所以再往前一块
+        i0 = max(bisect.bisect_right(blocks, first, key=_block_start) - 1, 0)
+        if i0 > 0 and blocks[i0].start == first:
+            i0 -= 1
+        i1 = max(bisect.bisect_right(blocks, last - delta, key=_block_start) - 1, i0)
+
+        # 重新切分，直到新的块边界与变化之后的某个旧块边界重合
+        inserted = []
+        j = i1 + 1
+        for s, e in split_markdown_blocks(lines, blocks[i0].start):
+            inserted.append(MarkdownBlock(s, e, "\n".join(lines[s:e])))
+            while j < len(blocks) and blocks[j].start + delta < e:
+                j += 1
+            if j < len(blocks) and blocks[j].start + delta == e:
+                break
+        else:
+            j = len(blocks)
+
+        removed = blocks[i0:j]
+        if delta:
+            for block in blocks[j:]:
+                block.start += delta
+                block.end += delta
+        blocks[i0:j] = inserted
+        return i0, removed, inserted
+
+    def snapshot(self):
+        """生成交给后台线程的块快照"""
+        return [(block.key, block.text) for block in self.blocks]
+
+    def render(self, snapshot):
+        """把块快照渲染为完整HTML"""
+        return self.render_fragments(snapshot)[0]
+
+    def render_fragments(self, snapshot):
+        """渲染块快照，返回 (完整HTML, 每个块的HTML列表)
+
+        需要整篇渲染时块列表为 None。
+        """
+        with self._lock:
+            if self._generation != markdown_renderer.generation:
+                # 扩展配置变了，缓存的结果作废
+                self._cache.clear()
+                self._seeded_cache.clear()
+                self._generation = markdown_renderer.generation
+            if not markdown_renderer.block_local:
+                return self._render_full(snapshot)
+            limit = max(self.cache_size, 2 * len(snapshot))
+            infos = [self._render_block(key, text, limit) for key, text in snapshot]
+
+            # 汇总整篇文档的引用式链接定义
+            references = {}
+            for _, block_refs, needs_full, _ in infos:
+                if needs_full:
+                    return self._render_full(snapshot)
+                for ref_id, value in block_refs.items():
+                    if references.setdefault(ref_id, value) != value:
+                        # 同一引用有多个不同定义，只能整篇渲染
+                        return self._render_full(snapshot)
+
+            fragments = []
+            refs_key = content_hash(repr(sorted(references.items()))) if references else None
+            used_ids = defaultdict(set)  # 词干 -> 前文已经使用的标题 id
+            for (key, text), (html, _, _, ids) in zip(snapshot, infos):
+                block_refs = references if references and "[" in text else None
+                if block_refs:
+                    # 引用定义变化后，使用引用的块都要重新渲染
+                    html = self._render_seeded(key, text, block_refs, refs_key, (), limit)
+                    ids = _HEADING_ID_RE.findall(html)
+                if ids and used_ids:
+                    # 与前文的标题重名时，带着前文的 id 重新渲染，去重后缀与整篇渲染一致
+                    seed_ids = set()
+                    for heading_id in ids:
+                        seed_ids.update(used_ids.get(_id_stem(heading_id), ()))
+                    if seed_ids:
+                        html = self._render_seeded(key, text, block_refs, refs_key if block_refs else None,
+                                                   tuple(sorted(seed_ids)), limit)
+                        ids = _HEADING_ID_RE.findall(html)
+                for heading_id in ids:
+                    used_ids[_id_stem(heading_id)].add(heading_id)
+                fragments.append(html)
+            return "\n".join(html for html in fragments if html), fragments
+
+    def _render_block(self, key, text, limit):
+        """渲染单个块，结果按块哈希缓存"""
+        info = self._cache.get(key)
+        if info is not None:
+            self._cache.move_to_end(key)
+            return info
+        html, references = markdown_renderer.render(text)
+        # 原始HTML、目录标记和标题以外的 id 会影响其他块，这样的文档只能整篇渲染
+        marker = markdown_renderer.toc_marker
+        needs_full = bool(_HTML_BLOCK_RE.search(text) or (marker and marker in text) or _OTHER_ID_RE.search(html))
+        info = (html, references, needs_full, _HEADING_ID_RE.findall(html))
+        self._cache[key] = info
+        while len(self._cache) > limit:
+            self._cache.popitem(last=False)
+        return info
+
+    def _render_seeded(self, key, text, references, refs_key, seed_ids, limit):
+        """带着整篇文档的引用定义和前文的标题 id 渲染单个块"""
+        cache_key = (key, refs_key, seed_ids)
+        html = self._seeded_cache.get(cache_key)
+        if html is not None:
+            self._seeded_cache.move_to_end(cache_key)
+            return html
+        html = markdown_renderer.render(text, references, seed_ids)[0]
+        self._seeded_cache[cache_key] = html
+        while len(self._seeded_cache) > limit:
+            self._seeded_cache.popitem(last=False)
+        return html
+
+    def _render_full(self, snapshot):
+        """整篇渲染，用于块级渲染无法保证结果一致的文档（如含原始HTML块）"""
+        return render_markdown("\n".join(text for _, text in snapshot)), None
+
+
+class RenderSignals(QObject):
+    """渲染任务的信号（QRunnable 不是 QObject，不能直接发射信号）"""
+    finished = Signal(int, str, object, object)  # 修订号, HTML, [(块HTML, 预览块数)] 或 None, ScrollMap 或 None
+
+
+class RenderTask(QRunnable):
+    """在线程池中把Markdown转换为HTML，避免阻塞界面线程
+
+    starts 是快照中每个块的起始行，line_count 是文档总行数，用于生成滚动同步的对应关系。
+    """
+    def __init__(self, revision, renderer, snapshot, signals, starts=None, line_count=0):
+        super().__init__()
+        self.revision = revision
+        self.renderer = renderer
+        self.snapshot = snapshot
+        self.signals = signals
+        self.starts = starts
+        self.line_count = line_count
+
+    def run(self):
+        scroll_map = None
+        try:
+            with tracer.span("markdown", sum(len(text) for _, text in self.snapshot)):
+                html, fragments = self.renderer.render_fragments(self.snapshot)
+            if fragments is not None:
+                fragments = PreviewUpdater.measure(fragments)
+                if self.starts is not None:
+                    scroll_map = ScrollMap.build(self.starts, self.line_count, fragments)
+        except Exception as e:
+            print(f"渲染预览失败: {str(e)}")
+            html, fragments = "", None
+        try:
+            self.signals.finished.emit(self.revision, html, fragments, scroll_map)
+        except RuntimeError:
+            # 编辑器已经关闭
+            pass
+
+
+class PreviewUpdater:
+    """预览区的增量更新器
+
+    记录每个Markdown块在预览文档中占用的文本块数，更新时只把变化的块对应的
+    片段替换掉，其余部分保持不动，不必对整篇文档重新 setHtml 和排版。
+    """
+    _block_counts = OrderedDict()  # 块HTML -> (预览文本块数, 是否以表格开头)，在后台线程中计算
+    _counts_lock = threading.Lock()
+
+    def __init__(self, preview):
+        self.preview = preview
+        self.fragments = None  # [(块HTML, 预览块数)]，None 表示尚未建立对应关系
+        self.scroll_map = None  # 与 fragments 对应的 ScrollMap
+        self._scratch = QTextDocument()
+
+    def reset(self):
+        """预览内容被替换或清空，之前的对应关系作废"""
+        self.fragments = None
+        self.scroll_map = None
+
+    @classmethod
+    def measure(cls, fragments):
+        """计算每个块的HTML在预览文档中对应的文本块数（在后台线程中调用）
+
+        单独排版时，以表格开头的片段在表格前面有一个空文本块；在整篇文档中
+        这个位置由前一个片段的最后一个文本块占用，所以不是第一个片段时要少算一块。
+        """
+        document = None
+        measured = []
+        with cls._counts_lock:
+            for html in fragments:
+                if not html:
+                    measured.append((html, 0))
+                    continue
+                entry = cls._block_counts.get(html)
+                if entry is None:
+                    if document is None:
+                        document = QTextDocument()
+                    document.setHtml(html)
+                    second = document.begin().next()
+                    starts_with_table = (not document.begin().text() and second.isValid()
+                                         and QTextCursor(second).currentTable() is not None)
+                    entry = (document.blockCount(), starts_with_table)
+                    cls._block_counts[html] = entry
+                else:
+                    cls._block_counts.move_to_end(html)
+                count, starts_with_table = entry
+                if starts_with_table and any(n for _, n in measured):
+                    count -= 1
+                measured.append((html, count))
+            while len(cls._block_counts) > max(BLOCK_CACHE_SIZE, 2 * len(fragments)):
+                cls._block_counts.popitem(last=False)
+        return measured
+
+    def apply(self, html, fragments, scroll_map=None):
+        """更新预览，保持滚动位置不变"""
+        with tracer.span("setHtml", len(html)):
+            scrollbar = self.preview.verticalScrollBar()
+            scroll_value = scrollbar.value()
+            if fragments is None or self.fragments is None or not self._patch(fragments):
+                self.preview.setHtml(html)
+                self.fragments = fragments
+                # 块内不闭合的原始HTML会影响相邻块的解析，此时对应关系不可靠，下次仍整篇更新
+                if fragments is not None and self.preview.document().blockCount() != max(1, sum(count for _, count in fragments)):
+                    self.fragments = None
+            self.scroll_map = scroll_map if self.fragments is not None else None
+            scrollbar.setValue(scroll_value)
+
+    def _patch(self, fragments):
+        """只替换变化的片段，变化太大时返回 False 改为整篇更新"""
+        old = self.fragments
+        prefix = 0
+        limit = min(len(old), len(fragments))
+        # 同样的HTML在不同位置占用的块数可能不同（表格），块数也要相同
+        while prefix < limit and old[prefix] == fragments[prefix]:
+            prefix += 1
+        suffix = 0
+        while suffix < limit - prefix and old[-1 - suffix] == fragments[-1 - suffix]:
+            suffix += 1
+        if prefix == len(old) == len(fragments):
+            return True
+        if len(fragments) - prefix - suffix > PREVIEW_PATCH_MAX_BLOCKS:
+            return False
+
+        # 新内容为空时把相邻的片段也纳入替换范围，避免留下多余的空文本块
+        while (not any(count for _, count in fragments[prefix:len(fragments) - suffix])
+               and any(count for _, count in old[prefix:len(old) - suffix])):
+            if prefix > 0:
+                prefix -= 1
+            elif suffix > 0:
+                suffix -= 1
+            else:
+                return False
+
+        # 表格要整体替换，在表格单元格前插入也会插进单元格里，这两种情况整篇更新
+        changed = old[prefix:len(old) - suffix] + fragments[prefix:len(fragments) - suffix]
+        if any("<table" in html for html, _ in changed):
+            return False
+        if not any(count for _, count in old[prefix:len(old) - suffix]):
+            following = next((html for html, count in old[len(old) - suffix:] if count), "")
+            if "<table" in following:
+                return False
+
+        first_block = sum(count for _, count in old[:prefix])
+        removed_blocks = sum(count for _, count in old[prefix:len(old) - suffix])
+        inserted = [html for html, count in fragments[prefix:len(fragments) - suffix] if count]
+
+        document = self.preview.document()
+        cursor = QTextCursor(document)
+        cursor.beginEditBlock()
+        if removed_blocks:
+            # 删除原有片段的内容，留下一个空文本块用于写入新内容
+            last = document.findBlockByNumber(first_block + removed_blocks - 1)
+            cursor.setPosition(document.findBlockByNumber(first_block).position())
+            cursor.setPosition(last.position() + last.length() - 1, QTextCursor.MoveMode.KeepAnchor)
+            cursor.removeSelectedText()
+        elif first_block < sum(count for _, count in old):
+            # 在第 first_block 个文本块之前插入
+            cursor.setPosition(document.findBlockByNumber(first_block).position())
+            cursor.insertBlock()
+            cursor.movePosition(QTextCursor.MoveOperation.PreviousBlock)
+        elif first_block > 0:
+            # 追加到文档末尾
+            cursor.movePosition(QTextCursor.MoveOperation.End)
+            cursor.insertBlock()
+        for index, html in enumerate(inserted):
+            if index:
+                cursor.insertBlock()
+            self._scratch.setHtml(html)
+            self._copy_blocks(self._scratch, cursor)
+        cursor.endEditBlock()
+        self.fragments = fragments
+        return True
+
+    @staticmethod
+    def _copy_blocks(source, cursor):
+        """把 source 的全部文本块复制到光标所在的空文本块处"""
+        lists = {}
+        block = source.begin()
+        first = True
+        while block.isValid():
+            # 列表归属由 objectIndex 记录，指向的是源文档里的对象，复制时要清掉
+            block_format = block.blockFormat()
+            block_format.setObjectIndex(-1)
+            if first:
+                cursor.setBlockFormat(block_format)
+                cursor.setBlockCharFormat(block.charFormat())
+                first = False
+            else:
+                cursor.insertBlock(block_format, block.charFormat())
+            text_list = block.textList()
+            if text_list is not None:
+                key = text_list.item(0).position()
+                if key in lists:
+                    lists[key].add(cursor.block())
+                else:
+                    lists[key] = cursor.createList(text_list.format())
+            iterator = block.begin()
+            while not iterator.atEnd():
+                fragment = iterator.fragment()
+                char_format = fragment.charFormat()
+                if char_format.isImageFormat():
+                    cursor.insertImage(char_format.toImageFormat())
+                else:
+                    cursor.insertText(fragment.text(), char_format)
+                iterator += 1
+            block = block.next()
+
+
+class ScrollMap:
+    """源码行与预览文本块的对应关系，用于编辑区和预览区同步滚动
+
+    每个在预览中占有文本块的Markdown块对应一项：源码起始行和在预览中的第一个文本块号，
+    两列都是递增的。滚动时在其中二分查找，每次只需查询几个预览文本块的位置，
+    耗时与文档大小无关。块内按比例插值。
+    """
+    def __init__(self, source_starts, preview_starts, line_count, preview_count):
+        self.source_starts = source_starts
+        self.preview_starts = preview_starts
+        self.line_count = line_count
+        self.preview_count = preview_count
+
+    @classmethod
+    def build(cls, starts, line_count, fragments):
+        """由每个块的起始行和测量过的预览片段生成，没有内容时返回 None"""
+        source_starts = []
+        preview_starts = []
+        preview_count = 0
+        for start, (_, count) in zip(starts, fragments):
+            if count:
+                source_starts.append(start)
+                preview_starts.append(preview_count)
+                preview_count += count
+        if not source_starts:
+            return None
+        return cls(source_starts, preview_starts, line_count, preview_count)
+
+    def _span(self, index, block_top):
+        """第 index 项在源码中的行范围和在预览中的纵坐标范围"""
+        source_end = self.source_starts[index + 1] if index + 1 < len(self.source_starts) else self.line_count
+        preview_end = self.preview_starts[index + 1] if index + 1 < len(self.preview_starts) else self.preview_count
+        return (self.source_starts[index], source_end,
+                block_top(self.preview_starts[index]), block_top(preview_end))
+
+    def to_preview(self, line, block_top):
+        """源码行（可以带小数）对应的预览纵坐标；block_top(n) 返回第 n 个预览文本块的顶部位置"""
+        index = max(bisect.bisect_right(self.source_starts, line) - 1, 0)
+        source_start, source_end, top, bottom = self._span(index, block_top)
+        fraction = min(max((line - source_start) / max(source_end - source_start, 1), 0.0), 1.0)
+        return top + fraction * (bottom - top)
+
+    def to_source(self, y, block_top):
+        """预览纵坐标对应的源码行（带小数）"""
+        index = bisect.bisect_right(range(len(self.preview_starts)), y,
+                                    key=lambda i: block_top(self.preview_starts[i])) - 1
+        index = max(index, 0)
+        source_start, source_end, top, bottom = self._span(index, block_top)
+        fraction = min(max((y - top) / max(bottom - top, 1), 0.0), 1.0)
+        return source_start + fraction * (source_end - source_start)
+
+
+def evict_cache_dir(cache_dir, suffix, max_bytes):
+    """按修改时间删除缓存目录中最久未用的条目，直到总大小不超过上限"""
+    entries = []
+    total = 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if not entry.name.endswith(suffix):
+                continue
+            try:
+                info = entry.stat()
+            except OSError:
+                continue
+            entries.append((info.st_mtime_ns, info.st_size, entry.path))
+            total += info.st_size
+    if total <= max_bytes:
+        return
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+
+
+class RenderCache:
+    """磁盘渲染缓存
+
+    把较大文档的预览HTML、预览片段和标题列表保存在 ~/.marknote/cache 下，每个条目一个
+    JSON 文件，文件名由内容哈希和渲染版本计算得到。再次打开内容没有变化的文件时直接显示
+    缓存的预览和目录，不必等待整篇渲染。文件的修改时间记录最近使用时间，总大小超出上限时
+    删除最久未用的条目。
+    """
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".marknote", "cache")
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, text_hash):
+        # 预览片段的文本块数由 Qt 计算，Qt 版本也计入
+        key = content_hash(f"{text_hash}/{render_pipeline_version()}/qt-{qVersion()}")
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def load(self, text_hash):
+        """读取缓存条目，返回 {'html', 'fragments', 'headings', 'scroll_map'}，没有时返回 None"""
+        path = self._path(text_hash)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"读取渲染缓存失败: {str(e)}")
+            return None
+        if entry.get("hash") != text_hash:
+            return None
+        return entry
+
+    def store(self, text_hash, html, fragments, headings, scroll_map=None):
+        """写入缓存条目，然后按大小上限清理（在后台线程调用）"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = {"hash": text_hash, "html": html, "fragments": fragments, "headings": headings}
+        if scroll_map is not None:
+            entry["scroll_map"] = [scroll_map.source_starts, scroll_map.preview_starts,
+                                   scroll_map.line_count, scroll_map.preview_count]
+        atomic_write_text(self._path(text_hash), json.dumps(entry, ensure_ascii=False), sync=False)
+        self.evict()
+
+    def evict(self):
+        """删除最久未用的条目，直到总大小不超过上限"""
+        max_bytes = self.max_bytes
+        if max_bytes is None:
+            max_bytes = get_setting('render_cache_size_mb', RENDER_CACHE_SIZE_MB) * 1024 * 1024
+        with self._lock:
+            evict_cache_dir(self.cache_dir, ".json", max_bytes)
+
+
+render_cache = RenderCache()
+
+
+class RenderCacheTask(QRunnable):
+    """在线程池中写入磁盘渲染缓存"""
+    def __init__(self, text_hash, html, fragments, headings, scroll_map=None):
+        super().__init__()
+        self.text_hash = text_hash
+        self.html = html
+        self.fragments = fragments
+        self.headings = headings
+        self.scroll_map = scroll_map
+
+    def run(self):
+        try:
+            render_cache.store(self.text_hash, self.html, self.fragments, self.headings, self.scroll_map)
+        except Exception as e:
+            print(f"写入渲染缓存失败: {str(e)}")
+
+
+class ThumbnailSignals(QObject):
+    """缩略图任务的信号"""
+    finished = Signal(str, object)  # 缓存键, QImage（解码失败时为空图片）
+
+
+class ThumbnailCache:
+    """预览图片的缩略图缓存
+
+    图片按预览区宽度缩小后保存在内存中（按字节数的LRU），缩小过的图片同时写入
+    ~/.marknote/thumbnails 下的 PNG 文件。键由图片路径、修改时间、文件大小和缩略图尺寸计算，
+    图片文件变化后自动失效。解码在线程池中进行，同一张图片同时只解码一次，
+    内存中的缩略图和读过的图片尺寸在界面线程中使用。
+    """
+    def __init__(self, cache_dir=None, memory_bytes=None, max_bytes=None):
+        self.cache_dir = cache_dir or os.path.join(os.path.expanduser("~"), ".marknote", "thumbnails")
+        self.memory_bytes = memory_bytes
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()  # 缓存键 -> QImage
+        self._memory_total = 0
+        self._sizes = OrderedDict()   # (路径, 修改时间, 文件大小) -> 原图尺寸
+        self._pending = set()
+        self._signals = None
+        self._lock = threading.Lock()
+
+    @property
+    def signals(self):
+        """解码完成的信号，首次使用时创建（需要在界面线程中）"""
+        if self._signals is None:
+            self._signals = ThumbnailSignals()
+            self._signals.finished.connect(self._on_finished)
+        return self._signals
+
+    @staticmethod
+    def key(path, info, size):
+        return content_hash(f"{path}\0{info.st_mtime_ns}\0{info.st_size}\0{size.width()}x{size.height()}")
+
+    def image_size(self, path, info):
+        """原图尺寸，只读取文件头，结果按路径和修改时间记住"""
+        size_key = (path, info.st_mtime_ns, info.st_size)
+        size = self._sizes.get(size_key)
+        if size is None:
+            size = QImageReader(path).size()
+            self._sizes[size_key] = size
+            while len(self._sizes) > BLOCK_CACHE_SIZE:
+                self._sizes.popitem(last=False)
+        return size
+
+    def image(self, key):
+        """返回内存中的缩略图，没有时返回 None"""
+        image = self._memory.get(key)
+        if image is not None:
+            self._memory.move_to_end(key)
+        return image
+
+    def request(self, key, path, size, device_ratio):
+        """在线程池中解码图片，完成后发出 signals.finished"""
+        if key in self._pending:
+            return
+        self._pending.add(key)
+        QThreadPool.globalInstance().start(ThumbnailTask(key, path, size, device_ratio, self.signals))
+
+    def _on_finished(self, key, image):
+        self._pending.discard(key)
+        if image.isNull():
+            return
+        limit = self.memory_bytes
+        if limit is None:
+            limit = get_setting('thumbnail_memory_mb', THUMBNAIL_MEMORY_MB) * 1024 * 1024
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_total -= old.sizeInBytes()
+        self._memory[key] = image
+        self._memory_total += image.sizeInBytes()
+        while self._memory_total > limit and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_total -= evicted.sizeInBytes()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.png")
+
+    def load(self, key):
+        """读取磁盘上的缩略图（在后台线程调用），没有时返回 None"""
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        image = QImage(path)
+        if image.isNull():
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return image
+
+    def store(self, key, image):
+        """写入磁盘缩略图，然后按大小上限清理（在后台线程调用）"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(key)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        if not image.save(temp_path, "PNG"):
+            raise OSError(f"无法写入 {temp_path}")
+        os.replace(temp_path, path)
+        max_bytes = self.max_bytes
+        if max_bytes is None:
+            max_bytes = get_setting('thumbnail_cache_size_mb', THUMBNAIL_CACHE_SIZE_MB) * 1024 * 1024
+        with self._lock:
+            evict_cache_dir(self.cache_dir, ".png", max_bytes)
+
+
+thumbnail_cache = ThumbnailCache()
+
+
+class ThumbnailTask(QRunnable):
+    """在线程池中解码并缩小一张图片"""
+    def __init__(self, key, path, size, device_ratio, signals):
+        super().__init__()
+        self.key = key
+        self.path = path
+        self.size = size
+        self.device_ratio = device_ratio
+        self.signals = signals
+
+    def run(self):
+        image = QImage()
+        try:
+            with tracer.span("image", os.path.getsize(self.path)):
+                reader = QImageReader(self.path)
+                scaled = reader.size() != self.size
+                cached = thumbnail_cache.load(self.key) if scaled else None
+                if cached is not None:
+                    image = cached
+                else:
+                    if scaled:
+                        # 解码时直接缩小，JPEG 等格式不必先解码出原图
+                        reader.setScaledSize(self.size)
+                    image = reader.read()
+                    if image.isNull():
+                        print(f"加载图片失败: {self.path}: {reader.errorString()}")
+                    elif scaled:
+                        thumbnail_cache.store(self.key, image)
+            image.setDevicePixelRatio(self.device_ratio)
+        except Exception as e:
+            print(f"加载图片失败: {str(e)}")
+        try:
+            self.signals.finished.emit(self.key, image)
+        except RuntimeError:
+            pass
+
+
+class PreviewTextEdit(QTextEdit):
+    """预览区
+
+    图片由 loadResource 提供：本地图片按预览区宽度在线程池中解码和缩小，
+    完成之前显示同样大小的占位图，完成后替换并重新排版。缩略图由 thumbnail_cache
+    缓存，重新渲染时不会再次解码同一张图片。
+    """
+    images_loaded = Signal()  # 图片加载完成、重新排版之后发出
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.relayouting = False  # 正在因为图片加载重新排版，期间的滚动不是用户操作
+        self._waiting = {}    # 缓存键 -> 等待这张图片的资源名
+        self._added = False   # 是否用 addResource 放入过图片，这些资源 setHtml 时不会清除
+        self._relayout_timer = QTimer(self)
+        self._relayout_timer.setSingleShot(True)
+        self._relayout_timer.setInterval(50)
+        self._relayout_timer.timeout.connect(self._relayout)
+        thumbnail_cache.signals.finished.connect(self._on_thumbnail)
+
+    def set_source_path(self, file_path):
+        """设置Markdown文件的路径，图片的相对路径相对于它所在的目录"""
+        if file_path:
+            directory = os.path.dirname(os.path.abspath(file_path))
+            self.document().setBaseUrl(QUrl.fromLocalFile(directory + os.sep))
+
+    def setHtml(self, html):
+        if self._added:
+            # 清掉之前放入的图片，图片文件变化后重新加载
+            self.document().clear()
+            self._added = False
+        super().setHtml(html)
+
+    def loadResource(self, resource_type, name):
+        if resource_type != QTextDocument.ResourceType.ImageResource:
+            return super().loadResource(resource_type, name)
+        url = self.document().baseUrl().resolved(name) if name.isRelative() else name
+        if not url.isLocalFile():
+            return super().loadResource(resource_type, name)
+        path = url.toLocalFile()
+        try:
+            info = os.stat(path)
+        except OSError:
+            return super().loadResource(resource_type, name)
+        size = thumbnail_cache.image_size(path, info)
+        if not size.isValid():
+            return super().loadResource(resource_type, name)
+        device_ratio = self.devicePixelRatioF()
+        target = self._target_width(device_ratio)
+        if size.width() > target:
+            size = QSize(target, max(1, round(size.height() * target / size.width())))
+        key = thumbnail_cache.key(path, info, size)
+        image = thumbnail_cache.image(key)
+        if image is not None:
+            return image
+        self._waiting.setdefault(key, []).append(QUrl(name))
+        thumbnail_cache.request(key, path, size, device_ratio)
+        return self._placeholder(size, device_ratio)
+
+    def _target_width(self, device_ratio):
+        """缩略图的宽度（设备像素）：预览区正文宽度向下取整到 THUMBNAIL_WIDTH_STEP"""
+        width = self.viewport().width() - 2 * self.document().documentMargin()
+        width = int(width * device_ratio) // THUMBNAIL_WIDTH_STEP * THUMBNAIL_WIDTH_STEP
+        return max(width, THUMBNAIL_WIDTH_STEP)
+
+    @staticmethod
+    def _placeholder(size, device_ratio):
+        """与缩略图显示大小相同的浅灰色占位图，只分配很小的图片，靠像素比放大"""
+        factor = max(1, -(-max(size.width(), size.height()) // 64))
+        image = QImage(-(-size.width() // factor), -(-size.height() // factor), QImage.Format.Format_RGB32)
+        image.fill(QColor("#f0f0f0"))
+        image.setDevicePixelRatio(factor * device_ratio)
+        return image
+
+    def _on_thumbnail(self, key, image):
+        names = self._waiting.pop(key, None)
+        if not names or image.isNull():
+            return
+        document = self.document()
+        for name in names:
+            document.addResource(QTextDocument.ResourceType.ImageResource, name, image)
+        self._added = True
+        # 多张图片接连完成时只重新排版一次
+        self._relayout_timer.start()
+
+    def _relayout(self):
+        scrollbar = self.verticalScrollBar()
+        scroll_value = scrollbar.value()
+        document = self.document()
+        self.relayouting = True
+        try:
+            document.markContentsDirty(0, document.characterCount())
+            scrollbar.setValue(scroll_value)
+        finally:
+            self.relayouting = False
+        self.images_loaded.emit()
+
+
+class MarkdownHighlighter(QSyntaxHighlighter):
+    """Markdown源码语法高亮
+
+    每个文本块的状态记录它是否处在围栏代码块或 YAML 头信息中。编辑后 QSyntaxHighlighter
+    只重新高亮变化的块，以及状态随之改变的后续块。
+
+    可见区域前后 HIGHLIGHT_MARGIN_BLOCKS 块以外的块只计算状态并标记为待高亮，滚动到附近时
+    再高亮。一轮高亮超过 HIGHLIGHT_BUDGET_MS 后，可见区域以外的块保持原状态、停止向后传播，
+    剩下的部分在空闲时分批处理，打开大文档或在文档开头输入围栏时不会卡住界面。
+    """
+    # 块状态：低两位是类型，其余位是围栏长度；PENDING 位表示只计算了状态、还没有高亮
+    NORMAL = 0
+    BACKTICK_FENCE = 1
+    TILDE_FENCE = 2
+    FRONT_MATTER = 3
+    PENDING = 1 << 24
+
+    # 行内规则：(触发字符, 正则, 格式名)，行内没有触发字符时不执行正则
+    INLINE_RULES = (
+        ("*_", re.compile(r'(\*\*|__)(?=\S)(.+?)(?<=\S)\1'), "bold"),
+        ("*_", re.compile(r'(?<![*\w])([*_])(?![\s*_])(.+?)(?<![\s*_])\1(?![*\w])'), "italic"),
+        ("~", re.compile(r'~~(?=\S)(.+?)(?<=\S)~~'), "strike"),
+        ("[", re.compile(r'!?\[[^\]\n]*\](?:\([^)\n]*\)|\[[^\]\n]*\])'), "link"),
+        ("<", re.compile(r'<(?:https?://[^>\s]+|/?[A-Za-z][^>]*)>'), "html"),
+        ("`", re.compile(r'(`+)(?!`)(.+?)(?<!`)\1(?!`)'), "code"),
+    )
+    _HEADING_RE = re.compile(r'#{1,6}(?:[ \t]|$)')
+    _QUOTE_RE = re.compile(r'[ ]{0,3}>')
+    _LIST_RE = re.compile(r'[ \t]*(?:[*+-]|\d+[.)])(?=[ \t])')
+    _RULE_RE = re.compile(r'[ ]{0,3}(?:(?:\*[ \t]*){3,}|(?:-[ \t]*){3,}|(?:_[ \t]*){3,})$')
+
+    def __init__(self, editor):
+        super().__init__(editor.document())
+        self.editor = editor
+        self.formats = self._create_formats()
+        # 立即高亮的块号范围，随滚动和窗口大小更新
+        self._first = 0
+        self._last = HIGHLIGHT_MARGIN_BLOCKS * 2
+        self._deadline = None
+        self._exhausted = False
+        self._last_block = -1
+        # 超出时间预算后留下的区间：从 _stale_from 开始的块需要重新高亮，至少到 _stale_to
+        self._stale_from = None
+        self._stale_to = -1
+        self._stale_timer = QTimer(self)
+        self._stale_timer.setSingleShot(True)
+        self._stale_timer.timeout.connect(self.continue_stale)
+        self._visible_pending = False
+        self._visible_timer = QTimer(self)
+        self._visible_timer.setSingleShot(True)
+        self._visible_timer.timeout.connect(self.highlight_visible)
+        self._connect_document(editor.document())
+        editor.verticalScrollBar().valueChanged.connect(self.highlight_visible)
+        editor.viewport().installEventFilter(self)
+
+    @staticmethod
+    def _create_formats():
+        def char_format(color=None, bold=False, italic=False, background=None, monospace=False, strike=False):
+            fmt = QTextCharFormat()
+            if color:
+                fmt.setForeground(QColor(color))
+            if bold:
+                fmt.setFontWeight(QFont.Weight.Bold)
+            if italic:
+                fmt.setFontItalic(True)
+            if background:
+                fmt.setBackground(QColor(background))
+            if monospace:
+                fmt.setFontFamilies(["Consolas", "Courier New", "monospace"])
+            if strike:
+                fmt.setFontStrikeOut(True)
+            return fmt
+        return {
+            "heading": char_format("#1a5fb4", bold=True),
+            "quote": char_format("#6a737d", italic=True),
+            "list": char_format("#c64600", bold=True),
+            "rule": char_format("#9a9996"),
+            "bold": char_format(bold=True),
+            "italic": char_format(italic=True),
+            "strike": char_format("#6a737d", strike=True),
+            "link": char_format("#0366d6"),
+            "html": char_format("#813d9c"),
+            "code": char_format("#c01c28", background="#f3f3f3", monospace=True),
+            "fence": char_format("#3d3846", background="#f6f8fa", monospace=True),
+            "front_matter": char_format("#6a737d", background="#f6f8fa", monospace=True),
+        }
+
+    def _connect_document(self, document):
+        if document is not None:
+            # 在 QSyntaxHighlighter 自己的处理之后调用，用来记下被跳过的编辑范围
+            document.contentsChange.connect(self._on_contents_change)
+
+    def attach(self, document):
+        """改为高亮另一个文档，None 表示停止高亮"""
+        old = self.document()
+        if old is not None:
+            old.contentsChange.disconnect(self._on_contents_change)
+        self._stale_from = None
+        self._stale_to = -1
+        self.setDocument(document)
+        self._connect_document(document)
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Type.Resize:
+            self._visible_timer.start(0)
+        return super().eventFilter(obj, event)
+
+    def _next_state(self, text, previous):
+        """由上一块的状态和本块文本计算本块的状态（不含 PENDING 位）"""
+        base = previous & ~self.PENDING if previous > 0 else self.NORMAL
+        kind = base & 3
+        if kind == self.FRONT_MATTER:
+            return self.NORMAL if text.rstrip() in ("---", "...") else base
+        if kind:
+            fence = ("`" if kind == self.BACKTICK_FENCE else "~") * (base >> 2)
+            return self.NORMAL if _closes_fence(text, fence) else base
+        first = text[:1]
+        if first == "`" or first == "~":
+            match = _FENCE_OPEN_RE.match(text)
+            if match:
+                fence = match.group('fence')
+                return (self.BACKTICK_FENCE if fence[0] == "`" else self.TILDE_FENCE) | (len(fence) << 2)
+        elif first == "-" and text.rstrip() == "---" and self.currentBlock().blockNumber() == 0:
+            return self.FRONT_MATTER
+        return self.NORMAL
+
+    def _over_budget(self):
+        if self._exhausted:
+            return True
+        now = time.perf_counter()
+        if self._deadline is None:
+            # 本轮高亮的第一个块，回到事件循环时这一轮结束
+            self._deadline = now + HIGHLIGHT_BUDGET_MS / 1000
+            QTimer.singleShot(0, self._end_pass)
+            return False
+        self._exhausted = now > self._deadline
+        return self._exhausted
+
+    def _end_pass(self):
+        self._deadline = None
+        self._exhausted = False
+
+    def highlightBlock(self, text):
+        if self._exhausted:
+            # 本轮已超出时间：不设置状态即保持原状态，QSyntaxHighlighter 不再向后传播，剩下的空闲时处理
+            return
+        number = self.currentBlock().blockNumber()
+        self._last_block = number
+        if not self._first <= number <= self._last:
+            if self._over_budget():
+                if self._stale_from is None or number < self._stale_from:
+                    self._stale_from = number
+                self._stale_to = max(self._stale_to, number)
+                self._stale_timer.start(0)
+                self._visible_timer.start(0)
+                return
+            stored = self.currentBlockState()
+            if stored < 0 or stored & self.PENDING:
+                # 不在可见区域附近，也还没有高亮过：只记录状态
+                self.setCurrentBlockState(self._next_state(text, self.previousBlockState()) | self.PENDING)
+                if not self._visible_pending:
+                    self._visible_pending = True
+                    self._visible_timer.start(0)
+                return
+        previous = self.previousBlockState()
+        state = self._next_state(text, previous)
+        self.setCurrentBlockState(state)
+        if state & 3 or (previous > 0 and previous & 3):
+            # 围栏代码块和头信息（包括起止行）整行使用同一格式
+            kind = (state & 3) or (previous & 3)
+            self.setFormat(0, len(text), self.formats["front_matter" if kind == self.FRONT_MATTER else "fence"])
+        elif text:
+            self._highlight_inline(text)
+
+    def _highlight_inline(self, text):
+        formats = self.formats
+        first = text.lstrip()[:1]
+        if first == "#" and self._HEADING_RE.match(text):
+            self.setFormat(0, len(text), formats["heading"])
+            return
+        if first == ">" and self._QUOTE_RE.match(text):
+            self.setFormat(0, len(text), formats["quote"])
+        elif first in "-*_" and self._RULE_RE.match(text):
+            self.setFormat(0, len(text), formats["rule"])
+            return
+        if first in "-*+0123456789":
+            match = self._LIST_RE.match(text)
+            if match:
+                self.setFormat(0, match.end(), formats["list"])
+        for triggers, pattern, name in self.INLINE_RULES:
+            if any(char in text for char in triggers):
+                fmt = formats[name]
+                for match in pattern.finditer(text):
+                    self.setFormat(match.start(), match.end() - match.start(), fmt)
+
+    def _on_contents_change(self, position, chars_removed, chars_added):
+        """编辑范围内因超出时间而跳过的块都要补上"""
+        if self._stale_from is not None:
+            document = self.document()
+            last = document.findBlock(position + chars_added)
+            self._stale_to = max(self._stale_to, last.blockNumber() if last.isValid() else document.blockCount() - 1)
+
+    def _update_window(self):
+        """按可见区域更新立即高亮的块号范围，返回可见的 (首块, 末块)"""
+        viewport = self.editor.viewport()
+        first = self.editor.cursorForPosition(QPoint(0, 0)).blockNumber()
+        last = self.editor.cursorForPosition(QPoint(0, viewport.height())).blockNumber()
+        self._first = first - HIGHLIGHT_MARGIN_BLOCKS
+        self._last = last + HIGHLIGHT_MARGIN_BLOCKS
+        return first, last
+
+    def highlight_visible(self):
+        """高亮可见区域中待高亮和超出时间时跳过的块"""
+        self._visible_pending = False
+        document = self.document()
+        if document is None:
+            return
+        self._end_pass()
+        first, last = self._update_window()
+        stale_from = self._stale_from if self._stale_from is not None else document.blockCount()
+        block = document.findBlockByNumber(max(self._first, 0))
+        while block.isValid() and block.blockNumber() <= self._last:
+            state = block.userState()
+            if state < 0 or state & self.PENDING or stale_from <= block.blockNumber() <= self._stale_to:
+                # 高亮后状态变化，QSyntaxHighlighter 会接着处理后面连续的待高亮块
+                self.rehighlightBlock(block)
+            block = block.next()
+
+    def continue_stale(self):
+        """分批重新高亮超出时间预算时留下的块"""
+        document = self.document()
+        if document is None:
+            return
+        self._deadline = time.perf_counter() + HIGHLIGHT_BUDGET_MS / 1000
+        self._exhausted = False
+        try:
+            with tracer.span("highlight") as span:
+                # 大小记为这一批重新高亮的字符数
+                span.size = 0
+                while self._stale_from is not None and time.perf_counter() < self._deadline:
+                    block = document.findBlockByNumber(self._stale_from)
+                    stale_to = self._stale_to
+                    self._stale_from = None
+                    self._stale_to = -1
+                    while block.isValid():
+                        self.rehighlightBlock(block)
+                        # 状态变化时 Qt 会接着高亮后面的块，一直算到最后高亮的块
+                        last = document.findBlockByNumber(max(self._last_block, block.blockNumber()))
+                        span.size += last.position() + last.length() - block.position()
+                        if self._stale_from is not None:
+                            # 又超出了时间，下次从停下的地方继续
+                            self._stale_to = max(self._stale_to, stale_to)
+                            break
+                        if self._last_block >= stale_to:
+                            break
+                        block = document.findBlockByNumber(self._last_block + 1)
+        finally:
+            self._end_pass()
+        if self._stale_from is not None:
+            self._stale_timer.start(0)
+
+
+class FileLoadSignals(QObject):
+    """大文件加载任务的信号"""
+    progress = Signal(int, int)          # 加载编号, 百分比
+    finished = Signal(int, object, str)  # 加载编号, 加载得到的 QTextDocument, 错误信息
+
+
+class FileLoadTask(QRunnable):
+    """在后台线程中以内存映射方式读取大文件，逐块解码后写入一个新的 QTextDocument
+
+    QTextDocument 可以在非界面线程中使用：整篇写完后再移交给界面线程挂到编辑器上，
+    界面线程不必逐块排版。内存中只有文档本身和当前正在解码的一块文本。
+    """
+    def __init__(self, load_id, file_path, signals, chunk_size=LARGE_FILE_CHUNK_SIZE):
+        super().__init__()
+        self.load_id = load_id
+        self.file_path = file_path
+        self.signals = signals
+        self.chunk_size = chunk_size
+        self.cancelled = threading.Event()
+        self.text_hash = None  # 完整加载后的内容哈希，与 content_hash() 的结果一致
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def run(self):
+        document = QTextDocument()
+        document.setUndoRedoEnabled(False)
+        error = ""
+        try:
+            with tracer.span("load", os.path.getsize(self.file_path)):
+                self._load(document)
+        except Exception as e:
+            error = str(e)
+        document.moveToThread(QCoreApplication.instance().thread())
+        try:
+            self.signals.finished.emit(self.load_id, document, error)
+        except RuntimeError:
+            # 编辑器已经关闭
+            pass
+
+    def _load(self, document):
+        # 与文本模式的 open() 一致：按 UTF-8 解码并把 \r\n、\r 统一为 \n
+        decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(), translate=True)
+        cursor = QTextCursor(document)
+        digest = hashlib.blake2b(digest_size=16)
+        with open(self.file_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                self.text_hash = digest.hexdigest()
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                for offset in range(0, size, self.chunk_size):
+                    if self.cancelled.is_set():
+                        return
+                    end = min(offset + self.chunk_size, size)
+                    text = decoder.decode(mapped[offset:end], final=end == size)
+                    digest.update(text.encode('utf-8', 'surrogatepass'))
+                    cursor.insertText(text)
+                    self.signals.progress.emit(self.load_id, end * 100 // size)
+        self.text_hash = digest.hexdigest()
+
+
+class SaveSignals(QObject):
+    """保存任务的信号"""
+    finished = Signal(int, str, str)  # 保存编号, 文件路径, 错误信息（成功时为空）
+
+
+class SaveTask(QRunnable):
+    """在线程池中把文本快照原子地写入文件
+
+    写入结束后在工作线程中设置 idle，界面线程可以直接等待它，不依赖排队的 finished 信号。
+    """
+    def __init__(self, save_id, path, text, signals, idle):
+        super().__init__()
+        self.save_id = save_id
+        self.path = path
+        self.text = text
+        self.signals = signals
+        self.idle = idle
+
+    def run(self):
+        error = ""
+        try:
+            with tracer.span("save", len(self.text)):
+                atomic_write_text(self.path, self.text)
+        except Exception as e:
+            error = str(e)
+        finally:
+            self.idle.set()
+        self.text = None
+        try:
+            self.signals.finished.emit(self.save_id, self.path, error)
+        except RuntimeError:
+            # 编辑器已经关闭
+            pass
+
+
+class EditJournal:
+    """文档的编辑日志，用于崩溃后恢复未保存的修改
+
+    日志保存在 ~/.marknote/journal 下，每个文档一个文件，每行一条JSON记录。
+    第一行记录文档路径和日志所基于的磁盘内容哈希（压缩后还包含当时的全文），
+    之后每次编辑追加一行 [位置, 删除的字符数, 插入的文本, 编辑后的长度]，
+    写入量只与这次编辑的大小有关。日志超过 JOURNAL_COMPACT_BYTES 和文档大小中较大者时，
+    把当前全文写成新的第一行并丢弃之前的记录，平均下来每次编辑的写入量仍与编辑大小成正比。
+    保存后日志删除；程序异常退出时日志留在磁盘上，下次启动时用 replay() 恢复。
+    打开的日志加了进程间锁，同时运行的其他实例不会把它当作异常退出留下的日志；
+    另一个实例也在编辑同一文件时，后打开的一方不记录日志，也不会删除或改写前者的日志。
+    """
+    def __init__(self, file_path, journal_dir=None):
+        self.file_path = os.path.abspath(file_path)
+        self.journal_dir = journal_dir or self.default_dir()
+        self.path = os.path.join(self.journal_dir, f"{content_hash(self.file_path)}.journal")
+        self.base_hash = None  # 日志基于的磁盘内容哈希，None 表示不记录
+        self._file = None
+        self._size = 0
+
+    @staticmethod
+    def default_dir():
+        return os.path.join(os.path.expanduser("~"), ".marknote", "journal")
+
+    def reset(self, base_hash):
+        """内容与磁盘一致（加载或保存完成）时调用：删除日志，之后的编辑基于 base_hash 记录
+
+        日志被其他实例（同时编辑同一文件）锁住时不删除。
+        """
+        try:
+            owned = self._file is not None or not os.path.exists(self.path) or self._acquire()
+            if owned:
+                if os.name == 'nt':
+                    # Windows 上不能删除打开着的文件
+                    self.close()
+                try:
+                    os.remove(self.path)
+                except FileNotFoundError:
+                    pass
+        except OSError as e:
+            print(f"删除编辑日志失败: {str(e)}")
+            owned = False
+        self.close()
+        self.base_hash = base_hash if owned else None
+
+    def _acquire(self):
+        """打开日志文件（不截断）并加锁，已被其他实例锁住时停止记录并返回 False"""
+        os.makedirs(self.journal_dir, exist_ok=True)
+        f = open(self.path, 'a', encoding='utf-8')
+        if not lock_file(f, blocking=False):
+            f.close()
+            self.base_hash = None
+            return False
+        self._file = f
+        return True
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def record(self, document, position, chars_removed, chars_added):
+        """追加一次 contentsChange 对应的编辑"""
+        if self.base_hash is None:
+            return
+        length = document.characterCount() - 1
+        inserted = ""
+        if chars_added:
+            cursor = QTextCursor(document)
+            cursor.setPosition(min(position, length))
+            cursor.setPosition(min(position + chars_added, length), QTextCursor.MoveMode.KeepAnchor)
+            # selectedText() 用 U+2029 表示换行
+            inserted = cursor.selectedText().replace("\u2029", "\n")
+        try:
+            if self._file is None and not self._open({"path": self.file_path, "base": self.base_hash}):
+                return
+            line = json.dumps([position, chars_removed, inserted, length], ensure_ascii=False) + "\n"
+            self._file.write(line)
+            self._file.flush()
+            self._size += len(line)
+            if self._size > max(get_setting('journal_compact_bytes', JOURNAL_COMPACT_BYTES), length):
+                self.checkpoint(document.toPlainText())
+        except OSError as e:
+            print(f"写入编辑日志失败: {str(e)}")
+            self.close()
+            self.base_hash = None
+
+    def checkpoint(self, text):
+        """把当前全文写为新的日志，之前的编辑记录不再需要
+
+        全文先写入加了锁的临时文件再替换日志，日志始终处于加锁状态；写到一半崩溃时旧日志不变。
+        """
+        if self.base_hash is None or (self._file is None and not self._acquire()):
+            return
+        header = json.dumps({"path": self.file_path, "base": self.base_hash, "text": text},
+                            ensure_ascii=False) + "\n"
+        import tempfile
+        fd, temp_path = tempfile.mkstemp(prefix=f".{os.path.basename(self.path)}.", suffix=".tmp",
+                                         dir=self.journal_dir)
+        new_file = os.fdopen(fd, 'a', encoding='utf-8')
+        try:
+            lock_file(new_file)
+            new_file.write(header)
+            new_file.flush()
+            os.fsync(new_file.fileno())
+            if os.name == 'nt':
+                # Windows 上不能替换打开着的文件
+                self.close()
+            os.replace(temp_path, self.path)
+        except BaseException:
+            new_file.close()
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        self.close()
+        self._file = new_file
+        self._size = len(header)
+
+    def _open(self, header):
+        if not self._acquire():
+            print(f"编辑日志正被其他实例使用，不再记录: {self.file_path}")
+            return False
+        line = json.dumps(header, ensure_ascii=False) + "\n"
+        # 加锁之后才截断，不会清掉其他实例正在使用的日志
+        self._file.truncate(0)
+        self._file.write(line)
+        self._size = len(line)
+        return True
+
+    @staticmethod
+    def replay(journal_path):
+        """读取日志，返回 (文档路径, 恢复的全文)
+
+        日志基于的内容与磁盘上的文件不一致、无法恢复时全文为 None；
+        日志正被其他实例使用时返回 None。最后一行写了一半（写入时崩溃）时忽略它。
+        记录中的位置和长度来自 QTextDocument，按 UTF-16 码元计数，所以在 UTF-16 编码的内容上重放。
+        """
+        with open(journal_path, 'r+', encoding='utf-8') as f:
+            if not lock_file(f, blocking=False):
+                return None
+            unlock_file(f)
+            header = json.loads(f.readline())
+            file_path = header["path"]
+            # 压缩过的日志带有全文，但磁盘上的文件在外部被修改过时同样不能恢复
+            try:
+                with open(file_path, 'r', encoding='utf-8') as source:
+                    disk_text = source.read()
+            except (OSError, UnicodeDecodeError):
+                return file_path, None
+            if content_hash(disk_text) != header.get("base"):
+                return file_path, None
+            data = bytearray(header.get("text", disk_text).encode('utf-16-le'))
+            del disk_text
+            for line in f:
+                try:
+                    position, chars_removed, inserted, length = json.loads(line)
+                except ValueError:
+                    break
+                encoded = inserted.encode('utf-16-le')
+                if (position + chars_removed > len(data) // 2
+                        or len(data) - 2 * chars_removed + len(encoded) != 2 * length):
+                    # 记录与内容对不上，这一条和之后的记录都不可信
+                    print(f"编辑日志不完整: {journal_path}")
+                    break
+                data[2 * position:2 * (position + chars_removed)] = encoded
+        return file_path, data.decode('utf-16-le')
+
+
 class MarkdownEditor(QWidget):
     """Markdown编辑器组件，包含目录树、编辑区和预览区"""
+    file_saved = Signal(str)  # 后台保存完成，参数为文件路径
+    
     def __init__(self, file_path=None, parent=None):
         super().__init__(parent)
         self.file_path = file_path
         self.is_modified = False
         
+        # 保存状态：同一时间只有一个后台写入，期间的保存请求合并为一次
+        self._disk_hash = None  # 磁盘上文件内容的哈希，内容相同时跳过保存
+        self._save_id = 0
+        self._save_in_flight = None  # (保存编号, 文本哈希, 编辑计数)
+        self._save_pending = False
+        self._save_idle = threading.Event()
+        self._save_idle.set()
+        self._save_signals = SaveSignals()
+        self._save_signals.finished.connect(self.on_save_finished)
+        self._conflict_prompt_open = False
+        self._disk_check_pending = False  # 后台保存期间收到的外部修改通知，保存完成后再检查
+        # 编辑日志：记录未保存的编辑，异常退出后下次启动时恢复
+        self.journal = EditJournal(file_path) if file_path and get_setting('edit_journal', True) else None
+        self._pending_recovery = None  # 大文件加载完成后再恢复的内容
+        self._rendered_hash = None  # 上次渲染时的内容哈希
+        # 文本编辑计数；document().revision() 在语法高亮改格式时也会增加，不能用来判断有没有新的编辑
+        self._edit_revision = 0
+        
+        # 后台渲染状态：每次请求分配递增的修订号，过期的结果直接丢弃
+        self._render_revision = 0
+        self._render_in_flight = False
+        self._pending_render = None
+        self._render_signals = RenderSignals()
+        self._render_signals.finished.connect(self.on_render_finished)
+        
+        # 增量渲染器：按块缓存HTML，只重新渲染变化的部分
+        self.renderer = IncrementalMarkdownRenderer()
+        self._line_count = 1
+        self._headings = []  # 按行号排序的标题索引，与目录树节点一一对应
+        self._cached_block = None  # 目录来自磁盘渲染缓存时的伪块，第一次编辑后由真实的块替换
+        self._scroll_syncing = False  # 正在由一侧的滚动带动另一侧，忽略另一侧发出的滚动信号
+        
+        # 标签页休眠：长时间在后台的标签页释放预览、目录和撤销记录，切换回来时重新生成
+        self.hibernated = False
+        self.last_active = time.monotonic()
+        
+        # 大文件模式：后台分块加载，预览和目录等用户手动开启
+        self._load_id = 0
+        self._loader = None
+        self._loading = False
+        self._load_incomplete = False  # 加载被取消或失败，编辑器里只有部分内容
+        self._preview_deferred = False
+        self._load_signals = FileLoadSignals()
+        self._load_signals.progress.connect(self.on_load_progress)
+        self._load_signals.finished.connect(self.on_load_finished)
+        
+        # 预览渲染调度器，合并连续编辑
+        self.render_scheduler = RenderScheduler(
+            get_setting('preview_render_delay_ms', PREVIEW_RENDER_DELAY_MS),
+            get_setting('preview_max_staleness_ms', PREVIEW_MAX_STALENESS_MS),
+            self)
+        self.render_scheduler.render_requested.connect(self.update_preview)
+        
         # 初始化UI
         self.init_ui()
         
@@ -48,16 +2333,27 @@ class MarkdownEditor(QWidget):
         self.toc_tree.setHeaderLabel("目录")
         self.toc_tree.setMinimumWidth(150)
         self.toc_tree.setMaximumWidth(250)
+        self.toc_tree.itemClicked.connect(self.on_toc_item_clicked)
         
         # 编辑区
-        self.editor = QTextEdit()
-        self.editor.setAcceptRichText(False)
-        self.editor.textChanged.connect(self.update_preview)
-        self.editor.textChanged.connect(self.set_modified)
+        # 源码只有纯文本，QPlainTextEdit 只布局可见的块，大文档上每次按键不必重新布局整个文档
+        self.editor = QPlainTextEdit()
+        # 语法高亮只改格式也会发出 textChanged，编辑状态改由 contentsChange 跟踪
+        self.editor.document().contentsChange.connect(self.on_contents_change)
+        self.editor.installEventFilter(self)
+        self.highlighter = MarkdownHighlighter(self.editor) if get_setting('syntax_highlighting', True) else None
         
         # 预览区
-        self.preview = QTextEdit()
+        self.preview = PreviewTextEdit()
+        self.preview.set_source_path(self.file_path)
         self.preview.setReadOnly(True)
+        self.preview.setUndoRedoEnabled(False)
+        self.preview_updater = PreviewUpdater(self.preview)
+        if get_setting('scroll_sync', True):
+            self.editor.verticalScrollBar().valueChanged.connect(self.sync_preview_scroll)
+            self.preview.verticalScrollBar().valueChanged.connect(self.sync_editor_scroll)
+            # 图片加载后预览高度变化，重新跟随编辑区
+            self.preview.images_loaded.connect(self.sync_preview_scroll)
         
         # 添加到分隔器
         splitter1.addWidget(self.toc_tree)
@@ -72,8 +2368,12 @@ class MarkdownEditor(QWidget):
         # 创建快捷工具栏
         self.create_toolbar()
         
+        # 大文件加载进度栏，平时隐藏
+        self.create_large_file_bar()
+        
         # 主布局 - 先添加工具栏，再添加分隔器
         main_layout.addWidget(self.toolbar)
+        main_layout.addWidget(self.large_file_bar)
         main_layout.addWidget(splitter1)
         
         self.setLayout(main_layout)
@@ -117,6 +2417,28 @@ class MarkdownEditor(QWidget):
         self.add_tool_button("Quote", "> ", "引用")
         self.add_tool_button("HR", "---", "水平线")
     
+    def create_large_file_bar(self):
+        """创建大文件模式的进度栏：显示加载进度，可取消加载或手动开启预览"""
+        self.large_file_bar = QFrame()
+        layout = QHBoxLayout(self.large_file_bar)
+        layout.setContentsMargins(8, 4, 8, 4)
+        
+        self.large_file_label = QLabel()
+        self.large_file_progress = QProgressBar()
+        self.large_file_progress.setRange(0, 100)
+        self.large_file_progress.setMaximumWidth(240)
+        self.large_file_cancel_btn = QPushButton("取消加载")
+        self.large_file_cancel_btn.clicked.connect(self.cancel_load)
+        self.large_file_preview_btn = QPushButton("显示预览和目录")
+        self.large_file_preview_btn.clicked.connect(self.enable_preview)
+        
+        layout.addWidget(self.large_file_label)
+        layout.addWidget(self.large_file_progress)
+        layout.addStretch()
+        layout.addWidget(self.large_file_cancel_btn)
+        layout.addWidget(self.large_file_preview_btn)
+        self.large_file_bar.hide()
+    
     def add_tool_button(self, text, markdown_text, tooltip):
         """添加工具按钮到工具栏"""
         button = QPushButton(text)
@@ -127,7 +2449,15 @@ class MarkdownEditor(QWidget):
     def insert_markdown(self, text):
         """在编辑器中插入Markdown格式文本"""
         cursor = self.editor.textCursor()
-        
+        # 合并为一次编辑操作：撤销一步即可还原，预览也只渲染一次
+        cursor.beginEditBlock()
+        try:
+            self._insert_markdown(cursor, text)
+        finally:
+            cursor.endEditBlock()
+    
+    def _insert_markdown(self, cursor, text):
+        """insert_markdown 的具体实现"""
         # 对于需要选择文本的格式（如加粗、斜体）
         if text in ["**", "*", "~~"]:
             if cursor.hasSelection():
@@ -151,86 +2481,692 @@ class MarkdownEditor(QWidget):
     
     def update_preview(self):
         """更新预览区内容"""
+        if self._preview_deferred or self.hibernated:
+            return
         text = self.editor.toPlainText()
-        html = markdown.markdown(text)
-        self.preview.setHtml(html)
-        self.update_toc(text)
+        # 内容与上次渲染时相同则跳过
+        text_hash = content_hash(text)
+        if text_hash == self._rendered_hash:
+            return
+        self._rendered_hash = text_hash
+        
+        # 只重新切分变化的块；Markdown转换交给后台线程，界面线程只负责最后的setHtml
+        with tracer.span("split", len(text)):
+            index, removed, inserted = self.renderer.update(text)
+        if self._cached_block is not None:
+            # 第一次编辑：整篇切分的结果替换缓存中恢复的目录
+            removed = [self._cached_block] + removed
+            self._cached_block = None
+        self._render_revision += 1
+        starts = [block.start for block in self.renderer.blocks]
+        self._pending_render = (self._render_revision, self.renderer.snapshot(), starts,
+                                self.editor.document().blockCount())
+        self._start_pending_render()
+        with tracer.span("toc", len(text)):
+            self.update_toc(removed, inserted)
     
-    def update_toc(self, text):
-        """更新目录树"""
+    def _start_pending_render(self):
+        """启动排队中的渲染任务，同一时间只有一个任务在运行"""
+        if self._render_in_flight or self._pending_render is None:
+            return
+        revision, snapshot, starts, line_count = self._pending_render
+        self._pending_render = None
+        self._render_in_flight = True
+        QThreadPool.globalInstance().start(RenderTask(revision, self.renderer, snapshot, self._render_signals,
+                                                      starts, line_count))
+    
+    def on_render_finished(self, revision, html, fragments, scroll_map):
+        """后台渲染完成，在界面线程中更新预览"""
+        self._render_in_flight = False
+        # 只接受最新修订号的结果
+        if revision == self._render_revision:
+            self._apply_preview(html, fragments, scroll_map)
+            if self._rendered_hash == self._disk_hash:
+                self._store_render_cache(html, fragments)
+        self._start_pending_render()
+    
+    def _apply_preview(self, html, fragments, scroll_map=None):
+        """更新预览，然后让预览跟随编辑区的位置"""
+        self._scroll_syncing = True
+        try:
+            self.preview_updater.apply(html, fragments, scroll_map)
+        finally:
+            self._scroll_syncing = False
+        self.sync_preview_scroll()
+    
+    def _preview_block_top(self, number):
+        """预览中第 number 个文本块顶部的纵坐标，超出末尾时为文档高度"""
+        document = self.preview.document()
+        layout = document.documentLayout()
+        if number >= document.blockCount():
+            return layout.documentSize().height()
+        return layout.blockBoundingRect(document.findBlockByNumber(number)).top()
+    
+    def _editor_top_line(self):
+        """编辑区顶部的源码行，折行的块内按可见行插值"""
+        block = self.editor.firstVisibleBlock()
+        offset = self.editor.verticalScrollBar().value() - block.firstLineNumber()
+        return block.blockNumber() + min(max(offset / max(block.lineCount(), 1), 0.0), 1.0)
+    
+    def _scroll_other(self, scrollbar, value):
+        self._scroll_syncing = True
+        try:
+            if scrollbar is self.preview.verticalScrollBar() and value > scrollbar.maximum():
+                # 预览分批排版，setHtml 后滚动范围要过一会儿才更新，先按已排版的高度放大
+                height = self.preview.document().documentLayout().documentSize().height()
+                scrollbar.setMaximum(max(scrollbar.maximum(), round(height) - self.preview.viewport().height()))
+            scrollbar.setValue(round(value))
+        finally:
+            self._scroll_syncing = False
+    
+    def sync_preview_scroll(self):
+        """预览滚动到编辑区顶部的源码行对应的位置"""
+        if self._scroll_syncing or self.hibernated or not get_setting('scroll_sync', True):
+            return
+        scrollbar = self.preview.verticalScrollBar()
+        scroll_map = self.preview_updater.scroll_map
+        if scroll_map is not None:
+            value = scroll_map.to_preview(self._editor_top_line(), self._preview_block_top)
+        else:
+            # 没有对应关系时（整篇渲染、大文件模式）按比例
+            source = self.editor.verticalScrollBar()
+            value = source.value() / max(source.maximum(), 1) * scrollbar.maximum()
+        self._scroll_other(scrollbar, value)
+    
+    def sync_editor_scroll(self):
+        """编辑区滚动到预览顶部对应的源码行"""
+        if (self._scroll_syncing or self.preview.relayouting or self.hibernated
+                or not get_setting('scroll_sync', True)):
+            return
+        scrollbar = self.editor.verticalScrollBar()
+        scroll_map = self.preview_updater.scroll_map
+        if scroll_map is not None:
+            line = scroll_map.to_source(self.preview.verticalScrollBar().value(), self._preview_block_top)
+            block = self.editor.document().findBlockByNumber(int(line))
+            if not block.isValid():
+                return
+            value = block.firstLineNumber() + (line - int(line)) * block.lineCount()
+        else:
+            source = self.preview.verticalScrollBar()
+            value = source.value() / max(source.maximum(), 1) * scrollbar.maximum()
+        self._scroll_other(scrollbar, value)
+    
+    def show_cached_render(self, text_hash):
+        """从磁盘渲染缓存显示预览和目录，没有缓存时返回 False
+
+        此时不切分文档，第一次编辑时整篇切分、后台渲染，之后按正常流程增量更新。
+        """
+        if self.editor.document().characterCount() < get_setting('render_cache_min_chars', RENDER_CACHE_MIN_CHARS):
+            return False
+        entry = render_cache.load(text_hash)
+        if entry is None:
+            return False
+        self.render_scheduler.cancel()
+        self._render_revision += 1  # 丢弃进行中的渲染结果
+        self._pending_render = None
+        self.renderer.invalidate()
+        self._rendered_hash = text_hash
+        fragments = entry["fragments"]
+        if fragments is not None:
+            fragments = [tuple(fragment) for fragment in fragments]
+        scroll_map = entry.get("scroll_map")
+        if scroll_map is not None:
+            scroll_map = ScrollMap(*scroll_map)
+        # 预览与目录都换成缓存中的内容，之前的片段对应关系不再可靠
+        self.preview_updater.reset()
+        self._apply_preview(entry["html"], fragments, scroll_map)
+        self._headings = []
         self.toc_tree.clear()
-        lines = text.split("\n")
-        headers = []
+        self._cached_block = CachedBlock(entry["headings"])
+        self.update_toc([], [self._cached_block])
+        return True
+    
+    def _store_render_cache(self, html, fragments):
+        """内容与磁盘文件一致时，把渲染结果写入磁盘渲染缓存"""
+        if (self._rendered_hash is None or self._cached_block is not None
+                or self.editor.document().characterCount() < get_setting('render_cache_min_chars', RENDER_CACHE_MIN_CHARS)):
+            return
+        headings = [(heading.line, heading.level, heading.title) for heading in self._headings]
+        QThreadPool.globalInstance().start(RenderCacheTask(self._rendered_hash, html, fragments, headings,
+                                                           self.preview_updater.scroll_map))
+    
+    def on_contents_change(self, position, chars_removed, chars_added):
+        """记录编辑涉及的行范围，供增量渲染使用"""
+        self._edit_revision += 1
+        self.render_scheduler.schedule()
+        self.set_modified()
+        if self.journal is not None and not self._loading:
+            self.journal.record(self.editor.document(), position, chars_removed, chars_added)
+        if self._preview_deferred:
+            # 开启预览时会整篇重新切分
+            return
+        document = self.editor.document()
+        first_line = document.findBlock(position).blockNumber()
+        last_block = document.findBlock(position + chars_added)
+        last_line = last_block.blockNumber() if last_block.isValid() else document.blockCount() - 1
+        line_count = document.blockCount()
+        self.renderer.note_change(first_line, max(first_line, last_line), line_count - self._line_count)
+        self._line_count = line_count
+    
+    def eventFilter(self, obj, event):
+        """开启跟踪时记录按键处理耗时：从按键事件开始到返回事件循环"""
+        if tracer.enabled and obj is self.editor and event.type() == QEvent.Type.KeyPress:
+            span = tracer.span("keystroke", self.editor.document().characterCount()).start()
+            QTimer.singleShot(0, span.finish)
+        return super().eventFilter(obj, event)
+    
+    def update_toc(self, removed, inserted):
+        """根据变化的块增量更新目录树"""
+        old = [heading for block in removed for heading in block.headings]
+        new = [heading for block in inserted for heading in block.headings]
+        if not old and not new:
+            return
+        # 变化区域之前的标题行号都小于区域起始行，二分定位
+        region_start = (removed or inserted)[0].start
+        lo = bisect.bisect_left(self._headings, region_start, key=lambda heading: heading.line)
+        self._headings[lo:lo + len(old)] = new
         
-        # 提取所有标题
-        for line in lines:
-            stripped_line = line.strip()
-            if stripped_line.startswith("#"):
-                level = 0
-                while level < len(stripped_line) and stripped_line[level] == "#":
-                    level += 1
-                if level > 0 and level <= 6:
-                    title = stripped_line[level:].strip()
-                    headers.append((level, title, lines.index(line)))
-        
-        # 构建目录树
-        nodes = {0: self.toc_tree.invisibleRootItem()}
-        for level, title, line_num in headers:
-            item = QTreeWidgetItem([title])
-            item.setData(0, Qt.ItemDataRole.UserRole, line_num)
-            # 移除这一行：item.clicked.connect(...)
-            
-            # 找到父节点
-            parent_level = level - 1
-            while parent_level not in nodes and parent_level > 0:
-                parent_level -= 1
+        # 级别和标题都没变的节点直接复用
+        prefix = 0
+        while prefix < min(len(old), len(new)) and self._reuse_toc_item(old[prefix], new[prefix]):
+            prefix += 1
+        suffix = 0
+        while (suffix < min(len(old), len(new)) - prefix
+               and self._reuse_toc_item(old[-1 - suffix], new[-1 - suffix])):
+            suffix += 1
+        old = old[prefix:len(old) - suffix]
+        new = new[prefix:len(new) - suffix]
+        if not old and not new:
+            return
+        
+        # 只是标题文字变了，原地改名
+        if len(old) == len(new) and all(o.level == n.level for o, n in zip(old, new)):
+            for o, n in zip(old, new):
+                self._transfer_toc_item(o, n)
+                n.item.setText(0, n.title)
+            return
+        
+        self._patch_toc_structure(lo + prefix, old, new)
+    
+    def _reuse_toc_item(self, old, new):
+        """级别和标题相同时，把旧标题的目录节点转交给新标题"""
+        if old.level != new.level or old.title != new.title:
+            return False
+        self._transfer_toc_item(old, new)
+        return True
+    
+    def _transfer_toc_item(self, old, new):
+        """让新标题接管旧标题的目录节点"""
+        if old is not new:
+            new.item = old.item
+            new.item.setData(0, Qt.ItemDataRole.UserRole, new)
+    
+    def _patch_toc_structure(self, start, old, new):
+        """标题层级发生变化时，移除旧节点、插入新节点，并调整受影响的后续节点的父节点"""
+        root = self.toc_tree.invisibleRootItem()
+        for heading in old:
+            (heading.item.parent() or root).removeChild(heading.item)
+        
+        # 由变化区域前一个标题的祖先链恢复层级栈
+        stack = []
+        if start > 0:
+            item = self._headings[start - 1].item
+            while item is not None:
+                stack.append(item.data(0, Qt.ItemDataRole.UserRole))
+                item = item.parent()
+            stack.reverse()
+        
+        # 后续标题的级别不高于变化区域内所有标题时，其层级不再受影响
+        min_level = min(heading.level for heading in old + new)
+        for index in range(start, len(self._headings)):
+            heading = self._headings[index]
+            previous_sibling = None
+            while stack and stack[-1].level >= heading.level:
+                previous_sibling = stack.pop()
+            parent = stack[-1].item if stack else None
             
-            nodes[parent_level].addChild(item)
-            nodes[level] = item
-
-        # 添加这段代码以连接 itemClicked 信号
-        self.toc_tree.itemClicked.connect(lambda item, column: self.jump_to_line(item.data(0, Qt.ItemDataRole.UserRole)))
+            if index < start + len(new):
+                heading.item = QTreeWidgetItem([heading.title])
+                heading.item.setData(0, Qt.ItemDataRole.UserRole, heading)
+                self._insert_toc_item(parent or root, previous_sibling, heading.item)
+            elif heading.item.parent() is not parent:
+                self._move_toc_item(parent or root, previous_sibling, heading.item)
+            elif heading.level <= min_level:
+                break
+            stack.append(heading)
+    
+    def _insert_toc_item(self, parent, previous_sibling, item):
+        """把节点插入到 previous_sibling 之后"""
+        index = parent.indexOfChild(previous_sibling.item) + 1 if previous_sibling else 0
+        parent.insertChild(index, item)
+    
+    def _move_toc_item(self, parent, previous_sibling, item):
+        """移动节点，保留其子树的展开和选中状态"""
+        subtree = [item]
+        for node in subtree:
+            subtree.extend(node.child(i) for i in range(node.childCount()))
+        expanded = [node for node in subtree if node.isExpanded()]
+        selected = [node for node in subtree if node.isSelected()]
+        (item.parent() or self.toc_tree.invisibleRootItem()).removeChild(item)
+        self._insert_toc_item(parent, previous_sibling, item)
+        for node in expanded:
+            node.setExpanded(True)
+        for node in selected:
+            node.setSelected(True)
+    
+    def on_toc_item_clicked(self, item, column):
+        """点击目录项时跳转到对应的标题"""
+        heading = item.data(0, Qt.ItemDataRole.UserRole)
+        if heading is not None:
+            self.jump_to_line(heading.line)
     
     def jump_to_line(self, line_num):
         """跳转到指定行"""
         cursor = self.editor.textCursor()
-        block = self.editor.document().findBlockByLineNumber(line_num)
+        block = self.editor.document().findBlockByNumber(line_num)
         if block.isValid():
             cursor.setPosition(block.position())
             self.editor.setTextCursor(cursor)
             self.editor.setFocus()
+            # 预览中对应的标题滚动到顶部
+            scroll_map = self.preview_updater.scroll_map
+            if scroll_map is not None and not self.hibernated:
+                self._scroll_other(self.preview.verticalScrollBar(),
+                                   scroll_map.to_preview(line_num, self._preview_block_top))
     
     def load_file(self):
         """加载文件内容"""
         try:
-            with open(self.file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                self.editor.setPlainText(content)
-                self.is_modified = False
+            threshold = get_setting('large_file_threshold_mb', LARGE_FILE_THRESHOLD_MB) * 1024 * 1024
+            size = os.path.getsize(self.file_path)
+            if size >= threshold:
+                self.load_large_file()
+                return
+            self._leave_large_file_mode()
+            self._reset_journal(None)
+            with tracer.span("load", size):
+                with open(self.file_path, 'r', encoding='utf-8') as f:
+                    content = f.read()
+                    self.editor.setPlainText(content)
+                    self.is_modified = False
+                self._disk_hash = content_hash(content)
+                del content
+                self._reset_journal(self._disk_hash)
+                # 内容没有变化的文件直接显示缓存的预览，否则立即渲染，不等待空闲
+                if not self.show_cached_render(self._disk_hash):
+                    self.render_scheduler.flush()
         except Exception as e:
             QMessageBox.warning(self, "错误", f"无法加载文件: {str(e)}")
     
-    def save_file(self, file_path=None):
-        """保存文件内容"""
-        if file_path:
+    def load_large_file(self):
+        """大文件模式：后台以内存映射方式分块读取，避免界面卡死和内存翻倍
+
+        加载期间编辑器只读，预览和目录推迟到用户点击按钮后再生成。
+        """
+        self.cancel_load()
+        self._load_id += 1
+        self._loading = True
+        self._load_incomplete = False
+        self._preview_deferred = True
+        self.render_scheduler.cancel()
+        self._reset_journal(None)
+        
+        # 清空旧内容和由旧内容生成的预览、目录
+        self.renderer.invalidate()
+        self._rendered_hash = None
+        self._headings = []
+        self._cached_block = None
+        self.toc_tree.clear()
+        self.preview.clear()
+        self.preview_updater.reset()
+        if self.highlighter is not None:
+            # 大文件模式下不做语法高亮
+            self.highlighter.attach(None)
+        self.editor.setReadOnly(True)
+        self.editor.clear()
+        
+        size_mb = os.path.getsize(self.file_path) / 1024 / 1024
+        self.large_file_label.setText(f"正在加载大文件（{size_mb:.0f} MB）...")
+        self.large_file_progress.setValue(0)
+        self.large_file_progress.show()
+        self.large_file_cancel_btn.show()
+        self.large_file_preview_btn.hide()
+        self.large_file_bar.show()
+        
+        self._loader = FileLoadTask(self._load_id, self.file_path, self._load_signals)
+        QThreadPool.globalInstance().start(self._loader)
+    
+    def _leave_large_file_mode(self):
+        """以普通方式重新加载文件前退出大文件模式"""
+        if not (self._loading or self._load_incomplete or self._preview_deferred):
+            return
+        self.cancel_load()
+        self._load_id += 1
+        self._loader = None
+        self._loading = False
+        self._load_incomplete = False
+        self._preview_deferred = False
+        self._line_count = self.editor.document().blockCount()
+        self.renderer.invalidate()
+        if self.highlighter is not None:
+            self.highlighter.attach(self.editor.document())
+        self.editor.setReadOnly(False)
+        self.large_file_bar.hide()
+    
+    def cancel_load(self):
+        """取消正在进行的大文件加载"""
+        if self._loader is not None:
+            self._loader.cancel()
+    
+    def on_load_progress(self, load_id, percent):
+        if load_id == self._load_id:
+            self.large_file_progress.setValue(percent)
+    
+    def on_load_finished(self, load_id, document, error):
+        """加载结束（完成、取消或失败），把加载得到的文档挂到编辑器上"""
+        if load_id != self._load_id:
+            document.deleteLater()
+            return
+        cancelled = self._loader.cancelled.is_set()
+        self._disk_hash = self._loader.text_hash
+        self._loader = None
+        self._attach_document(document)
+        self._loading = False
+        self.editor.moveCursor(QTextCursor.MoveOperation.Start)
+        self.large_file_progress.hide()
+        self.large_file_cancel_btn.hide()
+        self.large_file_preview_btn.show()
+        
+        if error or cancelled:
+            # 只加载了部分内容，保持只读，防止保存时截断原文件
+            self._load_incomplete = True
+            self.large_file_label.setText("加载未完成，当前只显示部分内容（只读）")
+            if error:
+                QMessageBox.warning(self, "错误", f"无法加载文件: {error}")
+        else:
+            self.editor.setReadOnly(False)
+            self.large_file_label.setText("大文件模式：预览和目录已暂停")
+        self.is_modified = False
+        if not self._load_incomplete:
+            self._reset_journal(self._disk_hash)
+            if self._pending_recovery is not None:
+                text, self._pending_recovery = self._pending_recovery, None
+                self.recover_text(text)
+    
+    def _attach_document(self, document):
+        """用后台加载的文档替换编辑器当前的文档"""
+        old = self.editor.document()
+        old.contentsChange.disconnect(self.on_contents_change)
+        # 编辑器自带的文档在 setDocument 时由编辑器自己释放，之前由大文件模式加载的文档需要手动释放
+        owned = old.parent() is self.editor
+        document.setParent(self.editor)
+        document.setDefaultFont(old.defaultFont())
+        document.setUndoRedoEnabled(True)
+        document.setDocumentLayout(QPlainTextDocumentLayout(document))
+        self.editor.setDocument(document)
+        document.contentsChange.connect(self.on_contents_change)
+        self._line_count = document.blockCount()
+        if owned:
+            old.deleteLater()
+    
+    def memory_estimate(self):
+        """粗略估计编辑区、预览区和渲染缓存占用的内存（字节）"""
+        editor_document = self.editor.document()
+        preview_document = self.preview.document()
+        return (editor_document.characterCount() * 2 + editor_document.blockCount() * EDITOR_BLOCK_BYTES
+                + preview_document.characterCount() * 2 + preview_document.blockCount() * PREVIEW_BLOCK_BYTES
+                + self.renderer.cache_bytes())
+    
+    def can_hibernate(self):
+        """未修改、没有在加载或保存的文档才能休眠"""
+        return not (self.is_modified or self._loading or self._save_in_flight is not None
+                    or self._conflict_prompt_open)
+    
+    def hibernate(self):
+        """释放预览、目录、渲染缓存和撤销记录，返回释放的估计字节数"""
+        before = self.memory_estimate()
+        self.hibernated = True
+        self.render_scheduler.cancel()
+        self._render_revision += 1  # 丢弃进行中的渲染结果
+        self._pending_render = None
+        self.renderer.invalidate()
+        self.renderer.clear_cache()
+        self._rendered_hash = None
+        self._headings = []
+        self._cached_block = None
+        self.toc_tree.clear()
+        self.preview.clear()
+        self.preview_updater.reset()
+        self.editor.document().clearUndoRedoStacks()
+        return before - self.memory_estimate()
+    
+    def wake(self):
+        """从休眠中恢复：整篇重新生成预览和目录"""
+        if not self.hibernated:
+            return
+        self.hibernated = False
+        self._line_count = self.editor.document().blockCount()
+        self.renderer.invalidate()
+        if not self.show_cached_render(content_hash(self.editor.toPlainText())):
+            self.render_scheduler.flush()
+    
+    def enable_preview(self):
+        """大文件模式下手动生成预览和目录"""
+        self._preview_deferred = False
+        self._line_count = self.editor.document().blockCount()
+        self.renderer.invalidate()
+        self.large_file_preview_btn.hide()
+        if not self._load_incomplete:
+            self.large_file_bar.hide()
+        self.render_scheduler.flush()
+    
+    def save_file(self, file_path=None, wait=False):
+        """保存文件内容
+
+        默认在后台线程写入，结果通过 on_save_finished 返回，返回值表示保存是否已受理；
+        wait=True 时在当前线程同步写入并返回是否成功，用于关闭标签页或窗口。
+        """
+        if self._loading or self._load_incomplete:
+            QMessageBox.warning(self, "错误", "文件尚未完整加载，不能保存")
+            return False
+        
+        if file_path and file_path != self.file_path:
             self.file_path = file_path
+            self._disk_hash = None
+            self.preview.set_source_path(file_path)
+            if self.journal is not None:
+                # 日志按路径保存，另存为后在新路径下重新开始
+                self.journal.reset(None)
+                self.journal = EditJournal(file_path)
         
         if not self.file_path:
             return False
         
-        try:
-            with open(self.file_path, 'w', encoding='utf-8') as f:
-                f.write(self.editor.toPlainText())
-            self.is_modified = False
+        if wait:
+            # 同步保存会写入最新内容，之前的后台保存结果不再需要处理
+            self.wait_for_save()
+            self._save_in_flight = None
+            self._save_pending = False
+            saved = self._save_now()
+            self._check_pending_disk_change()
+            return saved
+        if self._save_in_flight is not None:
+            # 正在写入，完成后再用最新内容保存一次
+            self._save_pending = True
             return True
+        self._start_save()
+        return True
+    
+    def _snapshot_for_save(self):
+        """取得要保存的文本和哈希，内容与磁盘一致时返回 None"""
+        text = self.editor.toPlainText()
+        text_hash = content_hash(text)
+        if text_hash == self._disk_hash:
+            self._mark_saved()
+            return None
+        return text, text_hash
+    
+    def _start_save(self):
+        """把当前内容的快照交给后台线程写入"""
+        snapshot = self._snapshot_for_save()
+        if snapshot is None:
+            return
+        text, text_hash = snapshot
+        self._save_id += 1
+        self._save_in_flight = (self._save_id, text_hash, self._edit_revision)
+        self._save_idle.clear()
+        QThreadPool.globalInstance().start(SaveTask(self._save_id, self.file_path, text, self._save_signals,
+                                                      self._save_idle))
+    
+    def _save_now(self):
+        """在当前线程同步保存"""
+        snapshot = self._snapshot_for_save()
+        if snapshot is None:
+            return True
+        text, text_hash = snapshot
+        try:
+            with tracer.span("save", len(text)):
+                atomic_write_text(self.file_path, text)
         except Exception as e:
             QMessageBox.warning(self, "错误", f"无法保存文件: {str(e)}")
             return False
+        self._disk_hash = text_hash
+        self._mark_saved()
+        self.file_saved.emit(self.file_path)
+        return True
+    
+    def check_disk_change(self):
+        """文件在外部被修改后调用：未修改的文档直接重新加载，已修改的询问用户"""
+        if self._save_in_flight is not None:
+            # 正在写入，此时读到的可能是自己写的内容，保存完成后再检查
+            self._disk_check_pending = True
+            return
+        if self._loading or self._conflict_prompt_open:
+            return
+        try:
+            threshold = get_setting('large_file_threshold_mb', LARGE_FILE_THRESHOLD_MB) * 1024 * 1024
+            if os.path.getsize(self.file_path) >= threshold:
+                # 大文件不在界面线程读取，内容未修改时按大文件模式重新加载
+                if not self.is_modified:
+                    self.load_file()
+                return
+            with open(self.file_path, 'r', encoding='utf-8') as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError):
+            # 文件被删除或暂时无法读取，保留编辑器中的内容
+            return
+        if content_hash(text) == self._disk_hash:
+            return
+        
+        if self.is_modified:
+            self._conflict_prompt_open = True
+            try:
+                reply = QMessageBox.question(
+                    self, "文件已更改",
+                    f"文件 '{os.path.basename(self.file_path)}' 已在外部被修改。\n"
+                    "是否重新加载？重新加载将丢弃当前未保存的修改。",
+                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+            finally:
+                self._conflict_prompt_open = False
+            if reply != QMessageBox.StandardButton.Yes:
+                return
+        self.reload_text(text)
+    
+    def reload_text(self, text):
+        """用磁盘上的新内容替换编辑器内容，保留光标和滚动位置，并且可以撤销"""
+        position = self.editor.textCursor().position()
+        scroll_value = self.editor.verticalScrollBar().value()
+        cursor = QTextCursor(self.editor.document())
+        cursor.beginEditBlock()
+        cursor.select(QTextCursor.SelectionType.Document)
+        cursor.insertText(text)
+        cursor.endEditBlock()
+        cursor.setPosition(min(position, self.editor.document().characterCount() - 1))
+        self.editor.setTextCursor(cursor)
+        self.editor.verticalScrollBar().setValue(scroll_value)
+        self._disk_hash = content_hash(text)
+        self._mark_saved()
+    
+    def wait_for_save(self):
+        """等待正在进行的后台保存写完文件（事件由 SaveTask 在工作线程中设置）"""
+        self._save_idle.wait()
+    
+    def on_save_finished(self, save_id, path, error):
+        """后台保存完成，在界面线程中更新状态"""
+        if self._save_in_flight is None or self._save_in_flight[0] != save_id:
+            return
+        _, text_hash, revision = self._save_in_flight
+        self._save_in_flight = None
+        if error:
+            self._save_pending = False
+            QMessageBox.warning(self, "错误", f"无法保存文件: {error}")
+            self._check_pending_disk_change()
+            return
+        if path == self.file_path:
+            self._disk_hash = text_hash
+            # 保存前最后一次渲染的就是保存的内容时，用预览片段写入渲染缓存
+            if (self._rendered_hash == text_hash and not self._render_in_flight
+                    and self._pending_render is None and self.preview_updater.fragments is not None):
+                fragments = self.preview_updater.fragments
+                self._store_render_cache("\n".join(html for html, _ in fragments if html), fragments)
+            # 写入期间没有新的编辑才算保存完成
+            if self._edit_revision == revision:
+                self._mark_saved()
+            elif self.journal is not None and self.journal.base_hash is not None:
+                # 磁盘内容变了，之后的编辑不能再基于旧内容重放，把当前全文写入日志
+                self.journal.base_hash = text_hash
+                try:
+                    self.journal.checkpoint(self.editor.toPlainText())
+                except OSError as e:
+                    print(f"写入编辑日志失败: {str(e)}")
+        self.file_saved.emit(path)
+        if self._save_pending:
+            self._save_pending = False
+            self._start_save()
+        else:
+            self._check_pending_disk_change()
+    
+    def _check_pending_disk_change(self):
+        """补做后台保存期间推迟的外部修改检查"""
+        if self._disk_check_pending:
+            self._disk_check_pending = False
+            self.check_disk_change()
+    
+    def _mark_saved(self):
+        """清除已修改状态并更新标签标题"""
+        self.is_modified = False
+        self._reset_journal(self._disk_hash)
+        self._update_tab_title()
+    
+    def _reset_journal(self, base_hash):
+        """内容与磁盘一致时丢弃编辑日志；base_hash 为 None 时暂停记录（加载期间）"""
+        if self.journal is not None:
+            self.journal.reset(base_hash)
+    
+    def discard_journal(self):
+        """关闭文档时丢弃编辑日志"""
+        self._reset_journal(None)
+    
+    def recover_text(self, text):
+        """用编辑日志恢复的内容替换编辑器内容，可以撤销，文档标记为已修改"""
+        if self._loading:
+            self._pending_recovery = text
+            return
+        cursor = QTextCursor(self.editor.document())
+        cursor.beginEditBlock()
+        cursor.select(QTextCursor.SelectionType.Document)
+        cursor.insertText(text)
+        cursor.endEditBlock()
     
     def set_modified(self):
         """设置文件为已修改状态"""
+        if self._loading:
+            return
         self.is_modified = True
-        # 通知主窗口更新标签标题
+        self._update_tab_title()
+    
+    def _update_tab_title(self):
+        """通知主窗口更新标签标题"""
         if self.parent() and hasattr(self.parent(), 'update_tab_title'):
             index = self.parent().indexOf(self)
             self.parent().update_tab_title(index)
@@ -353,6 +3289,10 @@ class HomeWidget(QWidget):
             }
         """)
         
+        self.recent_notebooks_list.itemDoubleClicked.connect(
+            lambda item: self.parent.open_notebook(item.data(Qt.ItemDataRole.UserRole))
+        )
+        
         # 填充最近笔记本数据
         self.update_recent_notebooks()
         
@@ -376,6 +3316,10 @@ class HomeWidget(QWidget):
             }
         """)
         
+        self.recent_docs_list.itemDoubleClicked.connect(
+            lambda item: self.parent.open_document(item.data(Qt.ItemDataRole.UserRole))
+        )
+        
         # 填充最近文档数据
         self.update_recent_docs()
         
@@ -469,31 +3413,20 @@ class HomeWidget(QWidget):
     def update_recent_notebooks(self):
         """更新最近笔记本列表"""
         self.recent_notebooks_list.clear()
-        # 使用父窗口的recent_notebooks数据
+        # 使用内存中的最近使用记录，不读取磁盘
         for notebook_path in self.parent.recent_notebooks[:5]:  # 只显示最近5个
             item = QListWidgetItem(os.path.basename(notebook_path))
             item.setData(Qt.ItemDataRole.UserRole, notebook_path)
+            item.setToolTip(notebook_path)
             self.recent_notebooks_list.addItem(item)
-        
-        # 连接双击事件
-        self.recent_notebooks_list.itemDoubleClicked.connect(
-            lambda item: self.parent.open_notebook(item.data(Qt.ItemDataRole.UserRole))
-        )
     
     def update_recent_docs(self):
         """更新最近文档列表"""
         self.recent_docs_list.clear()
-        # 这里需要实现从设置或历史记录中加载最近文档
-        # 为了演示，我们添加一些示例项目
-        sample_docs = [
-            "README.md",
-            "笔记1.md",
-            "项目计划.md",
-            "会议记录.md"
-        ]
-        
-        for doc in sample_docs:
-            item = QListWidgetItem(doc)
+        for file_path in settings_store.recent('recent_documents')[:5]:  # 只显示最近5个
+            item = QListWidgetItem(os.path.basename(file_path))
+            item.setData(Qt.ItemDataRole.UserRole, file_path)
+            item.setToolTip(file_path)
             self.recent_docs_list.addItem(item)
 
     
@@ -502,6 +3435,79 @@ class HomeWidget(QWidget):
         notebook_path = item.toolTip()
         self.parent.open_notebook(notebook_path)
 
+class SearchPanel(QWidget):
+    """笔记本全文搜索面板"""
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.parent = parent
+        # 输入停顿后再搜索
+        self.search_timer = QTimer(self)
+        self.search_timer.setSingleShot(True)
+        self.search_timer.setInterval(200)
+        self.search_timer.timeout.connect(self.run_search)
+        self.init_ui()
+    
+    def init_ui(self):
+        layout = QVBoxLayout(self)
+        layout.setContentsMargins(6, 6, 6, 6)
+        
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("搜索笔记本，多个词用空格分隔")
+        self.search_input.textChanged.connect(self.search_timer.start)
+        self.search_input.returnPressed.connect(self.run_search)
+        
+        self.result_label = QLabel()
+        self.result_label.setStyleSheet("color: #888888;")
+        
+        self.result_list = QListWidget()
+        self.result_list.setWordWrap(True)
+        self.result_list.itemClicked.connect(self.open_result)
+        
+        layout.addWidget(self.search_input)
+        layout.addWidget(self.result_label)
+        layout.addWidget(self.result_list)
+    
+    def run_search(self):
+        """执行搜索并显示结果"""
+        self.search_timer.stop()
+        self.result_list.clear()
+        query = self.search_input.text().strip()
+        if not query:
+            self.result_label.clear()
+            return
+        if not self.parent.notebook_indexes:
+            self.result_label.setText("请先打开笔记本")
+            return
+        
+        results = self.parent.search_notebooks(query)
+        for _, file_path, title, line, snippet in results:
+            item = QListWidgetItem(f"{title}（第 {line + 1} 行）\n{snippet}")
+            item.setToolTip(file_path)
+            item.setData(Qt.ItemDataRole.UserRole, (file_path, line))
+            self.result_list.addItem(item)
+        self.result_label.setText(f"找到 {len(results)} 条结果")
+    
+    def open_result(self, item):
+        """打开搜索结果"""
+        file_path, line = item.data(Qt.ItemDataRole.UserRole)
+        self.parent.open_search_result(file_path, line)
+
+
+class DocumentPlaceholder(QWidget):
+    """恢复会话时使用的占位标签页
+
+    只记录文件路径和光标、滚动位置，第一次切换到该标签页时才替换为真正的 MarkdownEditor。
+    """
+    is_modified = False
+
+    def __init__(self, file_path, cursor_position=0, scroll_value=0, parent=None):
+        super().__init__(parent)
+        self.file_path = file_path
+        self.cursor_position = cursor_position
+        self.scroll_value = scroll_value
+        self.last_active = time.monotonic()
+
+
 class CustomTabWidget(QTabWidget):
     """自定义标签页组件"""
     def __init__(self, parent=None):
@@ -512,6 +3518,92 @@ class CustomTabWidget(QTabWidget):
         
         # 主页标签不能关闭
         self.home_tab_index = -1
+        
+        # 标签页休眠策略：定时检查空闲时间，打开新标签页时检查内存预算
+        self._current_widget = None  # 上一个当前标签页，切走时记录时间，空闲时间从这时算起
+        self.currentChanged.connect(self.on_current_changed)
+        self.hibernate_timer = QTimer(self)
+        self.hibernate_timer.setInterval(TAB_HIBERNATE_CHECK_MS)
+        self.hibernate_timer.timeout.connect(self.hibernate_tabs)
+        self.hibernate_timer.start()
+    
+    def tabInserted(self, index):
+        super().tabInserted(index)
+        QTimer.singleShot(0, self.hibernate_tabs)
+    
+    def on_current_changed(self, index):
+        """切换标签页时记录使用时间，唤醒休眠的编辑器"""
+        now = time.monotonic()
+        previous = self._current_widget
+        widget = self.widget(index)
+        self._current_widget = widget
+        if previous is not None and previous is not widget:
+            try:
+                if self.indexOf(previous) != -1:
+                    previous.last_active = now
+            except RuntimeError:
+                # 标签页已关闭，对象已删除
+                pass
+        if widget is None:
+            return
+        widget.last_active = now
+        if getattr(widget, 'hibernated', False):
+            widget.wake()
+            self.setTabToolTip(index, widget.file_path)
+    
+    def hibernate_tabs(self):
+        """休眠后台标签页：超过空闲时间的，以及估计内存超出预算时最久未使用的"""
+        idle_seconds = get_setting('tab_hibernate_idle_minutes', TAB_HIBERNATE_IDLE_MINUTES) * 60
+        budget = get_setting('tab_memory_budget_mb', TAB_MEMORY_BUDGET_MB) * 1024 * 1024
+        unload_text = get_setting('tab_hibernate_unload_text', False)
+        now = time.monotonic()
+        total = 0
+        candidates = []
+        for i in range(self.count()):
+            widget = self.widget(i)
+            if not isinstance(widget, MarkdownEditor):
+                continue
+            estimate = widget.memory_estimate()
+            total += estimate
+            if i != self.currentIndex() and widget.can_hibernate() and (unload_text or not widget.hibernated):
+                candidates.append(widget)
+        
+        freed_total = 0
+        hibernated = 0
+        for widget in sorted(candidates, key=lambda widget: widget.last_active):
+            if now - widget.last_active < idle_seconds and total <= budget:
+                break
+            index = self.indexOf(widget)
+            title = self.tabText(index)
+            if unload_text:
+                freed = widget.memory_estimate()
+                self._unload_tab(index)
+            else:
+                freed = widget.hibernate()
+            total -= freed
+            freed_total += freed
+            hibernated += 1
+            self.setTabToolTip(self.indexOf(widget) if not unload_text else index,
+                               f"{widget.file_path}\n已休眠，约释放 {freed / 1024 / 1024:.1f} MB")
+            print(f"休眠标签页 {title}: 约释放 {freed / 1024 / 1024:.1f} MB")
+        if hibernated and hasattr(self.parent, 'statusBar'):
+            self.parent.statusBar().showMessage(
+                f"已休眠 {hibernated} 个后台标签页，约释放 {freed_total / 1024 / 1024:.1f} MB")
+    
+    def _unload_tab(self, index):
+        """把编辑器换成占位标签页，切换回来时从磁盘重新加载"""
+        editor = self.widget(index)
+        placeholder = DocumentPlaceholder(editor.file_path, editor.editor.textCursor().position(),
+                                          editor.editor.verticalScrollBar().value())
+        placeholder.last_active = editor.last_active
+        title = self.tabText(index)
+        editor.cancel_load()
+        editor.discard_journal()
+        if hasattr(self.parent, 'file_watcher'):
+            self.parent.file_watcher.unwatch_file(editor.file_path)
+        self.removeTab(index)
+        self.insertTab(index, placeholder, title)
+        editor.deleteLater()
     
     def set_home_tab(self, index):
         """设置主页标签"""
@@ -535,12 +3627,24 @@ class CustomTabWidget(QTabWidget):
                 return
             elif reply == QMessageBox.StandardButton.Save:
                 if hasattr(widget, 'save_file'):
-                    if not widget.save_file():
+                    if not widget.save_file(wait=True):
                         # 如果保存失败，尝试另存为
                         file_path, _ = QFileDialog.getSaveFileName(self, "另存为", "", "Markdown文件 (*.md)")
-                        if file_path and not widget.save_file(file_path):
+                        if file_path and not widget.save_file(file_path, wait=True):
                             return
         
+        # 停止仍在进行的后台加载
+        if hasattr(widget, 'cancel_load'):
+            widget.cancel_load()
+        
+        # 已保存或选择了不保存，不再需要恢复
+        if hasattr(widget, 'discard_journal'):
+            widget.discard_journal()
+        
+        # 不再监视已关闭的文档
+        if getattr(widget, 'file_path', None) and hasattr(self.parent, 'file_watcher'):
+            self.parent.file_watcher.unwatch_file(widget.file_path)
+        
         # 关闭标签
         self.removeTab(index)
     
@@ -613,13 +3717,843 @@ class AboutDialog(QDialog):
         
         self.setLayout(layout)
 
+_TITLE_RE = re.compile(r'^#{1,6}[ \t]+(.+?)[ \t#]*$', re.MULTILINE)
+
+# 全文搜索的分词：中日韩文字按相邻两字切分（二元组），其他文字按单词切分
+_CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+_SEARCH_TOKEN_RE = re.compile(f'([{_CJK_CHARS}]+)|[^\\W{_CJK_CHARS}]+')
+SEARCH_BLOCK_MAX_LINES = 20  # 全文索引中每条记录最多包含的行数
+
+def search_tokens(text, query=False):
+    """把文本切分为全文索引使用的词
+
+    连续的中文按二元组切分，并额外收录最后一个字，这样单字查询可以用前缀匹配找到
+    任意位置的字。query=True 时用于切分查询词，不收录末字。
+    """
+    tokens = []
+    for match in _SEARCH_TOKEN_RE.finditer(text):
+        run = match.group(1)
+        if run is None:
+            tokens.append(match.group(0).lower())
+        elif len(run) == 1 or not query:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+            tokens.append(run[-1])
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+def _search_blocks(text):
+    """把文档按空行切分为全文索引的记录，返回 [(起始行号, 文本)]"""
+    blocks = []
+    start = 0
+    lines = []
+    for number, line in enumerate(text.split("\n")):
+        if not line.strip():
+            if lines:
+                blocks.append((start, "\n".join(lines)))
+                lines = []
+            continue
+        if not lines:
+            start = number
+        lines.append(line)
+        if len(lines) >= SEARCH_BLOCK_MAX_LINES:
+            blocks.append((start, "\n".join(lines)))
+            lines = []
+    if lines:
+        blocks.append((start, "\n".join(lines)))
+    return blocks
+
+def _search_snippet(text, terms, width=80):
+    """在记录中找到第一个查询词，返回 (相对行号, 所在行的摘要)"""
+    lowered = text.lower()
+    positions = [position for position in (lowered.find(term.lower()) for term in terms) if position >= 0]
+    position = min(positions) if positions else 0
+    line_start = text.rfind("\n", 0, position) + 1
+    line_end = text.find("\n", position)
+    line = text[line_start:line_end if line_end >= 0 else len(text)]
+    offset = position - line_start
+    begin = max(0, min(offset - width // 3, len(line) - width))
+    snippet = line[begin:begin + width].strip()
+    if begin > 0:
+        snippet = "..." + snippet
+    if begin + width < len(line):
+        snippet += "..."
+    return text.count("\n", 0, position), snippet
+
+
+class NotebookIndex:
+    """笔记本文件索引
+
+    把笔记本中所有Markdown文件的路径、大小、修改时间、内容哈希和标题保存在
+    ~/.marknote/indexes 下的 SQLite 数据库中。打开笔记本时直接读取索引，
+    由后台线程调用 refresh() 增量刷新：目录的修改时间没变时不重新列出目录，
+    文件的大小和修改时间没变时不重新读取内容。
+
+    同一数据库中还有按段落切分的 FTS5 全文索引，用于 search()。
+    """
+    SCHEMA_VERSION = 2
+    COMMIT_INTERVAL = 500  # 首次建立索引时每处理这么多文件提交一次
+
+    def __init__(self, notebook_path):
+        self.notebook_path = os.path.abspath(notebook_path)
+        index_dir = os.path.join(os.path.expanduser("~"), ".marknote", "indexes")
+        os.makedirs(index_dir, exist_ok=True)
+        name = hashlib.sha1(self.notebook_path.encode('utf-8', 'surrogatepass')).hexdigest()
+        self.db_path = os.path.join(index_dir, f"{name}.db")
+        self._refresh_lock = threading.Lock()
+        self._init_db()
+
+    def _connect(self):
+        # 每个线程使用自己的连接；WAL 模式下后台刷新时界面线程仍可读取
+        connection = sqlite3.connect(self.db_path, timeout=30)
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        return connection
+
+    def _init_db(self):
+        """创建数据表；数据库版本不符或已损坏时重建"""
+        try:
+            with closing(self._connect()) as connection:
+                self._create_tables(connection)
+                return
+        except sqlite3.DatabaseError as e:
+            print(f"笔记本索引已损坏，重新建立: {str(e)}")
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.db_path + suffix)
+            except FileNotFoundError:
+                pass
+        with closing(self._connect()) as connection:
+            self._create_tables(connection)
+
+    def _create_tables(self, connection):
+        with connection:
+            version = connection.execute("PRAGMA user_version").fetchone()[0]
+            if version != self.SCHEMA_VERSION:
+                for table in ("dirs", "files", "blocks", "search"):
+                    connection.execute(f"DROP TABLE IF EXISTS {table}")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS dirs ("
+                "path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS files ("
+                "path TEXT PRIMARY KEY, dir TEXT, size INTEGER, mtime_ns INTEGER, hash TEXT, title TEXT)")
+            # 全文索引：blocks 保存每段的位置和原文，search 的 rowid 与 blocks.id 对应。
+            # search 不另存分词结果（content=''），删除时由原文重新分词
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS blocks ("
+                "id INTEGER PRIMARY KEY, path TEXT, line INTEGER, text TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS blocks_path ON blocks(path)")
+            connection.execute("CREATE VIRTUAL TABLE IF NOT EXISTS search USING fts5(tokens, content='')")
+            connection.execute(f"PRAGMA user_version={self.SCHEMA_VERSION}")
+
+    def is_built(self):
+        """索引是否至少完整刷新过一次"""
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT 1 FROM dirs WHERE path = ''").fetchone() is not None
+
+    def directories(self):
+        """返回索引中的全部目录的绝对路径"""
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT path FROM dirs").fetchall()
+        return [os.path.join(self.notebook_path, path) if path else self.notebook_path for path, in rows]
+
+    def files(self):
+        """返回索引中的全部文件 [(绝对路径, 标题)]，按路径排序"""
+        with closing(self._connect()) as connection:
+            rows = connection.execute("SELECT path, title FROM files ORDER BY path").fetchall()
+        return [(os.path.join(self.notebook_path, path), title) for path, title in rows]
+
+    def refresh(self):
+        """增量刷新索引
+
+        返回 (新增, 修改, 删除) 三个绝对路径列表；已有刷新在进行时直接返回 None。
+        """
+        if not self._refresh_lock.acquire(blocking=False):
+            return None
+        try:
+            return self._refresh()
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self):
+        with closing(self._connect()) as connection:
+            known_dirs = {}
+            children = defaultdict(list)
+            for path, parent, mtime_ns in connection.execute("SELECT path, parent, mtime_ns FROM dirs"):
+                known_dirs[path] = mtime_ns
+                if parent is not None:
+                    children[parent].append(path)
+            known_files = {}
+            files_in_dir = defaultdict(list)
+            for path, directory, size, mtime_ns in connection.execute("SELECT path, dir, size, mtime_ns FROM files"):
+                known_files[path] = (size, mtime_ns)
+                files_in_dir[directory].append(path)
+
+            seen_dirs = {}    # 相对路径 -> (上级目录, 修改时间)
+            seen_files = {}   # 相对路径 -> (所在目录, os.stat_result)
+            stack = [('', None)]
+            while stack:
+                directory, parent = stack.pop()
+                full_dir = os.path.join(self.notebook_path, directory)
+                try:
+                    mtime_ns = os.stat(full_dir).st_mtime_ns
+                except OSError:
+                    continue
+                if known_dirs.get(directory) == mtime_ns:
+                    seen_dirs[directory] = (parent, mtime_ns)
+                    # 目录项没有变化，沿用索引中的子目录和文件，只检查文件本身是否修改过
+                    stack.extend((child, directory) for child in children[directory])
+                    for path in files_in_dir[directory]:
+                        try:
+                            seen_files[path] = (directory, os.stat(os.path.join(self.notebook_path, path)))
+                        except OSError:
+                            pass
+                    continue
+                try:
+                    with os.scandir(full_dir) as entries:
+                        for entry in entries:
+                            # 跳过 .git 等隐藏目录和文件
+                            if entry.name.startswith('.'):
+                                continue
+                            path = os.path.join(directory, entry.name)
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append((path, directory))
+                            elif entry.name.lower().endswith(".md") and entry.is_file():
+                                seen_files[path] = (directory, entry.stat())
+                except OSError:
+                    continue
+                seen_dirs[directory] = (parent, mtime_ns)
+
+            removed = [path for path in known_files if path not in seen_files]
+            with connection:
+                for path in removed:
+                    self._remove_file(connection, path)
+            added, changed = self._update_files(connection, seen_files, known_files)
+            with connection:
+                connection.executemany("DELETE FROM dirs WHERE path = ?",
+                                       [(path,) for path in known_dirs if path not in seen_dirs])
+                connection.executemany(
+                    "INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)",
+                    [(path, parent, mtime_ns) for path, (parent, mtime_ns) in seen_dirs.items()
+                     if known_dirs.get(path) != mtime_ns])
+
+        return tuple([os.path.join(self.notebook_path, path) for path in paths]
+                     for paths in (added, changed, removed))
+
+    def refresh_dirs(self, dir_paths):
+        """重新列出指定的目录，返回值与 refresh() 相同
+
+        用于响应文件监视器报告的目录变化：只列出这些目录本身，新出现的子目录递归建立索引，
+        消失的子目录连同其下的文件一起删除，已索引的其他子目录不再检查。
+        """
+        with self._refresh_lock, closing(self._connect()) as connection:
+            stack = []
+            for dir_path in dir_paths:
+                directory = os.path.relpath(os.path.abspath(dir_path), self.notebook_path)
+                if directory == os.curdir:
+                    stack.append('')
+                elif not directory.startswith(os.pardir):
+                    stack.append(directory)
+            seen_files = {}
+            known_files = {}
+            removed = []
+            removed_dirs = []
+            listed_dirs = []
+            while stack:
+                directory = stack.pop()
+                full_dir = os.path.join(self.notebook_path, directory)
+                try:
+                    mtime_ns = os.stat(full_dir).st_mtime_ns
+                    with os.scandir(full_dir) as entries:
+                        entries = [entry for entry in entries if not entry.name.startswith('.')]
+                except OSError:
+                    removed_dirs.append(directory)
+                    continue
+                known_children = {path for path, in connection.execute(
+                    "SELECT path FROM dirs WHERE parent = ?", (directory,))}
+                known_in_dir = {path: (size, mtime) for path, size, mtime in connection.execute(
+                    "SELECT path, size, mtime_ns FROM files WHERE dir = ?", (directory,))}
+                children = set()
+                for entry in entries:
+                    path = os.path.join(directory, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        children.add(path)
+                        if path not in known_children:
+                            stack.append(path)
+                    elif entry.name.lower().endswith(".md") and entry.is_file():
+                        seen_files[path] = (directory, entry.stat())
+                known_files.update(known_in_dir)
+                removed.extend(path for path in known_in_dir if path not in seen_files)
+                removed_dirs.extend(known_children - children)
+                listed_dirs.append((directory, os.path.dirname(directory) if directory else None, mtime_ns))
+
+            with connection:
+                for directory in removed_dirs:
+                    # 目录已删除：删除其下的全部文件和子目录
+                    prefix = directory + os.sep
+                    removed.extend(path for path, in connection.execute(
+                        "SELECT path FROM files WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)))
+                    connection.execute("DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?",
+                                       (directory, len(prefix), prefix))
+                for path in removed:
+                    self._remove_file(connection, path)
+                connection.executemany("INSERT OR REPLACE INTO dirs VALUES (?, ?, ?)", listed_dirs)
+            added, changed = self._update_files(connection, seen_files, known_files)
+        return tuple([os.path.join(self.notebook_path, path) for path in paths]
+                     for paths in (added, changed, removed))
+
+    def refresh_files(self, file_paths):
+        """只刷新指定的文件（保存或外部修改后调用），返回值与 refresh() 相同"""
+        with self._refresh_lock, closing(self._connect()) as connection:
+            seen_files = {}
+            known_files = {}
+            removed = []
+            for file_path in file_paths:
+                path = os.path.relpath(os.path.abspath(file_path), self.notebook_path)
+                if path.startswith(os.pardir) or not path.lower().endswith(".md"):
+                    continue
+                row = connection.execute("SELECT size, mtime_ns FROM files WHERE path = ?", (path,)).fetchone()
+                if row is not None:
+                    known_files[path] = row
+                try:
+                    seen_files[path] = (os.path.dirname(path), os.stat(file_path))
+                except OSError:
+                    if row is not None:
+                        removed.append(path)
+            with connection:
+                for path in removed:
+                    self._remove_file(connection, path)
+            added, changed = self._update_files(connection, seen_files, known_files)
+        return tuple([os.path.join(self.notebook_path, path) for path in paths]
+                     for paths in (added, changed, removed))
+
+    def _update_files(self, connection, seen_files, known_files):
+        """重新读取大小或修改时间有变化的文件，返回 (新增, 修改) 的相对路径"""
+        added, changed = [], []
+        pending = 0
+        try:
+            for path, (directory, st) in seen_files.items():
+                known = known_files.get(path)
+                if known == (st.st_size, st.st_mtime_ns):
+                    continue
+                try:
+                    with open(os.path.join(self.notebook_path, path), 'r', encoding='utf-8', errors='replace') as f:
+                        text = f.read()
+                except OSError:
+                    continue
+                match = _TITLE_RE.search(text)
+                # 标题取第一个标题行，没有时用文件名
+                title = match.group(1) if match else os.path.splitext(os.path.basename(path))[0]
+                self._remove_file(connection, path)
+                connection.execute("INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)",
+                                   (path, directory, st.st_size, st.st_mtime_ns, content_hash(text), title))
+                for line, block in _search_blocks(text):
+                    block_id = connection.execute("INSERT INTO blocks (path, line, text) VALUES (?, ?, ?)",
+                                                  (path, line, block)).lastrowid
+                    connection.execute("INSERT INTO search (rowid, tokens) VALUES (?, ?)",
+                                       (block_id, " ".join(search_tokens(block))))
+                (changed if known else added).append(path)
+                pending += 1
+                if pending >= self.COMMIT_INTERVAL:
+                    connection.commit()
+                    pending = 0
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        return added, changed
+
+    def _remove_file(self, connection, path):
+        """从索引中删除一个文件及其全文索引记录"""
+        blocks = connection.execute("SELECT id, text FROM blocks WHERE path = ?", (path,)).fetchall()
+        connection.executemany("INSERT INTO search (search, rowid, tokens) VALUES ('delete', ?, ?)",
+                               [(block_id, " ".join(search_tokens(text))) for block_id, text in blocks])
+        connection.execute("DELETE FROM blocks WHERE path = ?", (path,))
+        connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def search(self, query, limit=50):
+        """全文搜索
+
+        查询按空白分为多个词，每个词都要出现；返回按相关度排序的
+        [(相关度, 绝对路径, 标题, 行号, 摘要)]，相关度越小越相关。
+        """
+        terms = query.split()
+        phrases = []
+        for number, term in enumerate(terms):
+            tokens = search_tokens(term, query=True)
+            if not tokens:
+                continue
+            # 单个汉字和最后一个词用前缀匹配，边输入边搜索时也能找到结果
+            prefix = "*" if len(tokens[-1]) == 1 and not tokens[-1].isascii() or number == len(terms) - 1 else ""
+            phrases.append(f'"{" ".join(tokens)}"{prefix}')
+        if not phrases:
+            return []
+        # 只有单字的查询几乎匹配所有段落，对全部结果排序太慢，只对最先找到的结果排序
+        order = "ORDER BY rank " if any(len(term) > 1 for term in terms) else ""
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT hits.rank, blocks.path, files.title, blocks.line, blocks.text "
+                f"FROM (SELECT rowid, rank FROM search WHERE search MATCH ? {order}LIMIT ?) AS hits "
+                "JOIN blocks ON blocks.id = hits.rowid LEFT JOIN files ON files.path = blocks.path "
+                "ORDER BY hits.rank",
+                (" AND ".join(phrases), limit)).fetchall()
+        results = []
+        for rank, path, title, line, text in rows:
+            offset, snippet = _search_snippet(text, terms)
+            results.append((rank, os.path.join(self.notebook_path, path), title, line + offset, snippet))
+        return results
+
+
+class IndexRefreshSignals(QObject):
+    """索引刷新任务的信号"""
+    finished = Signal(str, object, bool)  # 笔记本路径, (新增, 修改, 删除) 或 None, 是否为完整刷新
+
+
+class IndexRefreshTask(QRunnable):
+    """在线程池中增量刷新笔记本索引
+
+    指定 file_paths 或 dir_paths 时只刷新这些文件和目录，否则刷新整个笔记本。
+    """
+    def __init__(self, index, signals, file_paths=None, dir_paths=None):
+        super().__init__()
+        self.index = index
+        self.signals = signals
+        self.file_paths = file_paths
+        self.dir_paths = dir_paths
+
+    def run(self):
+        full = self.file_paths is None and self.dir_paths is None
+        try:
+            with tracer.span("scan") as span:
+                if full:
+                    changes = self.index.refresh()
+                else:
+                    changes = ([], [], [])
+                    if self.dir_paths:
+                        changes = self.index.refresh_dirs(self.dir_paths)
+                    if self.file_paths:
+                        changes = tuple(a + b for a, b in zip(changes, self.index.refresh_files(self.file_paths)))
+                if changes is not None:
+                    # 笔记本扫描的大小为有变化的文件数
+                    span.size = sum(len(paths) for paths in changes)
+        except Exception as e:
+            print(f"刷新笔记本索引失败: {str(e)}")
+            changes = None
+        try:
+            self.signals.finished.emit(self.index.notebook_path, changes, full)
+        except RuntimeError:
+            pass
+
+
+class FileWatcher(QObject):
+    """监视打开的文档和笔记本目录的变化
+
+    基于 QFileSystemWatcher（Linux 上即 inotify）。git checkout 之类的操作会在短时间内
+    产生大量事件，这里把它们合并后以批次的形式通过 changed 信号发出。
+    """
+    changed = Signal(object, object)  # 变化的文件路径集合, 变化的目录路径集合
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self.on_file_changed)
+        self.watcher.directoryChanged.connect(self.on_directory_changed)
+        self._files = set()               # 需要监视的文件
+        self._notebook_dirs = {}          # 笔记本路径 -> 需要监视的目录集合
+        self._changed_files = set()
+        self._changed_dirs = set()
+        
+        # 与渲染调度相同的做法：停止变化后处理，持续变化时也不超过最长延迟
+        self._idle_timer = QTimer(self)
+        self._idle_timer.setSingleShot(True)
+        self._idle_timer.setInterval(get_setting('watch_debounce_ms', WATCH_DEBOUNCE_MS))
+        self._idle_timer.timeout.connect(self.flush)
+        self._deadline_timer = QTimer(self)
+        self._deadline_timer.setSingleShot(True)
+        self._deadline_timer.setInterval(get_setting('watch_max_delay_ms', WATCH_MAX_DELAY_MS))
+        self._deadline_timer.timeout.connect(self.flush)
+
+    def watch_file(self, file_path):
+        self._files.add(file_path)
+        if file_path not in self.watcher.files():
+            self.watcher.addPath(file_path)
+
+    def unwatch_file(self, file_path):
+        self._files.discard(file_path)
+        if file_path in self.watcher.files():
+            self.watcher.removePath(file_path)
+
+    def set_notebook_dirs(self, notebook_path, dir_paths):
+        """设置笔记本需要监视的目录，替换之前的设置"""
+        dir_paths = set(dir_paths)
+        old = self._notebook_dirs.get(notebook_path, set())
+        self._notebook_dirs[notebook_path] = dir_paths
+        still_wanted = set().union(*self._notebook_dirs.values())
+        watched = set(self.watcher.directories())
+        removed = [path for path in old - dir_paths if path in watched and path not in still_wanted]
+        if removed:
+            self.watcher.removePaths(removed)
+        added = [path for path in dir_paths - watched if os.path.isdir(path)]
+        if added:
+            failed = self.watcher.addPaths(added)
+            if failed:
+                print(f"无法监视 {len(failed)} 个目录，可能超过了系统的监视数量上限")
+
+    def on_file_changed(self, file_path):
+        self._changed_files.add(file_path)
+        self._schedule()
+
+    def on_directory_changed(self, dir_path):
+        self._changed_dirs.add(dir_path)
+        self._schedule()
+
+    def _schedule(self):
+        self._idle_timer.start()
+        if not self._deadline_timer.isActive():
+            self._deadline_timer.start()
+
+    def flush(self):
+        """发出合并后的变化批次"""
+        self._idle_timer.stop()
+        self._deadline_timer.stop()
+        files, dirs = self._changed_files, self._changed_dirs
+        self._changed_files, self._changed_dirs = set(), set()
+        # 文件被替换（如原子保存、git checkout）后监视会失效，需要重新添加
+        watched = set(self.watcher.files())
+        for file_path in files:
+            if file_path in self._files and file_path not in watched and os.path.exists(file_path):
+                self.watcher.addPath(file_path)
+        if files or dirs:
+            self.changed.emit(files, dirs)
+
+
+class FileTreeNode:
+    """笔记本目录树的节点，笔记本较大时节点数量很多，只保留必要的字段"""
+    __slots__ = ('name', 'parent', 'is_dir', 'children', 'row', 'loading')
+
+    def __init__(self, name, parent, is_dir):
+        self.name = name
+        self.parent = parent
+        self.is_dir = is_dir
+        self.children = None  # None 表示目录尚未列出
+        self.row = 0
+        self.loading = False
+
+    @property
+    def path(self):
+        """节点的完整路径（由上级节点逐级拼接，不在每个节点中保存）"""
+        if self.parent is None or self.parent.parent is None:
+            return self.name
+        return os.path.join(self.parent.path, self.name)
+
+    def sort_key(self):
+        # 目录在前，名称不区分大小写
+        return (not self.is_dir, self.name.lower())
+
+
+class DirectoryListSignals(QObject):
+    """列目录任务的信号"""
+    finished = Signal(int, object)  # 请求编号, 排好序的 [(名称, 是否为目录)]
+
+
+class DirectoryListTask(QRunnable):
+    """在线程池中列出目录下的子目录和Markdown文件，排好序后发回界面线程"""
+    def __init__(self, request_id, dir_path, signals):
+        super().__init__()
+        self.request_id = request_id
+        self.dir_path = dir_path
+        self.signals = signals
+
+    def run(self):
+        with tracer.span("scan") as span:
+            entries = self._list()
+            span.size = len(entries)
+        try:
+            self.signals.finished.emit(self.request_id, entries)
+        except RuntimeError:
+            pass
+
+    def _list(self):
+        entries = []
+        try:
+            with os.scandir(self.dir_path) as iterator:
+                for entry in iterator:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    if is_dir or entry.name.lower().endswith(".md"):
+                        entries.append((entry.name, is_dir))
+        except OSError as e:
+            print(f"无法列出目录: {str(e)}")
+        # 排序放在后台完成，界面线程只需按顺序追加
+        entries.sort(key=lambda entry: (not entry[1], entry[0].lower()))
+        return entries
+
+
+class NotebookTreeModel(QAbstractItemModel):
+    """笔记本目录树模型
+
+    顶层为本次打开过的笔记本；目录在第一次展开时才在后台列出并排序，
+    结果每轮事件循环只插入一批，展开包含大量文件的目录时界面不会卡住。
+    """
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._root = FileTreeNode("", None, True)
+        self._root.children = []
+        self._requests = {}  # 请求编号 -> (节点, 是否为重新列出)
+        self._batches = {}   # 节点 -> 尚未插入的条目
+        self._next_request = 0
+        self._batch_timer = QTimer(self)
+        self._batch_timer.setSingleShot(True)
+        self._batch_timer.setInterval(0)
+        self._batch_timer.timeout.connect(self._flush_batches)
+        self._signals = DirectoryListSignals()
+        self._signals.finished.connect(self.on_list_finished)
+
+    def add_notebook(self, notebook_path):
+        """添加笔记本作为顶层节点，已存在时返回其索引"""
+        notebook_path = os.path.abspath(notebook_path)
+        for node in self._root.children:
+            if node.name == notebook_path:
+                return self.createIndex(node.row, 0, node)
+        node = FileTreeNode(notebook_path, self._root, True)
+        node.row = len(self._root.children)
+        self.beginInsertRows(QModelIndex(), node.row, node.row)
+        self._root.children.append(node)
+        self.endInsertRows()
+        return self.createIndex(node.row, 0, node)
+
+    def node(self, index):
+        return index.internalPointer() if index.isValid() else self._root
+
+    def index(self, row, column, parent=QModelIndex()):
+        # 视图排版时对每一行都会调用，尽量少做额外的调用
+        children = parent.internalPointer().children if parent.isValid() else self._root.children
+        if column != 0 or not children or not 0 <= row < len(children):
+            return QModelIndex()
+        return self.createIndex(row, 0, children[row])
+
+    def parent(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        parent = index.internalPointer().parent
+        if parent is None or parent is self._root:
+            return QModelIndex()
+        return self.createIndex(parent.row, 0, parent)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.column() > 0:
+            return 0
+        children = self.node(parent).children
+        return len(children) if children else 0
+
+    def columnCount(self, parent=QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QModelIndex()):
+        node = self.node(parent)
+        # 尚未列出的目录先显示展开箭头
+        return node.is_dir and (node.children is None or len(node.children) > 0)
+
+    def canFetchMore(self, parent):
+        node = self.node(parent)
+        return node.is_dir and node.children is None and not node.loading
+
+    def fetchMore(self, parent):
+        node = self.node(parent)
+        node.children = []
+        self._list(node, reload=False)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+        if role == Qt.ItemDataRole.DisplayRole:
+            if node.parent is self._root:
+                return os.path.basename(node.name) or node.name
+            return node.name
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return node.path
+        return None
+
+    def file_path(self, index):
+        """返回索引对应的文件路径，目录返回 None"""
+        node = self.node(index)
+        return None if node.is_dir else node.path
+
+    def refresh_dirs(self, dir_paths):
+        """重新列出已展开过的目录（文件监视器报告变化时调用）"""
+        for dir_path in dir_paths:
+            node = self._find(os.path.abspath(dir_path))
+            if node is not None and node.children is not None and not node.loading:
+                self._list(node, reload=True)
+
+    def _find(self, dir_path):
+        """按路径查找已加载的目录节点"""
+        for notebook in self._root.children:
+            if dir_path == notebook.name:
+                return notebook
+            if not dir_path.startswith(notebook.name + os.sep):
+                continue
+            node = notebook
+            for name in os.path.relpath(dir_path, notebook.name).split(os.sep):
+                if not node.children:
+                    return None
+                node = next((child for child in node.children if child.name == name and child.is_dir), None)
+                if node is None:
+                    return None
+            return node
+        return None
+
+    def _list(self, node, reload):
+        node.loading = True
+        self._next_request += 1
+        self._requests[self._next_request] = (node, reload)
+        QThreadPool.globalInstance().start(DirectoryListTask(self._next_request, node.path, self._signals))
+
+    def _attached(self, node):
+        while node.parent is not None:
+            node = node.parent
+        return node is self._root
+
+    def _index_of(self, node):
+        if node is self._root:
+            return QModelIndex()
+        return self.createIndex(node.row, 0, node)
+
+    def on_list_finished(self, request_id, entries):
+        request = self._requests.pop(request_id, None)
+        if request is None:
+            return
+        node, reload = request
+        if not self._attached(node):
+            return
+        if reload:
+            node.loading = False
+            self._reconcile(node, entries)
+        elif entries:
+            # 保持 loading 状态直到全部插入，期间不会重复列出
+            self._batches[node] = entries
+            self._batch_timer.start()
+        else:
+            # 空目录：去掉展开箭头
+            node.loading = False
+            index = self._index_of(node)
+            self.dataChanged.emit(index, index)
+
+    def _flush_batches(self):
+        """每个等待中的目录插入一批条目，还有剩余时下一轮事件循环继续
+
+        视图每次插入后都要重新排版整个展开的目录，批次大小随已插入的行数翻倍，
+        总的排版次数只随条目数对数增长。
+        """
+        for node, entries in list(self._batches.items()):
+            size = max(DIRECTORY_LIST_BATCH_SIZE, len(node.children))
+            batch = entries[:size]
+            del entries[:size]
+            self._insert(node, [FileTreeNode(name, node, is_dir) for name, is_dir in batch])
+            if not entries:
+                del self._batches[node]
+                node.loading = False
+        if self._batches:
+            self._batch_timer.start()
+
+    def _insert(self, node, new_nodes):
+        """把节点追加到子节点末尾"""
+        children = node.children
+        first = len(children)
+        for offset, child in enumerate(new_nodes):
+            child.row = first + offset
+        self.beginInsertRows(self._index_of(node), first, first + len(new_nodes) - 1)
+        children.extend(new_nodes)
+        self.endInsertRows()
+
+    def _sort(self, node):
+        """重新排序子节点，已有的持久索引（选中项、当前项）随之移动"""
+        self.layoutAboutToBeChanged.emit()
+        node.children.sort(key=FileTreeNode.sort_key)
+        for row, child in enumerate(node.children):
+            child.row = row
+        old_indexes = [index for index in self.persistentIndexList() if index.isValid()
+                       and index.internalPointer().parent is node]
+        self.changePersistentIndexList(
+            old_indexes, [self.createIndex(index.internalPointer().row, 0, index.internalPointer())
+                          for index in old_indexes])
+        self.layoutChanged.emit()
+
+    def _reconcile(self, node, entries):
+        """把重新列出的结果与已有子节点对比，只删除消失的条目、插入新条目"""
+        listed = set(entries)
+        parent = self._index_of(node)
+        # 从后往前删除，连续的行合并为一次删除
+        row = len(node.children) - 1
+        while row >= 0:
+            if (node.children[row].name, node.children[row].is_dir) in listed:
+                row -= 1
+                continue
+            last = row
+            while row > 0 and (node.children[row - 1].name, node.children[row - 1].is_dir) not in listed:
+                row -= 1
+            self.beginRemoveRows(parent, row, last)
+            for child in node.children[row:last + 1]:
+                child.parent = None  # 标记为已移除，之后返回的列目录结果会被忽略
+            del node.children[row:last + 1]
+            for child in node.children[row:]:
+                child.row -= last - row + 1
+            self.endRemoveRows()
+            row -= 1
+        existing = {(child.name, child.is_dir) for child in node.children}
+        new_nodes = [FileTreeNode(name, node, is_dir) for name, is_dir in entries if (name, is_dir) not in existing]
+        if new_nodes:
+            had_children = bool(node.children)
+            self._insert(node, new_nodes)
+            if had_children:
+                self._sort(node)
+
+
 class MarkdownNotebook(QMainWindow):
     """主窗口类"""
+    _first_paint_time = None  # 第一次绘制完成的时间；event() 在 __init__ 期间就会被调用，所以定义在类上
+    
     def __init__(self):
         super().__init__()
-        self.recent_notebooks = []
+        self.notebook_indexes = {}  # 笔记本路径 -> NotebookIndex
+        self._notebooks_to_open = set()  # 等待首次索引完成后再打开文档的笔记本
+        self._index_signals = IndexRefreshSignals()
+        self._index_signals.finished.connect(self.on_index_refreshed)
+        self.file_watcher = FileWatcher(self)
+        self.file_watcher.changed.connect(self.on_files_changed)
+        self._materializing_tab = False
         self.load_settings()
         self.init_ui()
+        self.restore_session()
+    
+    def event(self, event):
+        # 第一次绘制完成后再构建次要界面
+        result = super().event(event)
+        if self._first_paint_time is None and event.type() == QEvent.Type.UpdateRequest:
+            self._first_paint_time = time.perf_counter()
+            QTimer.singleShot(0, self.build_deferred_ui)
+        return result
+    
+    def build_deferred_ui(self):
+        """窗口第一次绘制后构建的界面"""
+        if self.home_widget is None:
+            self.home_widget = HomeWidget(self)
+            self.home_page.layout().addWidget(self.home_widget)
+        # 编辑器加载文档时会删除自己的编辑日志，要在打开任何文档之前读取
+        self.recover_unsaved()
+        # 恢复会话时的当前标签页
+        self.materialize_tab(self.tab_widget.currentIndex())
+        if os.environ.get("NEMOMARK_STARTUP_PROBE"):
+            # 启动耗时测量（benchmarks/bench_startup.py）：输出耗时后退出
+            print(f"startup first_paint_ms={(self._first_paint_time - _START_TIME) * 1000:.1f} "
+                  f"deferred_ui_ms={(time.perf_counter() - _START_TIME) * 1000:.1f}", flush=True)
+            QTimer.singleShot(0, QApplication.instance().quit)
     
     def init_ui(self):
         # 设置窗口
@@ -691,7 +4625,7 @@ class MarkdownNotebook(QMainWindow):
             }
             
             /* 文本编辑区样式 */
-            QTextEdit {
+            QTextEdit, QPlainTextEdit {
                 border: 1px solid #e0e0e0;
                 border-radius: 6px;
                 padding: 8px;
@@ -739,6 +4673,7 @@ class MarkdownNotebook(QMainWindow):
         
         # 创建标签页组件
         self.tab_widget = CustomTabWidget(self)
+        self.tab_widget.currentChanged.connect(self.on_current_tab_changed)
         self.main_layout.addWidget(self.tab_widget)
 
         
@@ -750,16 +4685,48 @@ class MarkdownNotebook(QMainWindow):
         
 
         
-        # 创建主页标签
-        self.home_widget = HomeWidget(self)
-        self.home_tab_index = self.tab_widget.addTab(self.home_widget, "主页")  # 恢复文本标签
+        # 创建主页标签：主页内容较多，先放一个空白容器，窗口第一次绘制后再构建（见 build_deferred_ui）
+        self.home_widget = None
+        self.home_page = QWidget()
+        home_layout = QVBoxLayout(self.home_page)
+        home_layout.setContentsMargins(0, 0, 0, 0)
+        self.home_tab_index = self.tab_widget.addTab(self.home_page, "主页")  # 恢复文本标签
         self.tab_widget.set_home_tab(self.home_tab_index)
         
+        # 笔记本目录树，打开笔记本后显示
+        self.notebook_tree_model = NotebookTreeModel(self)
+        self.notebook_tree = QTreeView()
+        self.notebook_tree.setModel(self.notebook_tree_model)
+        self.notebook_tree.setHeaderHidden(True)
+        self.notebook_tree.setUniformRowHeights(True)  # 大目录下滚动和排版只需按行计算
+        self.notebook_tree.activated.connect(self.on_notebook_tree_activated)
+        self.notebook_dock = QDockWidget("笔记本", self)
+        self.notebook_dock.setWidget(self.notebook_tree)
+        self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self.notebook_dock)
+        self.notebook_dock.hide()
+        
+        # 笔记本全文搜索面板，默认隐藏
+        self.search_panel = SearchPanel(self)
+        self.search_dock = QDockWidget("搜索", self)
+        self.search_dock.setWidget(self.search_panel)
+        self.addDockWidget(Qt.DockWidgetArea.LeftDockWidgetArea, self.search_dock)
+        self.tabifyDockWidget(self.notebook_dock, self.search_dock)
+        self.search_dock.hide()
+        
         # 创建菜单栏
         self.create_menu_bar()
         
         # 状态栏
         self.statusBar().showMessage("就绪")
+        
+        # 性能跟踪：状态栏显示各段耗时的 p50/p99，设置 NEMOMARK_TRACE 时启动即开启，退出时导出到该路径
+        self.trace_label = QLabel()
+        self.statusBar().addPermanentWidget(self.trace_label)
+        self.trace_timer = QTimer(self)
+        self.trace_timer.setInterval(1000)
+        self.trace_timer.timeout.connect(self.update_trace_label)
+        self._trace_export_path = os.environ.get("NEMOMARK_TRACE") or None
+        self.set_tracing(self._trace_export_path is not None)
     
     def create_menu_bar(self):
         """创建菜单栏"""
@@ -794,6 +4761,11 @@ class MarkdownNotebook(QMainWindow):
         open_doc_action.triggered.connect(self.open_document)
         file_menu.addAction(open_doc_action)
         
+        # 显示/隐藏笔记本目录树
+        notebook_tree_action = self.notebook_dock.toggleViewAction()
+        notebook_tree_action.setText("笔记本目录")
+        file_menu.addAction(notebook_tree_action)
+        
         file_menu.addSeparator()
         
         # 保存更改
@@ -847,6 +4819,14 @@ class MarkdownNotebook(QMainWindow):
         
         edit_menu.addSeparator()
         
+        # 全文搜索
+        search_action = QAction("在笔记本中搜索", self)
+        search_action.setShortcut("Ctrl+Shift+F")
+        search_action.triggered.connect(self.show_search_panel)
+        edit_menu.addAction(search_action)
+        
+        edit_menu.addSeparator()
+        
         # 插入Markdown组件的子菜单
         markdown_menu = edit_menu.addMenu("插入Markdown组件")
         
@@ -888,7 +4868,25 @@ class MarkdownNotebook(QMainWindow):
 
 
         help_menu.addSeparator()
-  
+        
+        # 性能跟踪
+        trace_menu = help_menu.addMenu("性能跟踪")
+        self.trace_action = QAction("记录性能跟踪", self)
+        self.trace_action.setCheckable(True)
+        self.trace_action.setChecked(tracer.enabled)
+        self.trace_action.toggled.connect(self.set_tracing)
+        trace_menu.addAction(self.trace_action)
+        
+        export_trace_action = QAction("导出跟踪文件...", self)
+        export_trace_action.triggered.connect(self.export_trace)
+        trace_menu.addAction(export_trace_action)
+        
+        clear_trace_action = QAction("清除跟踪数据", self)
+        clear_trace_action.triggered.connect(tracer.clear)
+        clear_trace_action.triggered.connect(self.update_trace_label)
+        trace_menu.addAction(clear_trace_action)
+        
+        help_menu.addSeparator()
     
         # 打开关于窗口
         about_action = QAction("关于", self)
@@ -900,6 +4898,43 @@ class MarkdownNotebook(QMainWindow):
         qq_group_action.triggered.connect(self.open_qq_group)
         help_menu.addAction(qq_group_action)
   
+    def set_tracing(self, enabled):
+        """开启或关闭性能跟踪"""
+        tracer.enabled = enabled
+        if self.trace_action.isChecked() != enabled:
+            self.trace_action.setChecked(enabled)
+        self.trace_label.setVisible(enabled)
+        if enabled:
+            self.trace_timer.start()
+            self.update_trace_label()
+        else:
+            self.trace_timer.stop()
+    
+    def update_trace_label(self):
+        """在状态栏显示各段耗时的 p50/p99"""
+        stats = tracer.stats()
+        if not stats:
+            self.trace_label.setText("跟踪中")
+            self.trace_label.setToolTip("")
+            return
+        self.trace_label.setText("  ".join(f"{name} {p50:.1f}/{p99:.1f}" for name, _, p50, p99 in stats))
+        self.trace_label.setToolTip("最近的耗时（毫秒），p50/p99\n" + "\n".join(
+            f"{name}: p50 {p50:.2f} ms, p99 {p99:.2f} ms, {count} 次" for name, count, p50, p99 in stats))
+    
+    def export_trace(self):
+        """导出 Chrome/Perfetto 跟踪文件"""
+        default_path = os.path.join(os.path.expanduser("~"),
+                                    f"nemomark-trace-{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+        file_path, _ = QFileDialog.getSaveFileName(self, "导出跟踪文件", default_path, "跟踪文件 (*.json)")
+        if not file_path:
+            return
+        try:
+            count = tracer.export_chrome_trace(file_path)
+        except OSError as e:
+            QMessageBox.warning(self, "错误", f"无法导出跟踪文件: {str(e)}")
+            return
+        self.statusBar().showMessage(f"已导出 {count} 条跟踪记录，可在 chrome://tracing 或 ui.perfetto.dev 中打开")
+    
     def create_new_notebook(self):
         """创建新的笔记本"""
         # 获取笔记本名称
@@ -981,9 +5016,10 @@ class MarkdownNotebook(QMainWindow):
         # 添加到最近使用
         self.add_to_recent(notebook_path)
         
-        # 刷新主页的最近使用列表
-        self.home_widget.update_recent_notebooks()
-        self.home_widget.update_recent_docs()
+        # 刷新主页的最近使用列表（主页尚未构建时，构建时会读取最新列表）
+        if self.home_widget is not None:
+            self.home_widget.update_recent_notebooks()
+            self.home_widget.update_recent_docs()
         
         # 检查是否已经打开
         for i in range(self.tab_widget.count()):
@@ -992,23 +5028,80 @@ class MarkdownNotebook(QMainWindow):
                 self.tab_widget.setCurrentIndex(i)
                 return
         
-        # 查找笔记本中的Markdown文件
-        md_files = []
-        for root, _, files in os.walk(notebook_path):
-            for file in files:
-                if file.lower().endswith(".md"):
-                    md_files.append(os.path.join(root, file))
+        # 在目录树中显示笔记本
+        tree_index = self.notebook_tree_model.add_notebook(notebook_path)
+        self.notebook_dock.show()
+        self.notebook_dock.raise_()
+        self.notebook_tree.expand(tree_index)
+        
+        # 从索引中读取笔记本的Markdown文件，后台增量刷新索引
+        index = self.get_notebook_index(notebook_path)
+        self.refresh_notebook_index(notebook_path)
         
         # 如果有README.md，优先打开它
         readme_path = os.path.join(notebook_path, "README.md")
         if os.path.exists(readme_path):
             self.open_document(readme_path, notebook_path)
-        elif md_files:
-            self.open_document(md_files[0], notebook_path)
+        elif index.is_built():
+            self._open_first_document(notebook_path)
+        else:
+            # 首次打开，等索引建立后再决定打开哪个文档
+            self._notebooks_to_open.add(index.notebook_path)
+    
+    def _open_first_document(self, notebook_path):
+        """打开笔记本中的第一个Markdown文件，没有时新建一个"""
+        md_files = self.get_notebook_index(notebook_path).files()
+        if md_files:
+            self.open_document(md_files[0][0], notebook_path)
         else:
             # 如果笔记本中没有任何Markdown文件，创建一个
             self.create_new_document(notebook_path)
     
+    def get_notebook_index(self, notebook_path):
+        """获取笔记本的索引"""
+        notebook_path = os.path.abspath(notebook_path)
+        index = self.notebook_indexes.get(notebook_path)
+        if index is None:
+            index = NotebookIndex(notebook_path)
+            self.notebook_indexes[notebook_path] = index
+        return index
+    
+    def refresh_notebook_index(self, notebook_path):
+        """在后台增量刷新笔记本索引"""
+        index = self.get_notebook_index(notebook_path)
+        QThreadPool.globalInstance().start(IndexRefreshTask(index, self._index_signals))
+    
+    def update_notebook_index(self, file_paths, dir_paths=()):
+        """文件保存或变化后，在后台更新所在笔记本的索引"""
+        for index in self.notebook_indexes.values():
+            root = index.notebook_path + os.sep
+            files = [path for path in file_paths if os.path.abspath(path).startswith(root)]
+            dirs = [path for path in dir_paths if (os.path.abspath(path) + os.sep).startswith(root)]
+            if files or dirs:
+                QThreadPool.globalInstance().start(IndexRefreshTask(index, self._index_signals, files, dirs))
+    
+    def on_files_changed(self, file_paths, dir_paths):
+        """文件监视器报告了一批变化：检查打开的文档，并更新笔记本索引"""
+        for i in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(i)
+            if getattr(widget, 'file_path', None) in file_paths and hasattr(widget, 'check_disk_change'):
+                widget.check_disk_change()
+        self.notebook_tree_model.refresh_dirs(dir_paths)
+        self.update_notebook_index(file_paths, dir_paths)
+    
+    def on_index_refreshed(self, notebook_path, changes, full):
+        """索引刷新完成"""
+        if changes is not None and (full or changes[0] or changes[2]):
+            # 目录可能有增删，更新监视的目录
+            self.file_watcher.set_notebook_dirs(notebook_path, self.get_notebook_index(notebook_path).directories())
+        if full and changes is not None and any(changes):
+            added, changed, removed = changes
+            self.statusBar().showMessage(
+                f"笔记本索引已更新: 新增 {len(added)}，修改 {len(changed)}，删除 {len(removed)}")
+        if notebook_path in self._notebooks_to_open and self.get_notebook_index(notebook_path).is_built():
+            self._notebooks_to_open.discard(notebook_path)
+            self._open_first_document(notebook_path)
+    
     def open_document(self, file_path=None, notebook=None):
         """打开Markdown文件"""
         if not file_path:
@@ -1034,25 +5127,139 @@ class MarkdownNotebook(QMainWindow):
             widget = self.tab_widget.widget(i)
             if hasattr(widget, 'file_path') and widget.file_path == file_path:
                 self.tab_widget.setCurrentIndex(i)
+                self.materialize_tab(i)
                 return
         
         # 创建编辑器并添加到标签页
-        editor = MarkdownEditor(file_path, self.tab_widget)
+        editor = self.create_editor(file_path)
         file_name = os.path.basename(file_path)
         index = self.tab_widget.addTab(editor, file_name)
         self.tab_widget.setCurrentIndex(index)
         
+        settings_store.add_recent('recent_documents', os.path.abspath(file_path))
+        if self.home_widget is not None:
+            self.home_widget.update_recent_docs()
+        
         self.statusBar().showMessage(f"已打开文档: {file_name}")
     
+    def create_editor(self, file_path):
+        """创建编辑器并加载文件"""
+        editor = MarkdownEditor(file_path, self.tab_widget)
+        editor.file_saved.connect(self.on_document_saved)
+        self.file_watcher.watch_file(file_path)
+        return editor
+    
+    def on_current_tab_changed(self, index):
+        """切换到恢复会话留下的占位标签页时才真正打开文档"""
+        # 启动时的当前标签页等第一次绘制之后再打开（见 build_deferred_ui）
+        if self._first_paint_time is not None and not self._materializing_tab:
+            self.materialize_tab(index)
+    
+    def materialize_tab(self, index):
+        """把占位标签页替换为编辑器，恢复光标和滚动位置"""
+        placeholder = self.tab_widget.widget(index)
+        if not isinstance(placeholder, DocumentPlaceholder):
+            return
+        self._materializing_tab = True
+        try:
+            editor = self.create_editor(placeholder.file_path)
+            current = self.tab_widget.currentIndex() == index
+            title = self.tab_widget.tabText(index)
+            self.tab_widget.removeTab(index)
+            self.tab_widget.insertTab(index, editor, title)
+            if current:
+                self.tab_widget.setCurrentIndex(index)
+        finally:
+            self._materializing_tab = False
+        placeholder.deleteLater()
+        
+        cursor = editor.editor.textCursor()
+        cursor.setPosition(min(placeholder.cursor_position, editor.editor.document().characterCount() - 1))
+        editor.editor.setTextCursor(cursor)
+        # 排版完成后滚动条的范围才正确
+        scroll_value = placeholder.scroll_value
+        QTimer.singleShot(0, lambda: editor.editor.verticalScrollBar().setValue(scroll_value))
+    
+    def recover_unsaved(self):
+        """读取上次异常退出时留下的编辑日志，询问是否恢复未保存的修改"""
+        journal_dir = EditJournal.default_dir()
+        try:
+            names = sorted(name for name in os.listdir(journal_dir) if name.endswith(".journal"))
+        except OSError:
+            return
+        # 先全部读入，打开文档时编辑器会重置自己的日志
+        recovered = []
+        for name in names:
+            journal_path = os.path.join(journal_dir, name)
+            try:
+                result = EditJournal.replay(journal_path)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"读取编辑日志失败: {str(e)}")
+                continue
+            if result is not None:
+                recovered.append((journal_path, *result))
+        for journal_path, file_path, text in recovered:
+            name = os.path.basename(file_path)
+            if text is None:
+                QMessageBox.warning(self, "无法恢复",
+                                    f"文档 '{name}' 在上次异常退出后已在外部被修改或删除，未保存的修改无法恢复。")
+            elif os.path.isfile(file_path):
+                reply = QMessageBox.question(
+                    self, "恢复未保存的修改",
+                    f"文档 '{name}' 有上次异常退出前未保存的修改，是否恢复？\n选择“否”将丢弃这些修改。",
+                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No)
+                if reply == QMessageBox.StandardButton.Yes:
+                    self.open_document(file_path)
+                    widget = self.tab_widget.currentWidget()
+                    if isinstance(widget, MarkdownEditor) and widget.file_path == file_path:
+                        widget.recover_text(text)
+                        self.statusBar().showMessage(f"已恢复未保存的修改: {name}")
+                        continue
+            try:
+                os.remove(journal_path)
+            except OSError:
+                pass
+    
+    def session_state(self):
+        """记录打开的文档、当前标签页以及光标和滚动位置"""
+        tabs = []
+        active = -1
+        for i in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(i)
+            if i == self.home_tab_index or not getattr(widget, 'file_path', None):
+                continue
+            if i == self.tab_widget.currentIndex():
+                active = len(tabs)
+            if isinstance(widget, DocumentPlaceholder):
+                cursor_position, scroll_value = widget.cursor_position, widget.scroll_value
+            else:
+                cursor_position = widget.editor.textCursor().position()
+                scroll_value = widget.editor.verticalScrollBar().value()
+            tabs.append({'file_path': widget.file_path, 'cursor': cursor_position, 'scroll': scroll_value})
+        return {'tabs': tabs, 'active': active}
+    
+    def restore_session(self):
+        """恢复上次关闭时打开的文档，只创建占位标签页，切换到时才加载"""
+        session = _settings.get('session') or {}
+        active_index = None
+        for position, tab in enumerate(session.get('tabs', [])):
+            file_path = tab.get('file_path')
+            if not file_path or not os.path.isfile(file_path):
+                continue
+            placeholder = DocumentPlaceholder(file_path, tab.get('cursor', 0), tab.get('scroll', 0))
+            index = self.tab_widget.addTab(placeholder, os.path.basename(file_path))
+            self.tab_widget.setTabToolTip(index, file_path)
+            if position == session.get('active'):
+                active_index = index
+        if active_index is not None:
+            self.tab_widget.setCurrentIndex(active_index)
+    
     def save_document(self):
         """保存当前文档"""
         current_widget = self.tab_widget.currentWidget()
         if hasattr(current_widget, 'save_file'):
-            if current_widget.save_file():
-                file_name = os.path.basename(current_widget.file_path)
-                self.statusBar().showMessage(f"已保存文档: {file_name}")
-                index = self.tab_widget.currentIndex()
-                self.tab_widget.update_tab_title(index)
+            # 保存在后台进行，完成后由 on_document_saved 更新状态栏和标签标题
+            current_widget.save_file()
     
     def save_document_as(self):
         """另存为当前文档"""
@@ -1066,53 +5273,69 @@ class MarkdownNotebook(QMainWindow):
                     file_name = os.path.basename(file_path)
                     index = self.tab_widget.currentIndex()
                     self.tab_widget.setTabText(index, file_name)
-                    self.statusBar().showMessage(f"已保存文档: {file_name}")
+    
+    def on_document_saved(self, file_path):
+        """文档保存完成"""
+        index = self.tab_widget.indexOf(self.sender())
+        if index >= 0:
+            self.tab_widget.update_tab_title(index)
+        self.statusBar().showMessage(f"已保存文档: {os.path.basename(file_path)}")
+        self.file_watcher.watch_file(file_path)
+        self.update_notebook_index([file_path])
+    
+    def on_notebook_tree_activated(self, index):
+        """在笔记本目录树中双击文件时打开它"""
+        file_path = self.notebook_tree_model.file_path(index)
+        if file_path:
+            self.open_document(file_path)
+    
+    def show_search_panel(self):
+        """显示全文搜索面板"""
+        self.search_dock.show()
+        self.search_panel.search_input.setFocus()
+        self.search_panel.search_input.selectAll()
+    
+    def search_notebooks(self, query, limit=50):
+        """在本次打开过的所有笔记本中搜索，返回按相关度合并的结果"""
+        results = []
+        for index in self.notebook_indexes.values():
+            try:
+                results.extend(index.search(query, limit))
+            except sqlite3.Error as e:
+                print(f"搜索失败: {str(e)}")
+        results.sort(key=lambda result: result[0])
+        return results[:limit]
+    
+    def open_search_result(self, file_path, line):
+        """打开搜索结果所在的文档并跳转到对应行"""
+        self.open_document(file_path)
+        widget = self.tab_widget.currentWidget()
+        if hasattr(widget, 'file_path') and widget.file_path == file_path:
+            widget.jump_to_line(line)
+    
+    @property
+    def recent_notebooks(self):
+        """最近使用的笔记本路径，从新到旧"""
+        return settings_store.recent('recent_notebooks')
     
     def add_to_recent(self, notebook_path):
-        """添加到最近使用的笔记本列表"""
-        # 如果已经在列表中，移到前面
-        if notebook_path in self.recent_notebooks:
-            self.recent_notebooks.remove(notebook_path)
-        
-        # 添加到开头
-        self.recent_notebooks.insert(0, notebook_path)
-        
-        # 限制最多10个最近使用的笔记本
-        if len(self.recent_notebooks) > 10:
-            self.recent_notebooks = self.recent_notebooks[:10]
-        
-        # 保存设置
-        self.save_settings()
+        """添加到最近使用的笔记本列表（稍后在后台写入设置）"""
+        settings_store.add_recent('recent_notebooks', notebook_path)
     
     def load_settings(self):
         """加载设置"""
         try:
-            config_dir = os.path.join(os.path.expanduser("~"), ".marknote")
-            if not os.path.exists(config_dir):
-                os.makedirs(config_dir)
-            
-            config_path = os.path.join(config_dir, "settings.json")
-            if os.path.exists(config_path):
-                with open(config_path, 'r', encoding='utf-8') as f:
-                    settings = json.load(f)
-                    self.recent_notebooks = settings.get('recent_notebooks', [])
+            settings_store.load()
         except Exception as e:
             print(f"加载设置失败: {str(e)}")
-            self.recent_notebooks = []
+        configure_markdown()
     
     def save_settings(self):
-        """保存设置"""
+        """记录会话并立即写入设置（退出时调用）"""
+        settings_store.set('session', self.session_state())
+        settings_store.set('last_save_time', datetime.datetime.now().isoformat())
         try:
-            config_dir = os.path.join(os.path.expanduser("~"), ".marknote")
-            if not os.path.exists(config_dir):
-                os.makedirs(config_dir)
-            
-            config_path = os.path.join(config_dir, "settings.json")
-            with open(config_path, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'recent_notebooks': self.recent_notebooks,
-                    'last_save_time': datetime.datetime.now().isoformat()
-                }, f, ensure_ascii=False, indent=2)
+            settings_store.flush()
         except Exception as e:
             print(f"保存设置失败: {str(e)}")
     
@@ -1184,15 +5407,202 @@ class MarkdownNotebook(QMainWindow):
                     event.ignore()
                     return
                 elif reply == QMessageBox.StandardButton.Save:
-                    if not widget.save_file():
+                    if not widget.save_file(wait=True):
                         event.ignore()
                         return
         
+        # 等待后台保存全部写入磁盘
+        for i in range(self.tab_widget.count()):
+            widget = self.tab_widget.widget(i)
+            if hasattr(widget, 'wait_for_save'):
+                widget.wait_for_save()
+        
         # 保存设置
         self.save_settings()
+        
+        # 通过 NEMOMARK_TRACE 开启的跟踪在退出时导出
+        if self._trace_export_path:
+            try:
+                tracer.export_chrome_trace(self._trace_export_path)
+            except OSError as e:
+                print(f"导出跟踪文件失败: {str(e)}")
         event.accept()
 
+EXPORT_MANIFEST_NAME = ".nemomark-export.json"
+EXPORT_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+def _scan_notebook_files(notebook_path, skip_dir=None):
+    """列出笔记本中的Markdown文件，返回 {相对路径: (大小, 修改时间)}"""
+    files = {}
+    pending = [notebook_path]
+    while pending:
+        dir_path = pending.pop()
+        try:
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    try:
+                        if entry.is_dir():
+                            if entry.path != skip_dir:
+                                pending.append(entry.path)
+                        elif entry.name.lower().endswith(".md"):
+                            st = entry.stat()
+                            files[os.path.relpath(entry.path, notebook_path)] = (st.st_size, st.st_mtime_ns)
+                    except OSError:
+                        continue
+        except OSError as e:
+            print(f"无法列出目录: {str(e)}")
+    return files
+
+def _export_output_path(output_dir, rel_path):
+    return os.path.join(output_dir, os.path.splitext(rel_path)[0] + ".html")
+
+def _export_file(notebook_path, output_dir, rel_path, known_hash):
+    """导出单个文件（在进程池中运行）
+
+    返回 (相对路径, 大小, 修改时间, 内容哈希, 是否重新渲染)，读取失败时返回 (相对路径, 错误信息)。
+    只有修改时间变化而内容没变的文件不重新渲染。
+    """
+    try:
+        with open(os.path.join(notebook_path, rel_path), 'rb') as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+        digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+        output_path = _export_output_path(output_dir, rel_path)
+        if digest == known_hash and os.path.exists(output_path):
+            return rel_path, st.st_size, st.st_mtime_ns, digest, False
+        text = data.decode('utf-8', errors='replace')
+        match = _TITLE_RE.search(text)
+        title = match.group(1) if match else os.path.splitext(os.path.basename(rel_path))[0]
+        page = EXPORT_TEMPLATE.format(title=html_escape(title), body=render_markdown(text))
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        # 导出的文件可以重新生成，不逐个 fsync；清单最后写入并同步
+        atomic_write_text(output_path, page, sync=False)
+        return rel_path, st.st_size, st.st_mtime_ns, digest, True
+    except OSError as e:
+        return rel_path, str(e)
+
+def export_notebook(notebook_path, output_dir, jobs=None, force=False):
+    """把笔记本中的Markdown文件导出为静态HTML
+
+    输出目录中的清单记录每个源文件的大小、修改时间和内容哈希。再次导出时，
+    大小和修改时间都没变的文件不读取，内容没变的文件不重新渲染；已删除的源文件
+    对应的HTML也会被删除。需要渲染的文件较多时分配到进程池中并行处理。
+    返回 (渲染数, 跳过数, 删除数, 失败数)。
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    notebook_path = os.path.abspath(notebook_path)
+    output_dir = os.path.abspath(output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, EXPORT_MANIFEST_NAME)
+    # 转换结果随程序和 markdown 版本变化，版本不同时全部重新渲染
+    pipeline = render_pipeline_version()
+    manifest = {}
+    if not force:
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("pipeline") == pipeline:
+                manifest = data.get("files", {})
+        except (OSError, ValueError):
+            pass
+
+    files = _scan_notebook_files(notebook_path, skip_dir=output_dir)
+    entries = {}
+    todo = []
+    for rel_path, (size, mtime_ns) in files.items():
+        entry = manifest.get(rel_path)
+        if (entry and entry[0] == size and entry[1] == mtime_ns
+                and os.path.exists(_export_output_path(output_dir, rel_path))):
+            entries[rel_path] = entry
+        else:
+            todo.append((rel_path, entry[2] if entry else None))
+
+    rendered = failed = 0
+    paths = [rel_path for rel_path, _ in todo]
+    hashes = [known_hash for _, known_hash in todo]
+    workers = jobs or os.cpu_count() or 1
+    if len(todo) > EXPORT_SERIAL_LIMIT and workers > 1:
+        # 子进程可能是重新导入的模块，扩展配置通过初始化函数传过去
+        with ProcessPoolExecutor(max_workers=workers, initializer=configure_markdown,
+                                 initargs=(markdown_renderer.extensions, markdown_renderer.extension_configs)) as pool:
+            results = list(pool.map(_export_file, repeat(notebook_path), repeat(output_dir), paths, hashes,
+                                    chunksize=max(1, len(todo) // (workers * 8))))
+    else:
+        results = map(_export_file, repeat(notebook_path), repeat(output_dir), paths, hashes)
+    for result in results:
+        if len(result) == 2:
+            print(f"导出失败: {result[0]}: {result[1]}")
+            failed += 1
+            continue
+        rel_path, size, mtime_ns, digest, written = result
+        entries[rel_path] = [size, mtime_ns, digest]
+        rendered += written
+
+    # 删除源文件已不存在的HTML，以及因此变空的目录
+    removed = 0
+    for rel_path in manifest.keys() - files.keys():
+        output_path = _export_output_path(output_dir, rel_path)
+        try:
+            os.remove(output_path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"无法删除过期文件: {str(e)}")
+            continue
+        directory = os.path.dirname(output_path)
+        while directory != output_dir:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    atomic_write_text(manifest_path, json.dumps({"pipeline": pipeline, "files": entries}, ensure_ascii=False))
+    return rendered, len(files) - rendered - failed, removed, failed
+
+def export_main(argv):
+    """命令行导出：NemoMark_Desktop.py export <笔记本目录> <输出目录>"""
+    import argparse
+    parser = argparse.ArgumentParser(prog=f"{os.path.basename(sys.argv[0])} export",
+                                     description="把笔记本中的Markdown文件导出为静态HTML")
+    parser.add_argument("notebook", help="笔记本目录")
+    parser.add_argument("output_dir", help="输出目录")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="并行进程数，默认为CPU核心数")
+    parser.add_argument("--force", action="store_true", help="忽略清单，全部重新渲染")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.notebook):
+        print(f"笔记本目录不存在: {args.notebook}")
+        return 1
+    # 与预览使用同一组Markdown扩展
+    try:
+        settings_store.load()
+    except (OSError, ValueError):
+        pass
+    configure_markdown()
+    start = time.perf_counter()
+    rendered, skipped, removed, failed = export_notebook(args.notebook, args.output_dir, args.jobs, args.force)
+    print(f"导出完成：渲染 {rendered} 个，未变化 {skipped} 个，删除 {removed} 个，"
+          f"失败 {failed} 个，用时 {time.perf_counter() - start:.2f} 秒")
+    return 1 if failed else 0
+
 if __name__ == "__main__":
+    # 命令行导出模式，不创建任何窗口
+    if len(sys.argv) > 1 and sys.argv[1] == "export":
+        sys.exit(export_main(sys.argv[2:]))
+    
     # 确保中文显示正常
     
    
@@ -0,0 +1,155 @@
+"""语法高亮输入延迟基准测试
+
+在约 5 MB 的文档上分别开启和关闭语法高亮，测量：
+- 打开：setPlainText 的耗时，以及之后空闲时分批高亮全部完成的耗时
+- 输入：在文档中间的段落里逐个输入字符，每次按键从发送事件到处理完成的耗时
+- 围栏：在文档开头输入 ``` 再删除，后面全部块的状态都要改变，单次按键的耗时
+
+用法: QT_QPA_PLATFORM=offscreen python benchmarks/bench_highlight.py [--size-mb 5] [--kind code] [--output highlight.json]
+
+结果文件的格式与 bench_suite.py 相同，可用 bench_suite.py compare 对比。
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QKeyEvent, QTextCursor
+from PySide6.QtCore import Qt, QEvent
+
+import NemoMark_Desktop as app_module
+from bench_suite import DOCUMENT_KINDS, generate_document
+
+
+def process_events(app, seconds=0.05):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        app.processEvents()
+
+
+def wait_highlight(app, editor):
+    """等待空闲时的分批高亮完成，返回耗时（毫秒）"""
+    start = time.perf_counter()
+    highlighter = editor.highlighter
+    if highlighter is not None:
+        while highlighter._stale_from is not None or highlighter._stale_timer.isActive():
+            app.processEvents()
+    return (time.perf_counter() - start) * 1000
+
+
+def key_press(app, widget, text):
+    """发送一次按键并处理完，返回耗时（毫秒）"""
+    key = Qt.Key.Key_Backspace if text == "\b" else Qt.Key.Key_unknown
+    start = time.perf_counter()
+    QApplication.sendEvent(widget, QKeyEvent(QEvent.Type.KeyPress, key, Qt.KeyboardModifier.NoModifier,
+                                             "" if text == "\b" else text))
+    QApplication.sendEvent(widget, QKeyEvent(QEvent.Type.KeyRelease, key, Qt.KeyboardModifier.NoModifier,
+                                             "" if text == "\b" else text))
+    elapsed = (time.perf_counter() - start) * 1000
+    app.processEvents()
+    return elapsed
+
+
+def move_cursor(app, editor, position):
+    cursor = editor.editor.textCursor()
+    cursor.setPosition(position)
+    editor.editor.setTextCursor(cursor)
+    editor.editor.ensureCursorVisible()
+    process_events(app)
+
+
+def run(app, text, highlighting, keystrokes):
+    app_module._settings['syntax_highlighting'] = highlighting
+    editor = app_module.MarkdownEditor()
+    # 只测量编辑区，预览渲染另有基准
+    editor.render_scheduler.render_requested.disconnect()
+    editor.resize(1200, 800)
+    editor.show()
+    process_events(app)
+
+    results = {}
+    start = time.perf_counter()
+    editor.editor.setPlainText(text)
+    results["open"] = [(time.perf_counter() - start) * 1000]
+    results["open.settle"] = [wait_highlight(app, editor)]
+
+    # 在文档中间的段落末尾输入
+    document = editor.editor.document()
+    block = document.findBlockByNumber(document.blockCount() // 2)
+    while block.isValid() and not block.text().strip():
+        block = block.next()
+    move_cursor(app, editor, block.position() + block.length() - 1)
+    results["type"] = [key_press(app, editor.editor, "abcdefghij"[i % 10]) for i in range(keystrokes)]
+
+    # 在文档开头输入 ``` 再删除
+    fence = []
+    for _ in range(3):
+        move_cursor(app, editor, 0)
+        key_press(app, editor.editor, "`")
+        key_press(app, editor.editor, "`")
+        fence.append(key_press(app, editor.editor, "`"))
+        wait_highlight(app, editor)
+        for _ in range(3):
+            fence.append(key_press(app, editor.editor, "\b"))
+            wait_highlight(app, editor)
+    results["fence"] = fence
+    editor.close()
+    editor.deleteLater()
+    process_events(app)
+    return results
+
+
+def summarize(times):
+    return {"median": statistics.median(times) / 1000, "min": min(times) / 1000,
+            "runs": [t / 1000 for t in times]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=5.0, help="文档大小（MB）")
+    parser.add_argument("--kind", choices=DOCUMENT_KINDS, default="code", help="文档类型")
+    parser.add_argument("--keystrokes", type=int, default=200, help="输入的字符数")
+    parser.add_argument("--output", help="结果JSON文件")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    text = generate_document(args.kind, int(args.size_mb * 1024 * 1024))
+    print(f"文档: {args.kind}, {len(text.encode('utf-8')) / 1024 / 1024:.1f} MB, {text.count(chr(10)) + 1} 行")
+
+    all_results = {}
+    for highlighting in (False, True):
+        label = "highlight" if highlighting else "plain"
+        results = run(app, text, highlighting, args.keystrokes)
+        for name, times in results.items():
+            all_results[f"highlight.{name}/{label}"] = summarize(times)
+        typing = sorted(results["type"])
+        p99 = typing[min(len(typing) - 1, int(len(typing) * 0.99))]
+        print(f"[{label}] 打开 {results['open'][0]:.0f} ms，之后分批高亮 {results['open.settle'][0]:.0f} ms；"
+              f"输入 p50 {statistics.median(typing):.2f} ms / p99 {p99:.2f} ms；"
+              f"围栏按键中位数 {statistics.median(results['fence']):.2f} ms / 最大 {max(results['fence']):.2f} ms")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "meta": {
+                    "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                    "python": platform.python_version(),
+                    "platform": platform.platform(),
+                    "cpu_count": os.cpu_count(),
+                    "size_mb": args.size_mb,
+                    "kind": args.kind,
+                },
+                "results": all_results,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
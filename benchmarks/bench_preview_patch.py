@@ -0,0 +1,134 @@
+"""预览增量更新基准测试
+
+生成约 5 MB 的Markdown文档，在文档中间修改一行，比较：
+- 整篇 setHtml 更新预览的耗时
+- PreviewUpdater 只替换变化片段的耗时
+
+分别测量不含表格和每节含一个表格的文档。表格单独排版与在整篇文档中占用的文本块数不同，
+表格文档还检查了增量更新确实被采用，并且结果与整篇 setHtml 一致。
+
+用法: QT_QPA_PLATFORM=offscreen python benchmarks/bench_preview_patch.py [--size-mb 5]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QTextCursor, QTextDocument
+from PySide6.QtCore import QThreadPool
+
+import NemoMark_Desktop as app_module
+
+
+def generate_document(size_bytes, tables=False):
+    """生成包含标题、段落、列表和代码块的文档，tables 为 True 时每节再加一个表格"""
+    sections = []
+    total = 0
+    index = 0
+    while total < size_bytes:
+        section = (
+            f"## 第{index}节 Section {index}\n\n"
+            f"这是第{index}节的正文，包含 **加粗**、*斜体* 和 `行内代码`。"
+            f"Some English text to make the paragraph longer, with a [link](https://example.com/{index}).\n\n"
+            f"- 列表项 {index}.1\n- 列表项 {index}.2\n- 列表项 {index}.3\n\n"
+            f"```\ndef func_{index}():\n    return {index}\n```\n\n"
+        )
+        if tables:
+            section += f"| 编号 | 名称 |\n| --- | --- |\n| {index} | 名称{index} |\n| {index + 1} | 名称{index + 1} |\n\n"
+        sections.append(section)
+        total += len(section.encode("utf-8"))
+        index += 1
+    return "".join(sections)
+
+
+def render(editor):
+    """同步执行一次渲染，返回 (html, fragments)
+
+    只切分变化的块，不调用 update_preview()，不会有后台渲染任务在计时期间更新预览。
+    """
+    editor.renderer.update(editor.editor.toPlainText())
+    html, fragments = editor.renderer.render_fragments(editor.renderer.snapshot())
+    if fragments is not None:
+        fragments = app_module.PreviewUpdater.measure(fragments)
+    return html, fragments
+
+
+def run(app, size_bytes, repeat, tables):
+    """测量一种文档，增量更新没有被采用或结果与整篇更新不一致时返回 False"""
+    editor = app_module.MarkdownEditor()
+    editor.render_scheduler.render_requested.disconnect()
+    editor.resize(1200, 800)
+    editor.show()
+
+    text = generate_document(size_bytes, tables)
+    print(f"[{'表格' if tables else '无表格'}] 文档大小: {len(text.encode('utf-8')) / 1024 / 1024:.1f} MB")
+
+    start = time.perf_counter()
+    editor.editor.setPlainText(text)
+    html, fragments = render(editor)
+    editor.preview_updater.apply(html, fragments)
+    app.processEvents()
+    print(f"首次渲染: {time.perf_counter() - start:.2f} s")
+    if editor.preview_updater.fragments is None:
+        print("预览块数与测量结果不一致，无法增量更新")
+        return False
+
+    middle = editor.editor.document().findBlockByNumber(editor.editor.document().blockCount() // 2)
+
+    def edit_and_render(i):
+        cursor = QTextCursor(middle)
+        cursor.movePosition(QTextCursor.MoveOperation.EndOfBlock)
+        cursor.insertText(f" 编辑{i}")
+        return render(editor)
+
+    def timed(update):
+        # 第一次编辑包含预览排版的预热开销，不计入结果
+        times = []
+        for i in range(repeat + 1):
+            html, fragments = edit_and_render(i)
+            # 等线程池中的任务结束后再计时，计时期间不处理其他结果
+            QThreadPool.globalInstance().waitForDone()
+            start = time.perf_counter()
+            update(html, fragments)
+            app.processEvents()
+            times.append(time.perf_counter() - start)
+        return times[1:]
+
+    def patch(html, fragments):
+        editor.preview_updater.apply(html, fragments)
+        patched.append(editor.preview_updater.fragments is not None)
+
+    patched = []
+    patch_times = timed(patch)
+    reference = QTextDocument()
+    reference.setHtml(render(editor)[0])
+    ok = all(patched) and editor.preview.document().toPlainText() == reference.toPlainText()
+    full_times = timed(lambda html, fragments: editor.preview.setHtml(html))
+
+    print(f"整篇 setHtml: 中位数 {sorted(full_times)[len(full_times) // 2] * 1000:.1f} ms")
+    print(f"增量更新:     中位数 {sorted(patch_times)[len(patch_times) // 2] * 1000:.1f} ms")
+    if not ok:
+        print("增量更新没有被采用或结果与整篇 setHtml 不一致")
+    editor.close()
+    editor.deleteLater()
+    app.processEvents()
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=5.0, help="文档大小（MB）")
+    parser.add_argument("--repeat", type=int, default=5, help="重复次数")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    results = [run(app, int(args.size_mb * 1024 * 1024), args.repeat, tables) for tables in (False, True)]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,73 @@
+"""Markdown转换开销基准测试
+
+比较小文档上每次转换的耗时：
+- markdown.markdown(text, extensions=...)：每次创建新的 Markdown 实例、注册全部处理器和扩展
+- MarkdownRenderer.convert(text)：复用本线程的实例，转换前只调用 reset()
+
+两者启用相同的扩展，差值就是每次转换省下的实例创建开销。预览按块渲染时每个块都是一次转换，
+这部分开销在块很小的时候占了大头。
+
+用法: python benchmarks/bench_renderer.py [--repeat 2000] [--extensions tables,fenced_code,toc]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import markdown
+from markdown.extensions.toc import slugify_unicode
+
+import NemoMark_Desktop as app_module
+
+SAMPLES = {
+    "heading": "## 第3节 Section 3",
+    "paragraph": "这是一段正文，包含 **加粗**、*斜体*、`行内代码` 和一个[链接](https://example.com)。",
+    "list": "- 要点一：渲染速度\n- 要点二：目录更新\n- 要点三：保存与加载",
+    "table": "| 编号 | 名称 | 数值 |\n| --- | --- | --- |\n| 1 | 名称1 | 3.5 |\n| 2 | 名称2 | 7.0 |",
+    "code": "```python\ndef example():\n    return compute(1, 2)\n```",
+}
+
+
+def measure(function, text, repeat):
+    """返回每次调用的耗时（微秒），取 5 轮的中位数"""
+    rounds = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            function(text)
+        rounds.append((time.perf_counter() - start) / repeat * 1e6)
+    return statistics.median(rounds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000, help="每轮转换次数")
+    parser.add_argument("--extensions", default=",".join(app_module.MARKDOWN_EXTENSIONS), help="启用的扩展，逗号分隔")
+    args = parser.parse_args()
+
+    extensions = [name for name in args.extensions.split(",") if name]
+    renderer = app_module.markdown_renderer
+    # 关闭代码块高亮，两边输出相同
+    renderer.configure(extensions, {}, None)
+    # 与 MarkdownRenderer 使用相同的扩展参数，只比较实例创建的开销
+    configs = {"toc": {"slugify": slugify_unicode}} if "toc" in extensions else {}
+
+    def per_call(text):
+        return markdown.markdown(text, extensions=extensions, extension_configs=configs)
+
+    for name, text in SAMPLES.items():
+        assert per_call(text) == renderer.convert(text), name
+
+    print(f"扩展: {', '.join(extensions) or '无'}")
+    print(f"{'样例':<10} {'每次新建(µs)':>14} {'复用实例(µs)':>14} {'节省':>8}")
+    for name, text in SAMPLES.items():
+        fresh = measure(per_call, text, args.repeat)
+        reused = measure(renderer.convert, text, args.repeat)
+        print(f"{name:<10} {fresh:14.1f} {reused:14.1f} {(fresh - reused) / fresh:8.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""启动耗时基准测试
+
+多次启动程序（NEMOMARK_STARTUP_PROBE=1 时程序在第一次绘制、构建完次要界面后输出耗时并退出），
+记录从启动进程到窗口第一次绘制的时间，并用 python -X importtime 汇总导入耗时最多的模块。
+
+超出预算或启动时导入了应当延迟导入的模块时返回 1，可作为启动耗时的回归测试：
+    python benchmarks/bench_startup.py [--repeat 5] [--budget-ms 1000] [--output startup.json]
+
+结果文件的格式与 bench_suite.py 相同，可用 bench_suite.py compare 对比。
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(ROOT_DIR, "NemoMark_Desktop.py")
+
+# 从启动进程到第一次绘制的预算（毫秒），按中位数判断
+STARTUP_BUDGET_MS = 1000
+# 导入 NemoMark_Desktop 的预算（毫秒）
+IMPORT_BUDGET_MS = 600
+# 启动时不应导入的模块（只在用到时导入）
+LAZY_MODULES = ("markdown", "pygments", "concurrent.futures", "multiprocessing", "webbrowser")
+
+
+def child_env(home):
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    # 使用独立的主目录，不读取用户的设置
+    env["HOME"] = home
+    env["USERPROFILE"] = home
+    return env
+
+
+def measure_startup(env):
+    """启动一次程序，返回 (进程启动到第一次绘制的毫秒数, 程序内测得的各阶段耗时)"""
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, APP_PATH], env=dict(env, NEMOMARK_STARTUP_PROBE="1"),
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        for line in process.stdout:
+            if line.startswith("startup "):
+                wall_ms = (time.perf_counter() - start) * 1000
+                phases = dict(item.split("=") for item in line.split()[1:])
+                break
+        else:
+            raise RuntimeError("程序没有输出启动耗时")
+        process.wait(timeout=30)
+    finally:
+        if process.poll() is None:
+            process.kill()
+    # first_paint_ms 从模块开始导入算起；wall_ms 还包括解释器启动
+    return wall_ms, {name: float(value) for name, value in phases.items()}
+
+
+def import_profile(env):
+    """用 -X importtime 导入程序模块，返回 (总耗时毫秒, [(累计毫秒, 模块名)], 启动时已导入的延迟模块)"""
+    code = ("import sys, NemoMark_Desktop; "
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], env=env, cwd=ROOT_DIR,
+                            capture_output=True, text=True, check=True)
+    eager = [name for name in result.stdout.strip().split(",") if name]
+    total_ms = None
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # 只统计 NemoMark_Desktop 直接导入的模块（缩进两级）
+        if name.startswith("   ") and not name.startswith("    "):
+            modules.append((int(cumulative) / 1000, name.strip()))
+        if name.strip() == "NemoMark_Desktop":
+            total_ms = int(cumulative) / 1000
+    modules.sort(reverse=True)
+    return total_ms, modules, eager
+
+
+def summarize(times):
+    return {"median": statistics.median(times) / 1000, "min": min(times) / 1000,
+            "runs": [t / 1000 for t in times]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=5, help="启动次数")
+    parser.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS, help="第一次绘制的预算（毫秒）")
+    parser.add_argument("--import-budget-ms", type=float, default=IMPORT_BUDGET_MS, help="导入模块的预算（毫秒）")
+    parser.add_argument("--output", help="结果JSON文件")
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix="nemomark-bench-home-")
+    env = child_env(home)
+    # 第一次启动会编译字节码、建立字体缓存，不计入结果
+    measure_startup(env)
+    wall_times = []
+    paint_times = []
+    for _ in range(args.repeat):
+        wall_ms, phases = measure_startup(env)
+        wall_times.append(wall_ms)
+        paint_times.append(phases["first_paint_ms"])
+    import_times = []
+    for _ in range(args.repeat):
+        total_ms, modules, eager = import_profile(env)
+        import_times.append(total_ms)
+
+    wall = statistics.median(wall_times)
+    imports = statistics.median(import_times)
+    print(f"进程启动到第一次绘制: 中位数 {wall:.1f} ms（预算 {args.budget_ms:.0f} ms）")
+    print(f"模块导入到第一次绘制: 中位数 {statistics.median(paint_times):.1f} ms")
+    print(f"导入 NemoMark_Desktop: 中位数 {imports:.1f} ms（预算 {args.import_budget_ms:.0f} ms）")
+    print("导入耗时最多的模块（-X importtime，累计）:")
+    for cumulative, name in modules[:10]:
+        print(f"  {cumulative:8.1f} ms  {name}")
+
+    failures = []
+    if wall > args.budget_ms:
+        failures.append(f"第一次绘制超出预算: {wall:.1f} ms > {args.budget_ms:.0f} ms")
+    if imports > args.import_budget_ms:
+        failures.append(f"导入耗时超出预算: {imports:.1f} ms > {args.import_budget_ms:.0f} ms")
+    if eager:
+        failures.append(f"启动时导入了应当延迟导入的模块: {', '.join(eager)}")
+
+    if args.output:
+        results = {
+            "meta": {
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "repeat": args.repeat,
+            },
+            "results": {
+                "startup.first_paint": summarize(wall_times),
+                "startup.first_paint_in_process": summarize(paint_times),
+                "startup.import": summarize(import_times),
+            },
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    for failure in failures:
+        print(failure)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
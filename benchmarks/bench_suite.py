@@ -0,0 +1,438 @@
+"""编辑器关键路径基准测试
+
+在生成的语料上测量：
+- MarkdownEditor.update_preview：在文档中间修改一行到预览更新完成
+- MarkdownEditor.update_toc：在文档中间插入一个标题后增量更新目录树
+- MarkdownEditor.jump_to_line：跳转到标题并把预览滚动到对应位置；预览没有滚动同步的对应关系，
+  或者跳转后预览顶部不是这个标题时报错
+- MarkdownEditor.load_file：打开文件到首次预览完成（大文件模式下到加载完成）
+- MarkdownEditor.save_file：修改后在后台保存，分别记录界面线程耗时和写入完成耗时
+- MarkdownNotebook.open_notebook：首次打开（没有索引）和再次打开，到索引刷新完成
+
+文档覆盖 1 KB 到 50 MB，内容分为标题多、表格多、代码多、中文多四类；
+笔记本覆盖 100 到 100k 个文件。生成的语料缓存在 --corpus-dir 中，重复运行时复用。
+
+用法:
+    python benchmarks/bench_suite.py run [--quick] [--output results.json] [--baseline baseline.json]
+    python benchmarks/bench_suite.py compare baseline.json results.json [--threshold 0.2]
+
+compare 模式下，中位数比基准慢超过 threshold（且绝对差值超过 --min-delta-ms）的项标记为退化，
+存在退化时返回值为 1。
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+DOCUMENT_KINDS = ("heading", "table", "code", "cjk")
+DOCUMENT_SIZES = (1 << 10, 100 << 10, 1 << 20, 10 << 20, 50 << 20)
+NOTEBOOK_SIZES = (100, 1000, 10000, 100000)
+QUICK_DOCUMENT_SIZES = (1 << 10, 100 << 10, 1 << 20)
+QUICK_NOTEBOOK_SIZES = (100, 1000)
+
+
+def format_size(size):
+    if size >= 1 << 20:
+        return f"{size >> 20}MB"
+    return f"{size >> 10}KB"
+
+
+def _heading_section(i):
+    return (f"# 第{i}章 Chapter {i}\n\n引言段落 {i}。\n\n"
+            f"## {i}.1 小节\n\n内容 {i}.1\n\n### {i}.1.1 细节\n\n内容 {i}.1.1\n\n"
+            f"## {i}.2 小节\n\n内容 {i}.2\n\n")
+
+
+def _table_section(i):
+    rows = "".join(f"| {i}-{r} | 名称{r} | {r * 3.5:.1f} | 说明文字 {r} |\n" for r in range(20))
+    return f"### 表 {i}\n\n| 编号 | 名称 | 数值 | 备注 |\n| --- | --- | --- | --- |\n{rows}\n"
+
+
+def _code_section(i):
+    body = "".join(f"    value_{j} = compute({i}, {j})  # 第{j}步\n" for j in range(15))
+    return f"#### 示例 {i}\n\n```python\ndef example_{i}():\n{body}    return value_0\n```\n\n"
+
+
+def _cjk_section(i):
+    return (f"## 第{i}节\n\n"
+            f"这是第{i}节的正文，主要用于测试中文排版和分词的性能。段落中包含**加粗**、*斜体*和`行内代码`，"
+            f"以及一个[链接](https://example.com/{i})。中文文本通常没有空格分隔，"
+            f"编辑器需要正确处理宽字符和换行。\n\n"
+            f"- 要点一：渲染速度\n- 要点二：目录更新\n- 要点三：保存与加载\n\n")
+
+
+SECTION_GENERATORS = {
+    "heading": _heading_section,
+    "table": _table_section,
+    "code": _code_section,
+    "cjk": _cjk_section,
+}
+
+
+def generate_document(kind, size_bytes):
+    """生成指定类型、约 size_bytes 字节的文档"""
+    section = SECTION_GENERATORS[kind]
+    parts = []
+    total = 0
+    i = 0
+    while total < size_bytes:
+        part = section(i)
+        parts.append(part)
+        total += len(part.encode("utf-8"))
+        i += 1
+    return "".join(parts)
+
+
+def document_path(corpus_dir, kind, size):
+    """返回生成的文档路径，不存在时生成"""
+    path = os.path.join(corpus_dir, "documents", f"{kind}-{format_size(size)}.md")
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(generate_document(kind, size))
+    return path
+
+
+def notebook_path(corpus_dir, file_count):
+    """返回生成的笔记本目录，每个子目录 500 个文件，不存在时生成"""
+    path = os.path.join(corpus_dir, "notebooks", f"notebook-{file_count}")
+    done_marker = os.path.join(path, ".complete")
+    if os.path.exists(done_marker):
+        return path
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    with open(os.path.join(path, "README.md"), "w", encoding="utf-8") as f:
+        f.write(f"# 基准测试笔记本\n\n共 {file_count} 个文件。\n")
+    for i in range(file_count - 1):
+        dir_path = os.path.join(path, f"dir{i // 500:04d}")
+        if i % 500 == 0:
+            os.makedirs(dir_path)
+        with open(os.path.join(dir_path, f"note{i:06d}.md"), "w", encoding="utf-8") as f:
+            f.write(_cjk_section(i))
+    open(done_marker, "w").close()
+    return path
+
+
+class Runner:
+    """运行基准测试并收集结果"""
+
+    def __init__(self, args):
+        # 使用独立的主目录，不读写用户的设置和笔记本索引
+        self.home = tempfile.mkdtemp(prefix="nemomark-bench-home-")
+        os.environ["HOME"] = self.home
+        os.environ["USERPROFILE"] = self.home
+
+        from PySide6.QtWidgets import QApplication
+        import NemoMark_Desktop as app_module
+        self.app_module = app_module
+        self.app = QApplication.instance() or QApplication(sys.argv)
+
+        self.args = args
+        self.corpus_dir = args.corpus_dir
+        self.results = {}
+
+    def record(self, name, times):
+        self.results[name] = {
+            "median": statistics.median(times),
+            "min": min(times),
+            "runs": times,
+        }
+        print(f"{name:<45} 中位数 {statistics.median(times) * 1000:10.2f} ms  最小 {min(times) * 1000:10.2f} ms",
+              flush=True)
+
+    def selected(self, name):
+        return not self.args.filter or any(pattern in name for pattern in self.args.filter)
+
+    def wait_until(self, predicate, timeout=600):
+        deadline = time.perf_counter() + timeout
+        while not predicate():
+            if time.perf_counter() > deadline:
+                raise TimeoutError("等待超时")
+            self.app.processEvents()
+            time.sleep(0.001)
+
+    def new_editor(self, file_path=None):
+        editor = self.app_module.MarkdownEditor(file_path)
+        editor.resize(1200, 800)
+        editor.show()
+        return editor
+
+    def close_editor(self, editor):
+        editor.cancel_load()
+        editor.wait_for_save()
+        self.wait_until(lambda: not editor._render_in_flight)
+        editor.close()
+        editor.deleteLater()
+        self.app.processEvents()
+
+    def render_idle(self, editor):
+        return not editor._render_in_flight and editor._pending_render is None
+
+    def run(self):
+        sizes = QUICK_DOCUMENT_SIZES if self.args.quick else DOCUMENT_SIZES
+        notebook_sizes = QUICK_NOTEBOOK_SIZES if self.args.quick else NOTEBOOK_SIZES
+        for kind in DOCUMENT_KINDS:
+            for size in sizes:
+                self.bench_document(kind, size)
+        for file_count in notebook_sizes:
+            self.bench_notebook(file_count)
+
+    def bench_document(self, kind, size):
+        label = f"{kind}/{format_size(size)}"
+        names = [f"{bench}/{label}" for bench in ("load_file", "update_preview", "update_toc", "save_file.ui",
+                                                  "save_file.total", "jump_to_line")]
+        if not any(self.selected(name) for name in names):
+            return
+        source = document_path(self.corpus_dir, kind, size)
+        work_dir = tempfile.mkdtemp(prefix="nemomark-bench-")
+        file_path = os.path.join(work_dir, os.path.basename(source))
+        shutil.copyfile(source, file_path)
+        try:
+            if self.selected(names[0]):
+                self.bench_load_file(names[0], file_path)
+            if not any(self.selected(name) for name in names[1:]):
+                return
+            editor = self.new_editor(file_path)
+            try:
+                # 加载完成后开启预览（大文件模式默认不渲染预览）
+                self.wait_until(lambda: not editor._loading)
+                if editor._preview_deferred:
+                    editor.enable_preview()
+                self.wait_until(lambda: self.render_idle(editor))
+                if self.selected(names[1]):
+                    self.bench_update_preview(names[1], editor)
+                if self.selected(names[5]):
+                    self.bench_jump_to_line(names[5], editor)
+                if self.selected(names[2]):
+                    self.bench_update_toc(names[2], editor)
+                if self.selected(names[3]) or self.selected(names[4]):
+                    self.bench_save_file(names[3], names[4], editor)
+            finally:
+                self.close_editor(editor)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def bench_load_file(self, name, file_path):
+        times = []
+        for _ in range(self.args.repeat):
+            editor = self.new_editor()
+            editor.file_path = file_path
+            start = time.perf_counter()
+            editor.load_file()
+            self.wait_until(lambda: not editor._loading and self.render_idle(editor))
+            times.append(time.perf_counter() - start)
+            self.close_editor(editor)
+        self.record(name, times)
+
+    def _middle_cursor(self, editor):
+        from PySide6.QtGui import QTextCursor
+        document = editor.editor.document()
+        cursor = QTextCursor(document.findBlockByNumber(document.blockCount() // 2))
+        cursor.movePosition(QTextCursor.MoveOperation.EndOfBlock)
+        return cursor
+
+    def bench_update_preview(self, name, editor):
+        # 第一次编辑包含预览排版的预热开销，不计入结果
+        times = []
+        for i in range(self.args.repeat + 1):
+            self._middle_cursor(editor).insertText(f" 编辑{i}")
+            start = time.perf_counter()
+            editor.update_preview()
+            self.wait_until(lambda: self.render_idle(editor))
+            self.app.processEvents()
+            times.append(time.perf_counter() - start)
+        self.record(name, times[1:])
+
+    def bench_jump_to_line(self, name, editor):
+        from PySide6.QtCore import QPoint
+        if editor.preview_updater.scroll_map is None:
+            raise RuntimeError(f"{name}: 预览没有滚动同步的对应关系")
+        lines = editor.editor.toPlainText().split("\n")
+        headings = [i for i, line in enumerate(lines) if line.startswith("#")]
+        del lines
+        if not headings:
+            return
+        times = []
+        for i in range(self.args.repeat):
+            line_num = headings[(i + 1) * len(headings) // (self.args.repeat + 1)]
+            start = time.perf_counter()
+            editor.jump_to_line(line_num)
+            self.app.processEvents()
+            times.append(time.perf_counter() - start)
+            scrollbar = editor.preview.verticalScrollBar()
+            if scrollbar.value() >= scrollbar.maximum():
+                # 预览已经滚到底，标题无法到达顶部
+                continue
+            top = editor.preview.cursorForPosition(QPoint(10, 10)).block().text()
+            expected = editor.editor.document().findBlockByNumber(line_num).text().lstrip("#").strip()
+            if top != expected:
+                raise RuntimeError(f"{name}: 跳转到 '{expected}' 后预览顶部是 '{top}'")
+        self.record(name, times)
+
+    def bench_update_toc(self, name, editor):
+        times = []
+        for i in range(self.args.repeat + 1):
+            self._middle_cursor(editor).insertText(f"\n\n## 新增标题 {i}\n")
+            text = editor.editor.toPlainText()
+            editor._rendered_hash = self.app_module.content_hash(text)
+            _, removed, inserted = editor.renderer.update(text)
+            start = time.perf_counter()
+            editor.update_toc(removed, inserted)
+            times.append(time.perf_counter() - start)
+        self.record(name, times[1:])
+
+    def bench_save_file(self, ui_name, total_name, editor):
+        ui_times = []
+        total_times = []
+        saved = []
+        editor.file_saved.connect(saved.append)
+        for i in range(self.args.repeat):
+            self._middle_cursor(editor).insertText(f" 保存{i}")
+            saved.clear()
+            start = time.perf_counter()
+            editor.save_file()
+            ui_times.append(time.perf_counter() - start)
+            self.wait_until(lambda: saved)
+            total_times.append(time.perf_counter() - start)
+        self.record(ui_name, ui_times)
+        self.record(total_name, total_times)
+
+    def bench_notebook(self, file_count):
+        names = [f"open_notebook.{mode}/{file_count}" for mode in ("cold", "warm")]
+        if not any(self.selected(name) for name in names):
+            return
+        path = notebook_path(self.corpus_dir, file_count)
+        index_dir = os.path.join(self.home, ".marknote", "indexes")
+        for name, cold in zip(names, (True, False)):
+            if not self.selected(name):
+                continue
+            times = []
+            # 再次打开的测试需要一次预热建立索引
+            runs = self.args.repeat if cold else self.args.repeat + 1
+            for _ in range(runs):
+                if cold:
+                    shutil.rmtree(index_dir, ignore_errors=True)
+                times.append(self.open_notebook_once(path))
+            self.record(name, times if cold else times[1:])
+
+    def open_notebook_once(self, path):
+        window = self.app_module.MarkdownNotebook()
+        refreshed = []
+        window._index_signals.finished.connect(lambda notebook, changes, full: refreshed.append(full))
+        start = time.perf_counter()
+        window.open_notebook(path)
+        self.wait_until(lambda: any(refreshed))
+        elapsed = time.perf_counter() - start
+        for i in range(window.tab_widget.count()):
+            editor = window.tab_widget.widget(i)
+            if isinstance(editor, self.app_module.MarkdownEditor):
+                self.wait_until(lambda: not editor._render_in_flight)
+        window.close()
+        window.deleteLater()
+        self.app.processEvents()
+        return elapsed
+
+    def output(self):
+        from PySide6 import __version__ as pyside_version
+        return {
+            "meta": {
+                "date": datetime.datetime.now().isoformat(timespec="seconds"),
+                "app_version": self.app_module.APP_VERSION,
+                "python": platform.python_version(),
+                "pyside": pyside_version,
+                "platform": platform.platform(),
+                "machine": platform.machine(),
+                "cpu_count": os.cpu_count(),
+                "repeat": self.args.repeat,
+            },
+            "results": self.results,
+        }
+
+    def cleanup(self):
+        shutil.rmtree(self.home, ignore_errors=True)
+
+
+def compare(baseline, current, threshold, min_delta):
+    """对比两次结果，返回退化的项目名列表"""
+    regressions = []
+    base_results = baseline["results"]
+    current_results = current["results"]
+    print(f"{'项目':<45} {'基准 ms':>12} {'当前 ms':>12} {'变化':>8}")
+    for name in sorted(base_results.keys() | current_results.keys()):
+        if name not in current_results:
+            print(f"{name:<45} {base_results[name]['median'] * 1000:12.2f} {'-':>12}   (缺失)")
+            continue
+        if name not in base_results:
+            print(f"{name:<45} {'-':>12} {current_results[name]['median'] * 1000:12.2f}   (新增)")
+            continue
+        old = base_results[name]["median"]
+        new = current_results[name]["median"]
+        ratio = new / old if old > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold and new - old > min_delta:
+            flag = "  退化"
+            regressions.append(name)
+        elif ratio < 1 - threshold and old - new > min_delta:
+            flag = "  改进"
+        print(f"{name:<45} {old * 1000:12.2f} {new * 1000:12.2f} {(ratio - 1) * 100:+7.1f}%{flag}")
+    if regressions:
+        print(f"\n共 {len(regressions)} 项退化超过 {threshold * 100:.0f}%")
+    return regressions
+
+
+def load_results(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="运行基准测试")
+    run_parser.add_argument("--quick", action="store_true", help="只测试 1 MB 以内的文档和 1000 个文件以内的笔记本")
+    run_parser.add_argument("--repeat", type=int, default=5, help="每项重复次数")
+    run_parser.add_argument("--filter", action="append", help="只运行名称包含该字符串的项目，可重复指定")
+    run_parser.add_argument("--corpus-dir", default=os.path.join(tempfile.gettempdir(), "nemomark-bench-corpus"),
+                            help="生成的语料目录，重复运行时复用")
+    run_parser.add_argument("--output", default="bench-results.json", help="结果JSON文件")
+    run_parser.add_argument("--baseline", help="运行后与该基准结果对比")
+
+    for p in (run_parser, subparsers.add_parser("compare", help="对比两个结果文件")):
+        p.add_argument("--threshold", type=float, default=0.2, help="判定退化的相对变化，默认 0.2 即慢 20%%")
+        p.add_argument("--min-delta-ms", type=float, default=1.0, help="绝对差值小于该值时不判定退化")
+    subparsers.choices["compare"].add_argument("baseline_file", help="基准结果")
+    subparsers.choices["compare"].add_argument("results_file", help="当前结果")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        regressions = compare(load_results(args.baseline_file), load_results(args.results_file),
+                              args.threshold, args.min_delta_ms / 1000)
+        return 1 if regressions else 0
+
+    runner = Runner(args)
+    try:
+        runner.run()
+    finally:
+        runner.cleanup()
+    results = runner.output()
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    if args.baseline:
+        regressions = compare(load_results(args.baseline), results, args.threshold, args.min_delta_ms / 1000)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+"""编辑日志重放检查
+
+在编辑器中打开文件，做随机编辑（含 emoji 等 BMP 以外的字符，QTextDocument 中占两个 UTF-16 码元），
+模拟异常退出后用 EditJournal.replay() 重放日志，与编辑器中的内容对比。
+每个文档分别在不压缩和频繁压缩（journal_compact_bytes 很小）两种设置下检查，
+最后一行写了一半时也要能恢复到前一条记录。
+
+不一致时打印文档和编辑，返回 1。
+
+用法: QT_QPA_PLATFORM=offscreen python benchmarks/check_edit_journal.py [--documents 50] [--edits 100] [--seed 0]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QTextCursor
+
+import NemoMark_Desktop as app_module
+
+DOCUMENTS = [
+    "# T 😀\n",
+    "# 标题\n\n中文段落，包含 emoji 😀🎉 和 𝒳 数学字母。\n\n- 列表 ✓\n",
+    "plain ascii text\n\nsecond paragraph\n",
+    "",
+]
+
+EDIT_TEXTS = ["a", "中", "😀", "🎉👍", "𝒳", "\n", "\n\n", "# ", "x😀y", "é"]
+
+
+def random_edit(rng, editor):
+    """插入、删除或替换，删除范围按字符选取，不会切开代理对"""
+    text = editor.toPlainText()
+    cursor = editor.textCursor()
+    start = rng.randint(0, len(text))
+    end = min(len(text), start + rng.choice((0, 0, 1, 2, 5)))
+    # QTextCursor 的位置按 UTF-16 码元计数
+    cursor.setPosition(len(text[:start].encode("utf-16-le")) // 2)
+    cursor.setPosition(len(text[:end].encode("utf-16-le")) // 2, QTextCursor.MoveMode.KeepAnchor)
+    inserted = rng.choice(EDIT_TEXTS) if rng.random() < 0.7 or start == end else ""
+    cursor.insertText(inserted)
+    return f"{start}..{end} -> {inserted!r}"
+
+
+def check(app, work_dir, text, rng, edits, compact_bytes):
+    """编辑一个文档并重放日志，返回是否一致"""
+    app_module._settings['journal_compact_bytes'] = compact_bytes
+    path = os.path.join(work_dir, "doc.md")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    editor = app_module.MarkdownEditor(path)
+    editor.render_scheduler.render_requested.disconnect()
+    editor.load_file()
+    app.processEvents()
+    history = []
+    try:
+        for _ in range(edits):
+            history.append(random_edit(rng, editor.editor))
+        journal_path = editor.journal.path
+        expected = editor.editor.toPlainText()
+        # 模拟异常退出：释放日志文件的锁，不保存、不删除日志
+        editor.journal.close()
+        _, recovered = app_module.EditJournal.replay(journal_path)
+        ok = recovered == expected
+        if ok:
+            # 最后一行写了一半时忽略它
+            with open(journal_path, "a", encoding="utf-8") as f:
+                f.write('[0, 0, "😀')
+            ok = app_module.EditJournal.replay(journal_path)[1] == expected
+        if not ok:
+            print(f"重放结果不一致（journal_compact_bytes={compact_bytes}）")
+            print(f"初始文档: {text!r}\n编辑: {history}\n期望: {expected!r}\n重放: {recovered!r}\n")
+        return ok
+    finally:
+        editor.journal = None
+        editor.close()
+        editor.deleteLater()
+        app.processEvents()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=50, help="随机文档数")
+    parser.add_argument("--edits", type=int, default=100, help="每个文档的编辑次数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    args = parser.parse_args()
+
+    # 使用独立的主目录，不读写用户的编辑日志
+    home = tempfile.mkdtemp(prefix="nemomark-journal-home-")
+    os.environ["HOME"] = home
+    os.environ["USERPROFILE"] = home
+    app = QApplication.instance() or QApplication(sys.argv)
+    rng = random.Random(args.seed)
+    failures = 0
+    checks = 0
+    try:
+        for i in range(len(DOCUMENTS) + args.documents):
+            if i < len(DOCUMENTS):
+                text = DOCUMENTS[i]
+            else:
+                text = "".join(rng.choice(EDIT_TEXTS + ["text ", "段落"]) for _ in range(rng.randint(0, 200)))
+            for compact_bytes in (app_module.JOURNAL_COMPACT_BYTES, 64):
+                checks += 1
+                if not check(app, home, text, rng, args.edits, compact_bytes):
+                    failures += 1
+    finally:
+        shutil.rmtree(home, ignore_errors=True)
+    print(f"共检查 {checks} 次，不一致 {failures} 次")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""增量渲染一致性检查
+
+IncrementalMarkdownRenderer 按块渲染的结果必须与整篇转换逐字节一致。本脚本在
+固定语料和随机生成的文档上，通过编辑器的 QTextDocument 做随机编辑（与真实编辑一样经过
+contentsChange 记录变化范围），每批编辑后增量切分、按块渲染，与同一文档的整篇转换对比：
+- 不启用扩展时与 markdown.markdown(text) 对比
+- 启用默认扩展和代码块高亮时与 render_markdown(text) 对比
+
+不一致时打印文档和最后一次编辑，把文档写入 --failures-dir，返回 1。
+
+用法: QT_QPA_PLATFORM=offscreen python benchmarks/check_incremental_render.py [--documents 200] [--edits 20] [--seed 0]
+"""
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import markdown
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QTextCursor
+
+import NemoMark_Desktop as app_module
+
+# 容易切错块的写法：围栏、列表续行、懒惰续行、引用定义、setext 标题、原始HTML等
+CORPUS = {
+    "fence_in_list": "- item\n\n  ```\n  code\n\n  more\n  ```\n\n- next\n\nafter",
+    "unclosed_fence": "intro\n\n```python\nx = 1\n\n# not a heading\n\ny = 2",
+    "tilde_fence": "~~~\n```\n~~~\n\n```\n~~~\n```\n\ntext",
+    "fence_attrs": "``` { .python #id }\nprint(1)\n```\n\n```python hl_lines=\"1\"\nprint(2)\n```",
+    "indented_code": "para\n\n    code line\n\n    code after blank\n\ntext",
+    "list_indented_continuation": "1. one\n\n    continued\n\n2. two\n\n        nested code\n\nend",
+    "nested_quote": "> quote\n>\n> > nested\n\n> second\n\nlazy\ncontinuation",
+    "lazy_quote": "> quote line\ncontinued lazily\n\nnew para",
+    "references": "[a]: https://a.example\n\nSee [a] and [b][].\n\n[b]: https://b.example \"B\"\n\n[unused]",
+    "reference_after_list": "- item\n\n[ref]: https://example.com\n- still list?\n\n[ref]",
+    "setext": "Title\n=====\n\nSub\n---\n\n---\n\ntext\n***",
+    "duplicate_headings": "# Same\n\n## Same\n\n### Same\n\n# Same_1\n\n# Same",
+    "cjk_emoji": "# 标题 😀\n\n中文段落，**加粗** 和 `代码`。\n\n## 第二节 🎉\n\n- 列表 ✓\n- 项目",
+    "tables": "| a | b |\n| --- | --- |\n| 1 | 2 |\n\ntext\n\n| c |\n| - |\n| 3 |",
+    "html_block": "<div>\n\n*inside*\n\n</div>\n\nafter",
+    "html_inline": "text <span>inline</span>\n\n<!-- comment -->\n\nmore",
+    "whitespace": "\n\n   \n\t\n# Heading\n\n \n\npara  \nbreak\n\n",
+    "hard_tabs": "\tindented\n\n-\ttab item\n\n>\tquote",
+}
+
+PIECES = [
+    "# Heading {i}",
+    "## 第{i}节 Section",
+    "Setext {i}\n========",
+    "Paragraph {i} with **bold**, *em* and `code`.",
+    "Paragraph {i}\nwith a second line",
+    "中文段落 {i}，包含 emoji 😀 和 [链接](https://example.com/{i})。",
+    "- item {i}\n- item b\n  - nested",
+    "1. first {i}\n2. second",
+    "- item {i}\n\n  continued paragraph",
+    "> quote {i}\n> more",
+    "> quote {i}\nlazy continuation",
+    "```\ncode {i}\n\n# not heading\n```",
+    "```python\ndef f_{i}():\n    return {i}\n```",
+    "~~~\ntilde {i}\n~~~",
+    "```\nunclosed {i}",
+    "    indented code {i}",
+    "[r{i}]: https://example.com/{i}",
+    "See [r{i}] and [r{i}][].",
+    "| a | b |\n| --- | --- |\n| {i} | x |",
+    "---",
+    "***",
+    "<div>raw {i}</div>",
+    "text <b>inline {i}</b>",
+    "",
+    "   ",
+]
+
+EDIT_TEXTS = ["\n", "\n\n", " ", "    ", "#", "# ", "`", "```", "~~~", ">", "> ", "- ", "1. ", "[r1]", "[r1]: /x",
+              "x", "中", "😀", "|", "---", "=", "<div>"]
+
+
+def random_document(rng):
+    parts = [rng.choice(PIECES).format(i=rng.randint(0, 20)) for _ in range(rng.randint(1, 15))]
+    return "".join(part + rng.choice(("\n\n", "\n\n", "\n", "\n\n\n")) for part in parts)
+
+
+def random_edit(rng, document):
+    """在 QTextDocument 上做一次随机编辑，返回编辑的描述"""
+    length = document.characterCount() - 1
+    cursor = QTextCursor(document)
+    choice = rng.random()
+    if choice < 0.35:
+        position = rng.randint(0, length)
+        text = rng.choice(EDIT_TEXTS)
+        cursor.setPosition(position)
+        cursor.insertText(text)
+        return f"在 {position} 插入 {text!r}"
+    if choice < 0.55:
+        block = document.findBlockByNumber(rng.randrange(document.blockCount()))
+        text = rng.choice(PIECES).format(i=rng.randint(0, 20)) + "\n"
+        cursor.setPosition(block.position())
+        cursor.insertText(text)
+        return f"在第 {block.blockNumber()} 行前插入 {text!r}"
+    if choice < 0.85 and length:
+        start = rng.randint(0, length - 1)
+        end = min(length, start + rng.choice((1, 1, 2, 5, 20, 80)))
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.MoveMode.KeepAnchor)
+        removed = cursor.selectedText().replace("\u2029", "\n")
+        cursor.removeSelectedText()
+        return f"删除 {start}..{end} {removed!r}"
+    block = document.findBlockByNumber(rng.randrange(document.blockCount()))
+    text = rng.choice(PIECES).format(i=rng.randint(0, 20))
+    cursor.setPosition(block.position())
+    cursor.movePosition(QTextCursor.MoveOperation.EndOfBlock, QTextCursor.MoveMode.KeepAnchor)
+    cursor.insertText(text)
+    return f"第 {block.blockNumber()} 行替换为 {text!r}"
+
+
+class Checker:
+    def __init__(self, args):
+        self.args = args
+        self.editor = app_module.MarkdownEditor()
+        # 只检查切分和渲染，不启动后台渲染任务
+        self.editor.render_scheduler.render_requested.disconnect()
+        self.failures = 0
+        self.updates = 0
+
+    def reference(self, text):
+        """同一文档的整篇转换结果"""
+        if self.plain:
+            return markdown.markdown(text)
+        return app_module.render_markdown(text)
+
+    def compare(self, name, text, edit=None):
+        renderer = self.editor.renderer
+        renderer.update(text)
+        self.updates += 1
+        blocks = renderer.blocks
+        if "\n".join(block.text for block in blocks) != text:
+            return self.fail(name, text, edit, "切分后的块拼接起来与文档不一致")
+        html = renderer.render(renderer.snapshot())
+        expected = self.reference(text)
+        if html != expected:
+            return self.fail(name, text, edit, f"增量渲染:\n{html}\n整篇转换:\n{expected}")
+        return True
+
+    def fail(self, name, text, edit, detail):
+        self.failures += 1
+        print(f"[{self.label}] {name} 不一致" + (f"，最后一次编辑：{edit}" if edit else ""))
+        print(f"文档:\n{text!r}\n{detail}\n")
+        if self.args.failures_dir:
+            os.makedirs(self.args.failures_dir, exist_ok=True)
+            path = os.path.join(self.args.failures_dir, f"{self.label}-{name}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text)
+        return False
+
+    def check_document(self, name, text, rng):
+        """整篇切分后对比一次，再经过若干批随机编辑逐批对比"""
+        editor = self.editor.editor
+        editor.setPlainText(text)
+        self.editor.renderer.invalidate()
+        if not self.compare(name, editor.toPlainText()):
+            return
+        for _ in range(self.args.edits):
+            # 一批多次编辑后再更新，覆盖 note_change 合并变化范围的情况
+            edits = [random_edit(rng, editor.document()) for _ in range(rng.choice((1, 1, 1, 2, 3)))]
+            if not self.compare(name, editor.toPlainText(), "；".join(edits)):
+                return
+
+    def run(self, label, plain):
+        self.label = label
+        self.plain = plain
+        if plain:
+            app_module.markdown_renderer.configure([], {}, None)
+        else:
+            app_module.configure_markdown(app_module.MARKDOWN_EXTENSIONS, {})
+        rng = random.Random(self.args.seed)
+        for name, text in CORPUS.items():
+            self.check_document(name, text, rng)
+        for i in range(self.args.documents):
+            self.check_document(f"random{i}", random_document(rng), rng)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=200, help="随机文档数")
+    parser.add_argument("--edits", type=int, default=20, help="每个文档的随机编辑批数")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--failures-dir", help="保存不一致文档的目录")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    checker = Checker(args)
+    checker.run("plain", True)
+    checker.run("extensions", False)
+    print(f"共对比 {checker.updates} 次，不一致 {checker.failures} 次")
+    return 1 if checker.failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())